@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import json
+import multiprocessing as mp
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+from engine.bootstrap import build_target_match_config
+from engine.core.debug_renderer import PoolKey, TargetMatchConfig, TilePool, load_tile_pool, render_target_match_debug, tile_pool_key
+from engine.core.tracing import traced
+from engine.profiles.registry import load_profile, merge_profile
+
+
+# -----------------------------
+# Batch mode: many targets, one warm tile pool
+# -----------------------------
+# Manifest (JSON):
+#   {
+#     "output_dir": "output/batch",           # optional (default: <paths.output>/batch)
+#     "profile": {...},                       # optional overrides for every target
+#     "targets": [
+#       {"target": "data/orders/0001.jpg", "name": "0001", "profile": {"a4_match": {"pick_mode": "global"}}},
+#       "data/orders/0002.jpg",
+#       ...
+#     ]
+#   }
+# Tile features and atlases are loaded once per (tile_size, tile_blur) in the parent
+# process; forked workers inherit them copy-on-write (spawn workers load their own once).
+# One image + one stats record (stats.jsonl) per target.
+
+
+@dataclass
+class BatchJob:
+    name: str
+    cfg: TargetMatchConfig
+
+
+_POOLS: Dict[PoolKey, TilePool] = {}
+
+
+def _warm_pool(cfg: TargetMatchConfig, cache_dir: str) -> TilePool:
+    key = tile_pool_key(cfg)
+    pool = _POOLS.get(key)
+    if pool is None:
+        pool = load_tile_pool(cfg, cache_dir)
+        _POOLS[key] = pool
+    return pool
+
+
+def warm_pools(jobs: List[BatchJob], cache_dir: str) -> int:
+    """Load every pool the jobs need (once per library / tile size / blur); returns the pools held."""
+    for job in jobs:
+        _warm_pool(job.cfg, cache_dir)
+    return len(_POOLS)
+
+
+def _init_worker(jobs: List[BatchJob], cache_dir: str) -> None:
+    # no-op under fork (pools inherited); spawn workers warm up once here
+    warm_pools(jobs, cache_dir)
+
+
+def _render_job(job: BatchJob, cache_dir: str) -> Dict:
+    t0 = time.perf_counter()
+    record: Dict = {"name": job.name, "target": job.cfg.target_path, "output": job.cfg.out_path}
+    try:
+        stats, tracer = traced(render_target_match_debug, job.cfg, pool=_warm_pool(job.cfg, cache_dir))
+        record.update(ok=True, stats=stats, stages=tracer.totals(), counters=tracer.counters)
+    except Exception as e:
+        record.update(ok=False, error=f"{type(e).__name__}: {e}", traceback=traceback.format_exc())
+    record["latency_s"] = round(time.perf_counter() - t0, 3)
+    return record
+
+
+def render_jobs(jobs: List[BatchJob], cache_dir: str, workers: int, consume: Callable[[Dict], None]) -> None:
+    """Render jobs in-process (workers == 1) or on a fork/spawn process pool; consume() each record as it lands."""
+    if workers == 1:
+        for job in jobs:
+            consume(_render_job(job, cache_dir))
+        return
+    method = "fork" if "fork" in mp.get_all_start_methods() else "spawn"
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=mp.get_context(method),
+        initializer=_init_worker,
+        initargs=(jobs, cache_dir),
+    ) as ex:
+        futures = [ex.submit(_render_job, job, cache_dir) for job in jobs]
+        for fut in as_completed(futures):
+            consume(fut.result())
+
+
+def load_batch_manifest(manifest_path: str | Path) -> Dict:
+    data = json.loads(Path(manifest_path).read_text(encoding="utf-8"))
+    if isinstance(data, list):
+        data = {"targets": data}
+    if not isinstance(data.get("targets"), list) or not data["targets"]:
+        raise ValueError(f"Batch manifest has no targets: {manifest_path}")
+    return data
+
+
+def build_batch_jobs(config: dict, manifest: Dict) -> Tuple[List[BatchJob], Path]:
+    paths = config["paths"]
+    base = merge_profile(load_profile(config["engine"].get("profile", "")), manifest.get("profile"))
+    out_dir = Path(manifest.get("output_dir") or Path(paths.get("output", "output")) / "batch")
+
+    jobs: List[BatchJob] = []
+    seen: Dict[str, int] = {}
+    for i, entry in enumerate(manifest["targets"]):
+        if isinstance(entry, str):
+            entry = {"target": entry}
+        target = str(entry["target"])
+        name = str(entry.get("name") or Path(target).stem)
+        # keep outputs distinct when two targets share a stem
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}_{seen[name]}"
+        else:
+            seen[name] = 0
+        profile = merge_profile(base, entry.get("profile"))
+        out_path = entry.get("output") or str(out_dir / f"{name}.png")
+        jobs.append(BatchJob(name, build_target_match_config(profile, paths, target, out_path)))
+    return jobs, out_dir
+
+
+def run_batch(config: dict, manifest_path: str | Path, workers: int = 0) -> List[Dict]:
+    """
+    Render every target of the manifest with one warm tile pool.
+    workers: 0/1 = in-process, N = process pool of N, -1 = one per CPU.
+    """
+    jobs, out_dir = build_batch_jobs(config, load_batch_manifest(manifest_path))
+    out_dir.mkdir(parents=True, exist_ok=True)
+    cache_dir = str(Path(config["paths"].get("output", "output")))
+
+    print("=" * 50)
+    print(f"[BATCH] {len(jobs)} targets -> {out_dir}")
+
+    t0 = time.perf_counter()
+    print(f"[BATCH] tile pools warm: {warm_pools(jobs, cache_dir)} in {time.perf_counter() - t0:.2f}s")
+
+    workers = (os.cpu_count() or 1) if workers < 0 else int(workers)
+    workers = max(1, min(workers, len(jobs)))
+
+    records: List[Dict] = []
+    stats_file = out_dir / "stats.jsonl"
+    t_render = time.perf_counter()
+    with open(stats_file, "w", encoding="utf-8") as f:
+
+        def consume(record: Dict) -> None:
+            records.append(record)
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            status = "ok" if record["ok"] else f"FAILED ({record['error']})"
+            print(f"[BATCH] {len(records)}/{len(jobs)} {record['name']} {record['latency_s']:.2f}s {status}")
+
+        render_jobs(jobs, cache_dir, workers, consume)
+
+    wall = max(time.perf_counter() - t_render, 1e-9)
+    ok = [r for r in records if r["ok"]]
+    lat = sorted(r["latency_s"] for r in ok)
+    print("-" * 50)
+    print(
+        f"[BATCH] done {len(ok)}/{len(jobs)} in {wall:.2f}s workers={workers} "
+        f"throughput={len(ok) * 60.0 / wall:.1f} renders/min"
+    )
+    if lat:
+        print(f"[BATCH] latency s: min={lat[0]:.2f} median={lat[len(lat) // 2]:.2f} max={lat[-1]:.2f}")
+    print(f"[BATCH] stats -> {stats_file}")
+    return records
@@ -0,0 +1,421 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+import PIL
+from PIL import Image
+
+from engine.core.color_match import rgb_to_lab_batch
+from engine.core.debug_renderer import TargetMatchConfig, load_tile_pool, render_target_match_debug
+from engine.core.tile_index import IVFPQIndex, KDTreeIndex
+from engine.core.tracing import traced
+
+
+# -----------------------------
+# Benchmark suite (offline, synthetic data)
+# -----------------------------
+#   python -m engine.bench                                # default sizes / grids
+#   python -m engine.bench --sizes 100,1000 --grids 80x45 --update-baseline
+#   python -m engine.bench --baseline bench/baseline.json # exit 1 on regression
+#   python -m engine.bench --index --sizes 10000,1000000  # tile index recall vs latency
+# Tile libraries and targets are generated from a seed (same bytes every time) and
+# kept under the work dir. Per library: cold feature cache + atlas build. Per
+# (library, grid): the renderer's traced stages, best (min) of `repeat` warm runs --
+# scheduler / cache noise only ever adds time, so the min is the stable statistic to gate on.
+# Results are only compared with a baseline of the same version, tile size and distribution.
+# Cases that look slower are re-measured (--confirm rounds, min kept) before they count:
+# a regression has to survive every round, a burst of machine load does not.
+BENCH_VERSION = 2
+COMPARED_SETTINGS = ("tile_size", "dist")
+LIBRARY_SIZES = (100, 1000, 10000)
+GRIDS = ((40, 22), (80, 45), (160, 90))
+RENDER_STAGES = ("target_analysis", "focus_map", "matching", "compose", "blend", "encode")
+COLD_STAGES = ("feature_cache", "tile_load")
+INDEX_SIZES = (10000, 100000)
+INDEX_NPROBES = (1, 4, 8, 16, 32)
+
+
+# ---------- synthetic data ----------
+def _tile_colours(rng: np.random.Generator, n: int, dist: str) -> np.ndarray:
+    """Base RGB per tile: "uniform" over the cube or "clustered" around 12 photo-like hues."""
+    if dist == "uniform":
+        return rng.uniform(0, 255, (n, 3))
+    if dist == "clustered":
+        centers = rng.uniform(30, 225, (12, 3))
+        return np.clip(centers[rng.integers(0, 12, n)] + rng.normal(0, 18, (n, 3)), 0, 255)
+    raise ValueError(f"Unknown colour distribution: {dist}")
+
+
+def make_tile_library(root: Path, n: int, seed: int = 0, dist: str = "clustered", size: int = 64) -> Path:
+    """n JPEG tiles (flat colour + gradient + grain), generated once per (n, seed, dist, size)."""
+    out = root / f"tiles_{dist}_{n}_s{seed}_{size}px"
+    spec = {"version": BENCH_VERSION, "n": n, "seed": seed, "dist": dist, "size": size}
+    marker = out / ".complete"
+    if marker.exists() and json.loads(marker.read_text(encoding="utf-8")) == spec:
+        return out
+    shutil.rmtree(out, ignore_errors=True)
+    out.mkdir(parents=True)
+
+    rng = np.random.default_rng(seed)
+    colours = _tile_colours(rng, n, dist)
+    ramp = np.linspace(-1.0, 1.0, size, dtype=np.float32)
+    batch = 512
+    for b0 in range(0, n, batch):
+        b1 = min(n, b0 + batch)
+        m = b1 - b0
+        # per tile: a random-direction gradient (+-40 levels) and gaussian grain
+        ang = rng.uniform(0, 2 * np.pi, m).astype(np.float32)
+        grad = np.cos(ang)[:, None, None] * ramp[None, None, :] + np.sin(ang)[:, None, None] * ramp[None, :, None]
+        px = colours[b0:b1, None, None, :] + 40.0 * grad[..., None] + rng.normal(0, 12, (m, size, size, 3))
+        px = np.clip(px, 0, 255).astype(np.uint8)
+        for i in range(m):
+            Image.fromarray(px[i], mode="RGB").save(out / f"t{b0 + i:06d}.jpg", quality=88)
+    marker.write_text(json.dumps(spec), encoding="utf-8")
+    return out
+
+
+def make_target(root: Path, width: int = 1600, height: int = 1000, seed: int = 0) -> Path:
+    """Smooth synthetic portrait: low-frequency colour field + two bright elliptical 'faces'."""
+    path = root / f"target_{width}x{height}_s{seed}.png"
+    if path.exists():
+        return path
+    root.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed + 1)
+    yy, xx = np.mgrid[0:height, 0:width].astype(np.float32)
+    img = np.zeros((height, width, 3), dtype=np.float32) + 110.0
+    for _ in range(6):
+        fx, fy = rng.uniform(0.5, 3.0, 2) * 2 * np.pi
+        phase = rng.uniform(0, 2 * np.pi)
+        amp = rng.uniform(10, 35, 3)
+        img += amp * np.sin(fx * xx / width + fy * yy / height + phase)[..., None]
+    for cx, cy in ((0.40, 0.45), (0.62, 0.42)):
+        d = ((xx / width - cx) / 0.09) ** 2 + ((yy / height - cy) / 0.16) ** 2
+        img += np.array([95.0, 60.0, 40.0]) * np.exp(-d)[..., None]
+    Image.fromarray(np.clip(img, 0, 255).astype(np.uint8), mode="RGB").save(path)
+    return path
+
+
+# ---------- runs ----------
+def _config(lib: Path, target: Path, out_path: Path, grid: Tuple[int, int], tile_size: int) -> TargetMatchConfig:
+    # fixed settings: results must not move with profile tuning
+    return TargetMatchConfig(
+        raw_tiles_dir=str(lib),
+        target_path=str(target),
+        out_path=str(out_path),
+        grid_w=grid[0],
+        grid_h=grid[1],
+        tile_size=tile_size,
+        sample=350,
+        top_k=25,
+        seed=123,
+        cap_center=3,
+        feather=0.22,
+    )
+
+
+def _stage_ms(tracer, names: Sequence[str], prefix: str = "") -> Dict[str, float]:
+    totals = tracer.totals()
+    return {prefix + n: totals[n]["wall_ms"] for n in names if n in totals}
+
+
+def run_suite(
+    work: Path,
+    sizes: Sequence[int] = LIBRARY_SIZES,
+    grids: Sequence[Tuple[int, int]] = GRIDS,
+    tile_size: int = 32,
+    repeat: int = 5,
+    dist: str = "clustered",
+) -> Dict:
+    data = work / "data"
+    target = make_target(data)
+    cases: Dict[str, Dict[str, float]] = {}
+
+    for n in sizes:
+        t0 = time.perf_counter()
+        lib = make_tile_library(data, n, dist=dist)
+        print(f"[BENCH] library {lib.name} ready in {time.perf_counter() - t0:.1f}s")
+
+        cache = work / "cache" / lib.name
+        shutil.rmtree(cache, ignore_errors=True)
+        probe_cfg = _config(lib, target, work / "out" / "probe.png", grids[0] if grids else GRIDS[0], tile_size)
+        pool, tracer = traced(load_tile_pool, probe_cfg, cache)
+        cold = _stage_ms(tracer, COLD_STAGES, prefix="cold_")
+        cases[f"tiles{n}"] = cold
+        print(f"[BENCH] tiles{n} " + " ".join(f"{k}={v:.1f}ms" for k, v in cold.items()))
+
+        for gw, gh in grids:
+            key = f"tiles{n}_grid{gw}x{gh}"
+            cfg = _config(lib, target, work / "out" / f"{key}.png", (gw, gh), tile_size)
+            runs: Dict[str, List[float]] = {}
+            for _ in range(max(1, repeat)):
+                _, tracer = traced(render_target_match_debug, cfg, pool)
+                for stage_name, ms in _stage_ms(tracer, RENDER_STAGES).items():
+                    runs.setdefault(stage_name, []).append(ms)
+            cases[key] = {k: round(min(v), 3) for k, v in runs.items()}
+            print(f"[BENCH] {key} " + " ".join(f"{k}={v:.1f}ms" for k, v in cases[key].items()))
+
+    return {
+        "version": BENCH_VERSION,
+        "created_at": time.time(),
+        "machine": machine_info(),
+        "settings": {"sizes": list(sizes), "grids": [list(g) for g in grids], "tile_size": tile_size, "repeat": repeat, "dist": dist},
+        "cases": cases,
+    }
+
+
+# ---------- tile index: recall vs latency ----------
+def synthetic_features(n: int, seed: int = 0, dist: str = "clustered", grid: int = 3) -> Tuple[np.ndarray, np.ndarray]:
+    """Mean Labs (n,3) and float16 sub-cell descriptors (n, grid*grid*3) of make_tile_library-like tiles, no images."""
+    rng = np.random.default_rng(seed)
+    colours = _tile_colours(rng, n, dist)
+    ramp = (np.arange(grid, dtype=np.float32) + 0.5) / grid * 2.0 - 1.0
+    ang = rng.uniform(0, 2 * np.pi, n).astype(np.float32)
+    grad = np.cos(ang)[:, None, None] * ramp[None, None, :] + np.sin(ang)[:, None, None] * ramp[None, :, None]
+    px = colours[:, None, None, :] + 40.0 * grad[..., None] + rng.normal(0, 3, (n, grid, grid, 3))
+    px = np.clip(px, 0, 255).astype(np.uint8)
+    desc = rgb_to_lab_batch(px.reshape(-1, 3)).reshape(n, -1).astype(np.float16)
+    labs = rgb_to_lab_batch(np.clip(px.reshape(n, -1, 3).mean(axis=1).round(), 0, 255).astype(np.uint8))
+    return np.ascontiguousarray(labs, dtype=np.float32), desc
+
+
+def _us_per_query(fn, queries: np.ndarray) -> float:
+    t0 = time.perf_counter()
+    for q in queries:
+        fn(q)
+    return round((time.perf_counter() - t0) / max(1, len(queries)) * 1e6, 1)
+
+
+def index_report(
+    sizes: Sequence[int] = INDEX_SIZES,
+    queries: int = 200,
+    nprobes: Sequence[int] = INDEX_NPROBES,
+    refine: int = 64,
+    dist: str = "clustered",
+    grid: int = 3,
+) -> Dict:
+    """
+    Per library size: exact KD-tree vs brute force on Lab (with A3-like penalties and 30% capped
+    tiles excluded), IVF-PQ recall@1 / recall@10 vs latency on sub-cell descriptors per nprobe.
+    """
+    cases: Dict[str, Dict] = {}
+    for n in sizes:
+        labs, desc = synthetic_features(n, seed=0, dist=dist, grid=grid)
+        q_labs, q_desc = synthetic_features(queries, seed=1, dist=dist, grid=grid)
+        rng = np.random.default_rng(2)
+        counts = rng.integers(0, 4, n)
+        penalty = 1.0 + (1.0 - np.exp(-1.30 * counts))
+        capped = counts >= 3
+
+        t0 = time.perf_counter()
+        kd = KDTreeIndex.build(labs)
+        kd_build = time.perf_counter() - t0
+        ex = kd.exclusion(capped)
+        allowed = np.flatnonzero(~capped)
+
+        def brute_lab(q: np.ndarray) -> int:
+            diff = labs[allowed] - q.astype(np.float64)
+            d = np.sqrt(diff[:, 0] ** 2 + diff[:, 1] ** 2 + diff[:, 2] ** 2) * penalty[allowed]
+            return int(allowed[int(np.argmin(d))])
+
+        exact = sum(int(kd.query(q, 1, penalty, ex)[0][0]) == brute_lab(q) for q in q_labs)
+        lab_case = {
+            "build_s": round(kd_build, 3),
+            "brute_us": _us_per_query(brute_lab, q_labs),
+            "kdtree_us": _us_per_query(lambda q: kd.query(q, 1, penalty, ex), q_labs),
+            "recall_at_1": round(exact / len(q_labs), 4),
+        }
+        cases[f"lab_tiles{n}"] = lab_case
+        print(f"[BENCH] index lab tiles{n} " + " ".join(f"{k}={v}" for k, v in lab_case.items()))
+
+        x = desc.astype(np.float32)
+        qx = q_desc.astype(np.float32)
+        t0 = time.perf_counter()
+        ivf = IVFPQIndex.train(desc, m=grid * grid)
+        ivf_train = time.perf_counter() - t0
+
+        def brute_desc(q: np.ndarray) -> np.ndarray:
+            d = ((x - q) ** 2).sum(axis=1)
+            d[capped] = np.inf
+            return np.argsort(d, kind="stable")[:10]
+
+        truth = [brute_desc(q) for q in qx]
+        sub_case: Dict = {"train_s": round(ivf_train, 3), "nlist": ivf.nlist, "brute_us": _us_per_query(brute_desc, qx)}
+        for nprobe in nprobes:
+
+            def ann(q: np.ndarray) -> np.ndarray:
+                cand = ivf.search(q, refine, nprobe, capped)
+                return cand[np.argsort(((x[cand] - q) ** 2).sum(axis=1), kind="stable")[:10]]
+
+            got = [ann(q) for q in qx]
+            sub_case[f"nprobe{nprobe}"] = {
+                "us": _us_per_query(ann, qx),
+                "recall_at_1": round(float(np.mean([g.size > 0 and g[0] == t[0] for g, t in zip(got, truth)])), 4),
+                "recall_at_10": round(float(np.mean([len(set(g.tolist()) & set(t.tolist())) / 10 for g, t in zip(got, truth)])), 4),
+            }
+            print(f"[BENCH] index sub{grid} tiles{n} nprobe={nprobe} " + " ".join(f"{k}={v}" for k, v in sub_case[f"nprobe{nprobe}"].items()))
+        cases[f"sub{grid}_tiles{n}"] = sub_case
+        print(f"[BENCH] index sub{grid} tiles{n} train_s={sub_case['train_s']} nlist={ivf.nlist} brute_us={sub_case['brute_us']}")
+
+    return {
+        "version": BENCH_VERSION,
+        "created_at": time.time(),
+        "machine": machine_info(),
+        "settings": {"sizes": list(sizes), "queries": queries, "nprobes": list(nprobes), "refine": refine, "dist": dist, "grid": grid},
+        "cases": cases,
+    }
+
+
+def machine_info() -> Dict[str, str]:
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pillow": PIL.__version__,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": str(os.cpu_count()),
+    }
+
+
+# ---------- baselines ----------
+def settings_mismatch(results: Dict, baseline: Dict) -> List[str]:
+    """Settings that make results and baseline incomparable (empty: ok to compare)."""
+    out = []
+    if baseline.get("version") != results.get("version"):
+        out.append(f"version: {baseline.get('version')} -> {results.get('version')}")
+    for k in COMPARED_SETTINGS:
+        ref, got = baseline.get("settings", {}).get(k), results["settings"].get(k)
+        if ref != got:
+            out.append(f"{k}: {ref} -> {got}")
+    return out
+
+
+def compare(results: Dict, baseline: Dict, threshold: float = 0.25, min_ms: float = 10.0) -> List[str]:
+    """Stages slower than baseline * (1 + threshold) and by more than min_ms (noise floor)."""
+    regressions = []
+    for case, stages in results["cases"].items():
+        base = baseline.get("cases", {}).get(case)
+        if base is None:
+            continue
+        for stage_name, ms in stages.items():
+            ref = base.get(stage_name)
+            if ref is None:
+                continue
+            if ms > ref * (1.0 + threshold) and ms - ref > min_ms:
+                regressions.append(f"{case}/{stage_name}: {ms:.1f}ms vs baseline {ref:.1f}ms (+{(ms / max(ref, 1e-9) - 1) * 100:.0f}%)")
+    return regressions
+
+
+def _flagged_cases(regressions: Sequence[str]) -> List[Tuple[int, Tuple[int, int] | None]]:
+    """(library size, grid or None for the cold case) of every case named in compare() output."""
+    out: List[Tuple[int, Tuple[int, int] | None]] = []
+    for line in regressions:
+        case = line.split("/", 1)[0]
+        size, _, grid = case[len("tiles"):].partition("_grid")
+        item = (int(size), _parse_grids(grid)[0] if grid else None)
+        if item not in out:
+            out.append(item)
+    return out
+
+
+def _keep_min(results: Dict, again: Dict) -> None:
+    for case, stages in again["cases"].items():
+        kept = results["cases"].setdefault(case, {})
+        for stage_name, ms in stages.items():
+            kept[stage_name] = min(kept.get(stage_name, ms), ms)
+
+
+def _parse_grids(text: str) -> List[Tuple[int, int]]:
+    out = []
+    for part in text.split(","):
+        w, h = part.lower().split("x")
+        out.append((int(w), int(h)))
+    return out
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m engine.bench", description="ZEN'KO pipeline benchmark (synthetic, offline)")
+    parser.add_argument("--sizes", default=",".join(map(str, LIBRARY_SIZES)), help="tile library sizes, e.g. 100,1000,10000,100000")
+    parser.add_argument("--grids", default=",".join(f"{w}x{h}" for w, h in GRIDS), help="grid sizes, e.g. 40x22,80x45")
+    parser.add_argument("--tile-size", type=int, default=32)
+    parser.add_argument("--repeat", type=int, default=5, help="warm renders per case (min is kept)")
+    parser.add_argument("--dist", default="clustered", choices=("clustered", "uniform"))
+    parser.add_argument("--work", default="output/bench", help="synthetic data, caches and results")
+    parser.add_argument("--baseline", default=None, help="baseline JSON (default: <work>/baseline.json)")
+    parser.add_argument("--update-baseline", action="store_true", help="write these results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown per stage (0.25 = +25%%)")
+    parser.add_argument("--min-ms", type=float, default=10.0, help="ignore slowdowns smaller than this")
+    parser.add_argument("--confirm", type=int, default=2, help="re-measure slow cases this many times before reporting them")
+    parser.add_argument("--index", action="store_true", help="tile index recall vs latency report instead of the pipeline suite")
+    parser.add_argument("--queries", type=int, default=200, help="--index: queries per library size")
+    args = parser.parse_args(argv)
+
+    work = Path(args.work)
+    if args.index:
+        sizes = [int(s) for s in args.sizes.split(",") if s] if args.sizes != parser.get_default("sizes") else list(INDEX_SIZES)
+        report = index_report(sizes, queries=args.queries, dist=args.dist)
+        work.mkdir(parents=True, exist_ok=True)
+        report_path = work / "index_report.json"
+        report_path.write_text(json.dumps(report, indent=1), encoding="utf-8")
+        print(f"[BENCH] index report -> {report_path}")
+        return 0
+
+    baseline_path = Path(args.baseline) if args.baseline else work / "baseline.json"
+    baseline = None
+    if not args.update_baseline and baseline_path.exists():
+        baseline = json.loads(baseline_path.read_text(encoding="utf-8"))
+        planned = {"version": BENCH_VERSION, "settings": {"tile_size": args.tile_size, "dist": args.dist}}
+        mismatch = settings_mismatch(planned, baseline)
+        if mismatch:
+            print(f"[BENCH] not comparable with {baseline_path}: " + ", ".join(mismatch))
+            print("[BENCH] re-run with the baseline's settings, or record a new one with --update-baseline")
+            return 2
+    results = run_suite(
+        work,
+        sizes=[int(s) for s in args.sizes.split(",") if s],
+        grids=_parse_grids(args.grids),
+        tile_size=args.tile_size,
+        repeat=args.repeat,
+        dist=args.dist,
+    )
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold, args.min_ms)
+        for attempt in range(max(0, args.confirm)):
+            if not regressions:
+                break
+            print(f"[BENCH] {len(regressions)} slow stage(s), re-measuring ({attempt + 1}/{args.confirm})")
+            for n, grid in _flagged_cases(regressions):
+                again = run_suite(work, sizes=[n], grids=[grid] if grid else [], tile_size=args.tile_size, repeat=args.repeat, dist=args.dist)
+                _keep_min(results, again)
+            regressions = compare(results, baseline, args.threshold, args.min_ms)
+    results_path = work / "results.json"
+    results_path.write_text(json.dumps(results, indent=1), encoding="utf-8")
+    print(f"[BENCH] results -> {results_path}")
+
+    if args.update_baseline:
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        baseline_path.write_text(json.dumps(results, indent=1), encoding="utf-8")
+        print(f"[BENCH] baseline updated -> {baseline_path}")
+        return 0
+    if baseline is None:
+        print(f"[BENCH] no baseline at {baseline_path} (run with --update-baseline to create one)")
+        return 0
+
+    if baseline.get("machine") != results["machine"]:
+        print("[BENCH] warning: baseline was recorded on a different machine / library versions")
+    for line in regressions:
+        print(f"[BENCH] REGRESSION {line}")
+    print(f"[BENCH] {len(regressions)} regression(s) vs {baseline_path} (threshold +{args.threshold * 100:.0f}%, min {args.min_ms}ms)")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
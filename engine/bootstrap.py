@@ -1,19 +1,124 @@
-import math
 import random
 from pathlib import Path
 
 from engine.profiles.registry import load_profile
 from engine.core.a3_probe import run_a3_probe
+from engine.core.a3_sampler import A3Sampler
 from engine.core.a3_viz import render_a3_ascii_map
 from engine.core.debug_renderer import TargetMatchConfig, render_target_match_debug
+from engine.core.focus_map import get_focus_map
+from engine.core.placement_grid import PlacementGrid
+from engine.core.tracing import Tracer, stage, tracing
+from engine.io.decode import format_decode_stats
 
 
-def run(config: dict):
+def build_target_match_config(profile: dict, paths: dict, target_path: str, out_path: str) -> TargetMatchConfig:
+    """A4 render settings for one target, from a (possibly merged) profile."""
+    output = profile["output"]
+    tiles_cfg = profile["tiles"]
+    blend_cfg = profile["blend"]
+    a3 = profile.get("a3_diversity", {})
+    a4_match = profile.get("a4_match", {})
+    a4_blend = profile.get("a4_blend", {})
+    render = profile.get("render", {})
+    ingest = profile.get("ingest", {})
+
+    tile_size = int(tiles_cfg["size"])
+    cap = int(a3.get("cap_override", a3.get("cap", 0)))
+
+    return TargetMatchConfig(
+        raw_tiles_dir=str(paths.get("raw_tiles", "data/raw_tiles")),
+        target_path=str(target_path),
+        out_path=str(out_path),
+        grid_w=output["width"] // tile_size,
+        grid_h=output["height"] // tile_size,
+        tile_size=tile_size,
+        tile_blur=int(a4_match.get("tile_blur", 0)),
+        sample=int(a4_match.get("sample", 350)),
+        top_k=int(a4_match.get("top_k", 25)),
+        pick_mode=str(a4_match.get("pick_mode", "best")),
+        placement_workers=int(a4_match.get("placement_workers", 0)),
+        placement_bands=int(a4_match.get("placement_bands", 32)),
+        subcell_grid=int(a4_match.get("subcell_grid", 0)),
+        subcell_scope=str(a4_match.get("subcell_scope", "focus")),
+        subcell_pca=int(a4_match.get("subcell_pca", 0)),
+        tile_index=str(a4_match.get("tile_index", "auto")),
+        index_min_tiles=int(a4_match.get("index_min_tiles", 50000)),
+        subcell_index=str(a4_match.get("subcell_index", "exact")),
+        ivf_nprobe=int(a4_match.get("ivf_nprobe", 16)),
+        ivf_refine=int(a4_match.get("ivf_refine", 64)),
+        seed=int(tiles_cfg.get("seed", 123)),
+        a3_enable=bool(a3.get("enable", True)),
+        k_center=float(a3.get("k_center", 1.30)),
+        k_edge=float(a3.get("k_edge", 0.05)),
+        cap_center=int(a4_match.get("cap_center", cap if cap > 0 else 3)),
+        alpha_center=float(a4_blend.get("alpha_center", 0.70)),
+        alpha_edge=float(a4_blend.get("alpha_edge", 0.12)),
+        ellipse_rx=float(blend_cfg.get("ellipse_rx", 0.38)),
+        ellipse_ry=float(blend_cfg.get("ellipse_ry", 0.55)),
+        feather=float(blend_cfg.get("feather", 0.0)),
+        center_x=float(blend_cfg.get("center_x", 0.50)),
+        center_y=float(blend_cfg.get("center_y", 0.45)),
+        foci=a4_match.get("foci"),
+        ingest_workers=int(ingest.get("workers", 0)),
+        ingest_chunk=int(ingest.get("chunk_size", 64)),
+        dedupe_bits=int(ingest.get("dedupe_bits", -1)),
+        atlas_mips=bool(render.get("atlas_mips", False)),
+        stream=bool(render.get("stream", False)),
+        memory_budget_mb=int(render.get("memory_budget_mb", 512)),
+        png_compress_level=int(render.get("png_compress_level", 6)),
+        dzi=bool(render.get("dzi", False)),
+        dzi_tile_size=int(render.get("dzi_tile_size", 254)),
+        dzi_format=str(render.get("dzi_format", "jpg")),
+        dzi_workers=int(render.get("dzi_workers", 0)),
+        stage_cache=bool(render.get("stage_cache", True)),
+        stage_cache_mb=int(render.get("stage_cache_mb", 1024)),
+        save_placement=bool(render.get("save_placement", False)),
+        atlas_mode=str(render.get("atlas_mode", "packed")),
+        prefetch_workers=int(render.get("prefetch_workers", 4)),
+        prefetch_depth=int(render.get("prefetch_depth", 256)),
+    )
+
+
+def default_target_path(paths: dict) -> str:
+    target_path = str(paths.get("target", "data/target/target.jpg"))
+    if not Path(target_path).exists():
+        # fallback to png if jpg absent
+        if Path("data/target/target.png").exists():
+            target_path = "data/target/target.png"
+    return target_path
+
+
+def run(config: dict, trace_path: str | None = None, profile: bool = False) -> dict:
+    """
+    Run the pipeline under a Tracer: per-stage wall/CPU/peak RSS and cache counters go to
+    <output>/run_report.json, and to a Chrome trace when trace_path is set.
+    profile=True also runs the hot stages (matching, blend) under cProfile.
+    """
+    tracer = Tracer(profile=profile)
+    with tracing(tracer):
+        stats = _run(config)
+
+    report = tracer.write_report(
+        Path(config["paths"].get("output", "output")) / "run_report.json",
+        engine=config["engine"],
+        render_stats=stats,
+    )
+    for line in tracer.format_summary():
+        print(line)
+    if trace_path:
+        print(f"[TRACE] chrome trace -> {tracer.write_chrome_trace(trace_path)}")
+    print(f"[TRACE] run report -> {report}")
+    return stats
+
+
+def _run(config: dict) -> dict:
     engine = config["engine"]
     paths = config["paths"]
 
     profile_name = engine.get("profile", "")
-    profile = load_profile(profile_name)
+    with stage("profile_load"):
+        profile = load_profile(profile_name)
 
     print("=" * 50)
     print(f"Starting {engine['name']}")
@@ -56,7 +161,8 @@ def run(config: dict):
         return files
 
     raw_tiles_dir = str(paths.get("raw_tiles", "data/raw_tiles"))
-    tile_ids = list_tile_ids(raw_tiles_dir)
+    with stage("tile_listing"):
+        tile_ids = list_tile_ids(raw_tiles_dir)
 
     if tile_ids:
         max_tiles = int(tiles_cfg.get("max", len(tile_ids)))
@@ -81,66 +187,32 @@ def run(config: dict):
 
     rng = random.Random(int(tiles_cfg.get("seed", 123)))
 
-    def in_ellipse_cell(r: int, c: int) -> bool:
-        nx = ((c + 0.5) / grid_w) * 2.0 - 1.0
-        ny = ((r + 0.5) / grid_h) * 2.0 - 1.0
-        return (nx * nx) / (blend_cfg["ellipse_rx"] ** 2) + (ny * ny) / (blend_cfg["ellipse_ry"] ** 2) <= 1.0
-
-    center_mask = [[in_ellipse_cell(r, c) for c in range(grid_w)] for r in range(grid_h)]
-
-    center_counts = {}
-    global_counts = {}
-    cap_fallbacks = 0
-
-    def weighted_pick(is_center: bool) -> str:
-        nonlocal cap_fallbacks
-        k = k_center if is_center else k_edge
-
-        weights = []
-        total_w = 0.0
-        for tid in fake_tiles:
-            cc = center_counts.get(tid, 0)
-
-            if is_center and cap > 0 and cc >= cap:
-                w = 0.0
-            else:
-                w = math.exp(-k * cc) if a3_enable else 1.0
-
-            weights.append(w)
-            total_w += w
-
-        if total_w <= 0.0:
-            cap_fallbacks += 1
-            min_cc = min(center_counts.get(t, 0) for t in fake_tiles)
-            candidates = [t for t in fake_tiles if center_counts.get(t, 0) == min_cc]
-            return rng.choice(candidates)
-
-        x = rng.random() * total_w
-        acc = 0.0
-        for tid, w in zip(fake_tiles, weights):
-            acc += w
-            if acc >= x:
-                return tid
-        return fake_tiles[-1]
-
-    placements = []
-    for r in range(grid_h):
-        for c in range(grid_w):
-            is_center = center_mask[r][c]
-            tid = weighted_pick(is_center)
-            placements.append((r, c, tid))
-
-            global_counts[tid] = global_counts.get(tid, 0) + 1
-            if is_center:
-                center_counts[tid] = center_counts.get(tid, 0) + 1
-
-    top = sorted(center_counts.items(), key=lambda kv: kv[1], reverse=True)[:10]
-    max_rep = top[0][1] if top else 0
-    print("[B1DBG] Top center repeats:", top)
-    print(f"[B1DBG] max_center_repeat={max_rep} (target <= {cap}) cap_fallbacks={cap_fallbacks}")
+    # A3 simulation uses the profile ellipse centered on the frame
+    center_mask = get_focus_map(
+        output["width"],
+        output["height"],
+        tile_size,
+        [(0.5, 0.5, float(blend_cfg["ellipse_rx"]), float(blend_cfg["ellipse_ry"]))],
+    ).center_mask
+
+    # O(log N) weighted picks (sum tree over exp(-k*count) weights, hard cap, least-used fallback)
+    sampler = A3Sampler(len(fake_tiles), rng, a3_enable=a3_enable, k_center=k_center, k_edge=k_edge, cap=cap)
+
+    grid = PlacementGrid.empty(grid_w, grid_h, fake_tiles)
+    with stage("a3_simulation"):
+        for r in range(grid_h):
+            for c in range(grid_w):
+                is_center = bool(center_mask[r, c])
+                ti = sampler.pick(is_center)
+                sampler.commit(ti, is_center)
+                grid.tiles[r, c] = ti
+
+    b1 = grid.repeat_stats(center_mask)
+    print("[B1DBG] Top center repeats:", b1.top)
+    print(f"[B1DBG] max_center_repeat={b1.max_repeat} (target <= {cap}) cap_fallbacks={sampler.cap_fallbacks}")
 
     res = run_a3_probe(
-        placements=placements,
+        placements=grid,
         grid_w=grid_w,
         grid_h=grid_h,
         ellipse_rx=blend_cfg["ellipse_rx"],
@@ -152,7 +224,7 @@ def run(config: dict):
 
     # ASCII proof (optional)
     render_a3_ascii_map(
-        placements=placements,
+        placements=grid.cells(),
         grid_w=grid_w,
         grid_h=grid_h,
         ellipse_rx=blend_cfg["ellipse_rx"],
@@ -162,38 +234,59 @@ def run(config: dict):
     # --------------------------------------------------
     # A4 TARGET MATCH DEBUG (LAB + cache + portrait-first blend)
     # --------------------------------------------------
-    target_path = str(paths.get("target", "data/target/target.jpg"))
-    if not Path(target_path).exists():
-        # fallback to png if jpg absent
-        if Path("data/target/target.png").exists():
-            target_path = "data/target/target.png"
+    target_path = default_target_path(paths)
 
     out_path = str(Path(paths.get("output", "output")) / "mosaic_target_debug.png")
 
     print("[A4] Rendering target-match debug mosaic...")
-    stats = render_target_match_debug(
-        TargetMatchConfig(
-            raw_tiles_dir=raw_tiles_dir,
-            target_path=target_path,
-            out_path=out_path,
-            grid_w=grid_w,
-            grid_h=grid_h,
-            tile_size=tile_size,
-        tile_blur=int(profile.get("a4_match", {}).get("tile_blur", 0)),
-
-            sample=int(profile.get("a4_match", {}).get("sample", 350)),
-            top_k=int(profile.get("a4_match", {}).get("top_k", 25)),
-            seed=int(tiles_cfg.get("seed", 123)),
-            a3_enable=a3_enable,
-            k_center=k_center,
-            k_edge=k_edge,
-            cap_center=int(profile.get("a4_match", {}).get("cap_center", cap if cap > 0 else 3)),
-            alpha_center=float(profile.get("a4_blend", {}).get("alpha_center", 0.70)),
-            alpha_edge=float(profile.get("a4_blend", {}).get("alpha_edge", 0.12)),
-            ellipse_rx=float(blend_cfg.get("ellipse_rx", 0.38)),
-            ellipse_ry=float(blend_cfg.get("ellipse_ry", 0.55)),
-        )
-    )
+    with stage("render"):
+        stats = render_target_match_debug(build_target_match_config(profile, paths, target_path, out_path))
 
     print(f"[A4] Debug image saved -> {out_path}")
     print(f"[A4] tiles_pool={stats['tiles_pool']} max_center_repeat={stats['max_center_repeat']} cap_fallbacks={stats['cap_fallbacks']}")
+    print(f"[A4] center_unique={stats['center_unique']} center_dup_rate={stats['center_dup_rate']}")
+    print(
+        f"[A4] peak_rss_mb={stats['peak_rss_mb']}"
+        + (f" streamed strip_tile_rows={stats['strip_tile_rows']}" if "strip_tile_rows" in stats else "")
+    )
+    if stats.get("stage_cache_hits"):
+        print(f"[A4] stage cache: reused {stats['stage_cache_hits']}")
+    if "subcell_cells" in stats:
+        print(
+            f"[A4] sub-cell descriptors: cells={stats['subcell_cells']} dims={stats['subcell_dims']} "
+            f"ms={stats['subcell_ms']} rmse={stats['subcell_rmse']}"
+            + (f" index={stats['subcell_index']}" if "subcell_index" in stats else "")
+        )
+    if "dedupe_removed" in stats:
+        print(
+            f"[A4] near-duplicates: pool {stats['dedupe_pool_before']} -> {stats['tiles_pool']} "
+            f"(-{stats['dedupe_removed']} in {stats['dedupe_clusters']} clusters) "
+            f"matching saved ~{stats['dedupe_match_saved_ms']} ms"
+        )
+    if "prefetch_tiles" in stats:
+        print(
+            f"[A4] tile prefetch: tiles={stats['prefetch_tiles']} workers={stats['prefetch_workers']} "
+            f"depth={stats['prefetch_depth']} stalls={stats['prefetch_stalls']} stall_ms={stats['prefetch_stall_ms']} "
+            f"decode_ms={stats['prefetch_decode_ms']} peak_resident={stats['prefetch_peak_resident']}"
+        )
+    if "tile_index" in stats:
+        print(f"[A4] tile index: {stats['tile_index']} (exact, delta={stats['tile_index_delta']})")
+    if "placement_repairs" in stats:
+        print(
+            f"[A4] band placement: repairs={stats['placement_repairs']} ms={stats['placement_ms']} "
+            f"critical_ms={stats['placement_critical_ms']} cost={stats['greedy_cost']}"
+        )
+    if "dzi_levels" in stats:
+        print(
+            f"[A4] deep zoom: levels={stats['dzi_levels']} tiles_written={stats['dzi_tiles_written']} "
+            f"tiles_unchanged={stats['dzi_tiles_skipped']}"
+        )
+    if "assign_cost" in stats:
+        print(
+            f"[A4] global assignment: solve_ms={stats['assign_ms']} cost={stats['assign_cost']} "
+            f"lower_bound={stats['assign_lower_bound']} capacity={stats['assign_capacity']}"
+            + (f" greedy_cost={stats['greedy_cost']}" if "greedy_cost" in stats else "")
+        )
+    for line in format_decode_stats():
+        print(line)
+    return stats
@@ -1,6 +1,9 @@
 from __future__ import annotations
-from dataclasses import dataclass
-from typing import Iterable, Tuple
+from dataclasses import dataclass, field
+from typing import Iterable, List, Tuple
+
+from engine.core.focus_map import get_focus_map
+from engine.core.placement_grid import PlacementGrid
 
 
 @dataclass
@@ -8,32 +11,20 @@ class A3ProbeResult:
     center_total: int
     center_unique: int
     center_dup_rate: float
-
-
-def _in_ellipse(nx: float, ny: float, rx: float, ry: float) -> bool:
-    v = (nx * nx) / (rx * rx) + (ny * ny) / (ry * ry)
-    return v <= 1.0
+    center_max_repeat: int = 0
+    top_repeats: List[Tuple[str, int]] = field(default_factory=list)
 
 
 def run_a3_probe(
-    placements: Iterable[Tuple[int, int, str]],
+    placements: PlacementGrid | Iterable[Tuple[int, int, str]],
     grid_w: int,
     grid_h: int,
     ellipse_rx: float,
     ellipse_ry: float,
 ) -> A3ProbeResult:
-    center_ids = []
-
-    for r, c, tile_id in placements:
-        # Normalize cell center to [-1, 1] range
-        nx = ((c + 0.5) / grid_w) * 2.0 - 1.0
-        ny = ((r + 0.5) / grid_h) * 2.0 - 1.0
-
-        if _in_ellipse(nx, ny, ellipse_rx, ellipse_ry):
-            center_ids.append(tile_id)
-
-    total = len(center_ids)
-    unique = len(set(center_ids))
-    dup_rate = 0.0 if total == 0 else 1.0 - (unique / total)
+    # one cell per "pixel": the grid-level mask of a centered ellipse
+    center_mask = get_focus_map(grid_w, grid_h, 1, [(0.5, 0.5, ellipse_rx, ellipse_ry)]).center_mask
 
-    return A3ProbeResult(total, unique, dup_rate)
+    grid = placements if isinstance(placements, PlacementGrid) else PlacementGrid.from_tuples(placements, grid_w, grid_h)
+    st = grid.repeat_stats(center_mask)
+    return A3ProbeResult(st.total, st.unique, st.dup_rate, st.max_repeat, st.top)
@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import math
+import random
+from typing import Dict, List
+
+
+# -----------------------------
+# Sum tree over tile weights
+# -----------------------------
+class _SumTree:
+    """Complete binary tree of sums; set() recomputes the leaf-to-root path (no float drift)."""
+
+    def __init__(self, values: List[float]):
+        self.n = len(values)
+        size = 1
+        while size < max(1, self.n):
+            size *= 2
+        self.size = size
+        tree = [0.0] * (2 * size)
+        tree[size : size + self.n] = values
+        for i in range(size - 1, 0, -1):
+            tree[i] = tree[2 * i] + tree[2 * i + 1]
+        self.tree = tree
+
+    @property
+    def total(self) -> float:
+        return self.tree[1]
+
+    def set(self, i: int, value: float) -> None:
+        tree = self.tree
+        j = i + self.size
+        tree[j] = value
+        j //= 2
+        while j:
+            tree[j] = tree[2 * j] + tree[2 * j + 1]
+            j //= 2
+
+    def find(self, x: float) -> int:
+        """Smallest leaf i whose running sum reaches x (clamped to the last tile)."""
+        tree = self.tree
+        j = 1
+        while j < self.size:
+            left = tree[2 * j]
+            if left >= x:
+                j = 2 * j
+            else:
+                x -= left
+                j = 2 * j + 1
+        return min(j - self.size, self.n - 1)
+
+
+class _CountTree:
+    """Integer indicator tree: k-th member (in tile order) of one count level."""
+
+    def __init__(self, flags: List[int]):
+        self.n = len(flags)
+        size = 1
+        while size < max(1, self.n):
+            size *= 2
+        self.size = size
+        tree = [0] * (2 * size)
+        tree[size : size + self.n] = flags
+        for i in range(size - 1, 0, -1):
+            tree[i] = tree[2 * i] + tree[2 * i + 1]
+        self.tree = tree
+
+    def __len__(self) -> int:
+        return self.tree[1]
+
+    def add(self, i: int, delta: int) -> None:
+        j = i + self.size
+        while j:
+            self.tree[j] += delta
+            j //= 2
+
+    def __getitem__(self, k: int) -> int:
+        tree = self.tree
+        j = 1
+        while j < self.size:
+            if tree[2 * j] > k:
+                j = 2 * j
+            else:
+                k -= tree[2 * j]
+                j = 2 * j + 1
+        return j - self.size
+
+
+# -----------------------------
+# A3 weighted sampler (V0 simulation)
+# -----------------------------
+class A3Sampler:
+    """
+    Weighted tile picks for the A3 simulation in O(log N):
+      weight = exp(-k * center_count)  (1.0 when A3 is off)
+      center cells: weight 0 once center_count >= cap (hard cap B1)
+      all center tiles capped -> uniform pick among least-used tiles
+    Same RNG calls and same decisions as the former linear scan (weighted_pick in bootstrap).
+    """
+
+    def __init__(
+        self,
+        n_tiles: int,
+        rng: random.Random,
+        a3_enable: bool = True,
+        k_center: float = 1.30,
+        k_edge: float = 0.05,
+        cap: int = 0,
+    ):
+        if n_tiles <= 0:
+            raise ValueError("A3Sampler needs at least one tile")
+        self.n = int(n_tiles)
+        self.rng = rng
+        self.a3_enable = bool(a3_enable)
+        self.k_center = float(k_center)
+        self.k_edge = float(k_edge)
+        self.cap = int(cap)
+
+        self.counts: List[int] = [0] * self.n
+        self.cap_fallbacks = 0
+
+        self._center = _SumTree([self._weight(0, True)] * self.n)
+        self._edge = _SumTree([self._weight(0, False)] * self.n)
+
+        # tiles per center-count level; the minimum level only moves up
+        self._level_size: Dict[int, int] = {0: self.n}
+        self._min_level = 0
+        self._levels: Dict[int, _CountTree] = {}
+
+    def _weight(self, cc: int, is_center: bool) -> float:
+        if is_center and self.cap > 0 and cc >= self.cap:
+            return 0.0
+        if not self.a3_enable:
+            return 1.0
+        return math.exp(-(self.k_center if is_center else self.k_edge) * cc)
+
+    def _least_used(self) -> _CountTree:
+        level = self._min_level
+        tree = self._levels.get(level)
+        if tree is None:
+            tree = _CountTree([1 if cc == level else 0 for cc in self.counts])
+            self._levels[level] = tree
+        return tree
+
+    def pick(self, is_center: bool) -> int:
+        tree = self._center if is_center else self._edge
+        total_w = tree.total
+
+        if total_w <= 0.0:
+            self.cap_fallbacks += 1
+            # rng.choice(seq) == seq[randbelow(len(seq))]: k-th least-used tile in O(log N)
+            return self.rng.choice(self._least_used())  # type: ignore[arg-type]
+
+        x = self.rng.random() * total_w
+        return tree.find(x)
+
+    def commit(self, i: int, is_center: bool) -> None:
+        """Record a placement; only center placements change counts (and weights)."""
+        if not is_center:
+            return
+        old = self.counts[i]
+        new = old + 1
+        self.counts[i] = new
+
+        self._center.set(i, self._weight(new, True))
+        self._edge.set(i, self._weight(new, False))
+
+        self._level_size[old] -= 1
+        self._level_size[new] = self._level_size.get(new, 0) + 1
+        if old in self._levels:
+            self._levels[old].add(i, -1)
+        if new in self._levels:
+            self._levels[new].add(i, 1)
+        while self._level_size.get(self._min_level, 0) == 0:
+            self._levels.pop(self._min_level, None)
+            self._min_level += 1
@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+import math
+import random
+import time
+from typing import List
+
+from engine.core.a3_sampler import A3Sampler
+from engine.core.focus_map import get_focus_map
+from engine.profiles.premium_subject_focus import PROFILE
+
+
+def _legacy_placements(tile_ids: List[str], center_mask, seed: int, a3_enable: bool, k_center: float, k_edge: float, cap: int) -> List[str]:
+    # former bootstrap.weighted_pick, kept verbatim as the reference
+    rng = random.Random(seed)
+    center_counts = {}
+
+    def weighted_pick(is_center: bool) -> str:
+        k = k_center if is_center else k_edge
+
+        weights = []
+        total_w = 0.0
+        for tid in tile_ids:
+            cc = center_counts.get(tid, 0)
+
+            if is_center and cap > 0 and cc >= cap:
+                w = 0.0
+            else:
+                w = math.exp(-k * cc) if a3_enable else 1.0
+
+            weights.append(w)
+            total_w += w
+
+        if total_w <= 0.0:
+            min_cc = min(center_counts.get(t, 0) for t in tile_ids)
+            candidates = [t for t in tile_ids if center_counts.get(t, 0) == min_cc]
+            return rng.choice(candidates)
+
+        x = rng.random() * total_w
+        acc = 0.0
+        for tid, w in zip(tile_ids, weights):
+            acc += w
+            if acc >= x:
+                return tid
+        return tile_ids[-1]
+
+    out = []
+    grid_h, grid_w = center_mask.shape
+    for r in range(grid_h):
+        for c in range(grid_w):
+            is_center = bool(center_mask[r, c])
+            tid = weighted_pick(is_center)
+            out.append(tid)
+            if is_center:
+                center_counts[tid] = center_counts.get(tid, 0) + 1
+    return out
+
+
+def _sampler_placements(tile_ids: List[str], center_mask, seed: int, a3_enable: bool, k_center: float, k_edge: float, cap: int) -> List[str]:
+    sampler = A3Sampler(len(tile_ids), random.Random(seed), a3_enable=a3_enable, k_center=k_center, k_edge=k_edge, cap=cap)
+    out = []
+    grid_h, grid_w = center_mask.shape
+    for r in range(grid_h):
+        for c in range(grid_w):
+            is_center = bool(center_mask[r, c])
+            ti = sampler.pick(is_center)
+            sampler.commit(ti, is_center)
+            out.append(tile_ids[ti])
+    return out
+
+
+def run_probe():
+    w = int(PROFILE["output"]["width"])
+    h = int(PROFILE["output"]["height"])
+    tile_size = int(PROFILE["tiles"]["size"])
+    blend_cfg = PROFILE["blend"]
+    a3 = PROFILE["a3_diversity"]
+
+    center_mask = get_focus_map(
+        w, h, tile_size, [(0.5, 0.5, float(blend_cfg["ellipse_rx"]), float(blend_cfg["ellipse_ry"]))]
+    ).center_mask
+
+    # pool sizes: tiny (forces cap fallbacks), fake pool, real pool size, large pool
+    cases = []
+    for n in (5, 80, 110, 2000):
+        for seed in (int(PROFILE["tiles"]["seed"]), 123):
+            cases.append((n, seed, True, float(a3["k_center"]), float(a3["k_edge"]), int(a3["cap"])))
+    cases.append((110, 7, False, 1.30, 0.05, 3))
+    cases.append((110, 7, True, 1.30, 0.05, 0))
+
+    print("=== A3 SAMPLER PROBE ===")
+    print(f"grid: {center_mask.shape[1]} x {center_mask.shape[0]} center_cells={int(center_mask.sum())}")
+
+    failed = 0
+    for n, seed, a3_enable, k_center, k_edge, cap in cases:
+        tile_ids = [f"tile_{i:04d}" for i in range(n)]
+
+        t0 = time.perf_counter()
+        ref = _legacy_placements(tile_ids, center_mask, seed, a3_enable, k_center, k_edge, cap)
+        t1 = time.perf_counter()
+        got = _sampler_placements(tile_ids, center_mask, seed, a3_enable, k_center, k_edge, cap)
+        t2 = time.perf_counter()
+
+        same = ref == got
+        failed += 0 if same else 1
+        print(
+            f"[A3S] pool={n:<5} seed={seed:<4} a3={a3_enable!s:<5} cap={cap} identical={same} "
+            f"legacy_ms={(t1 - t0) * 1000:.1f} sampler_ms={(t2 - t1) * 1000:.1f}"
+        )
+
+    if failed:
+        raise RuntimeError(f"A3 sampler probe failed: {failed} case(s) differ from the linear reference")
+
+    print("\n[OK] A3 sampler probe passed: placements identical to the linear reference")
+
+
+if __name__ == "__main__":
+    run_probe()
@@ -0,0 +1,391 @@
+from __future__ import annotations
+
+import math
+import time
+from dataclasses import dataclass
+import numpy as np
+
+
+# -----------------------------
+# Global (whole-grid) tile assignment
+# -----------------------------
+# Center cells: capacitated assignment, each tile used at most `capacity` times,
+# solved with an epsilon-scaling auction (Bertsekas) over tile "slots".
+# Edge cells: reuse is free, so each edge cell simply takes its nearest tile.
+# Cost = Lab distance (same metric as the greedy matcher, without A3 penalties:
+# the capacity replaces the soft diversity penalty).
+
+DEFAULT_BLOCK_ELEMS = 1 << 18          # cells x tiles per cost block (bidding works block by block)
+DEFAULT_MAX_COST_BYTES = 256 << 20     # keep the full center cost matrix resident below this
+DEFAULT_EPS_FINAL = 0.01               # Lab units; center cost is within n_center * eps of optimal
+
+
+@dataclass
+class AssignmentResult:
+    tiles: np.ndarray          # intp (n_cells,), tile index per cell
+    cost: float                # total Lab distance (float64, exact)
+    center_cost: float
+    edge_cost: float
+    lower_bound: float         # dual bound on the optimal total cost
+    capacity: int              # effective per-tile center capacity
+    rounds: int                # auction bidding rounds (all phases)
+    solve_ms: float
+
+
+def _row_block(n_cols: int, block_elems: int) -> int:
+    return max(1, block_elems // max(1, n_cols))
+
+
+def lab_distances(cell_labs: np.ndarray, tile_labs: np.ndarray, tiles: np.ndarray) -> np.ndarray:
+    """Exact float64 Lab distance of each cell to its assigned tile."""
+    diff = tile_labs[tiles].astype(np.float64) - cell_labs.astype(np.float64)
+    return np.sqrt((diff * diff).sum(axis=1))
+
+
+class _CostRows:
+    """Rows of the cells x tiles Lab distance matrix, as GEMM blocks (resident when small enough)."""
+
+    def __init__(self, cell_labs: np.ndarray, tile_labs: np.ndarray, max_cost_bytes: int, block_elems: int):
+        self.cells = np.ascontiguousarray(cell_labs, dtype=np.float32)
+        self.tiles_t = np.ascontiguousarray(tile_labs, dtype=np.float32).T
+        self.cell_sq = (self.cells * self.cells).sum(axis=1)
+        self.tile_sq = (self.tiles_t * self.tiles_t).sum(axis=0)
+        self.block = _row_block(self.tiles_t.shape[1], block_elems)
+
+        self.full: np.ndarray | None = None
+        n, m = self.cells.shape[0], self.tiles_t.shape[1]
+        if n * m * 4 <= max_cost_bytes:
+            self.full = np.empty((n, m), dtype=np.float32)
+            for a in range(0, n, self.block):
+                self.full[a : a + self.block] = self._compute(np.arange(a, min(n, a + self.block)))
+
+    def _compute(self, rows: np.ndarray) -> np.ndarray:
+        d2 = self.cells[rows] @ self.tiles_t
+        d2 *= -2.0
+        d2 += self.cell_sq[rows, None]
+        d2 += self.tile_sq[None, :]
+        np.maximum(d2, 0.0, out=d2)
+        return np.sqrt(d2, out=d2)
+
+    def __call__(self, rows: np.ndarray) -> np.ndarray:
+        if self.full is not None:
+            return self.full[rows]
+        return self._compute(rows)
+
+    def tile_rows(self, cols: np.ndarray) -> np.ndarray:
+        """Transposed block: distances from tiles `cols` to every cell, (len(cols), n_cells)."""
+        d2 = self.tiles_t[:, cols].T @ self.cells.T
+        d2 *= -2.0
+        d2 += self.tile_sq[cols, None]
+        d2 += self.cell_sq[None, :]
+        np.maximum(d2, 0.0, out=d2)
+        return np.sqrt(d2, out=d2)
+
+    def pairs(self, rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+        d2 = (self.cells[rows] * self.tiles_t[:, cols].T).sum(axis=1)
+        d2 *= -2.0
+        d2 += self.cell_sq[rows]
+        d2 += self.tile_sq[cols]
+        np.maximum(d2, 0.0, out=d2)
+        return np.sqrt(d2, out=d2)
+
+    def blocks(self, rows: np.ndarray):
+        for a in range(0, rows.size, self.block):
+            sub = rows[a : a + self.block]
+            yield sub, self(sub)
+
+
+def nearest_tiles(
+    cell_labs: np.ndarray,
+    tile_labs: np.ndarray,
+    block_elems: int = DEFAULT_BLOCK_ELEMS,
+) -> np.ndarray:
+    """Nearest tile (Lab distance) per cell, computed in row blocks."""
+    cost = _CostRows(cell_labs, tile_labs, 0, block_elems)
+    out = np.empty(cost.cells.shape[0], dtype=np.intp)
+    for rows, c in cost.blocks(np.arange(out.size)):
+        out[rows] = c.argmin(axis=1)
+    return out
+
+
+class _Slots:
+    """Tile slots: price / holder per (tile, slot) + cheapest and second cheapest price per tile."""
+
+    def __init__(self, n_tiles: int, capacity: int):
+        self.capacity = capacity
+        self.price = np.zeros((n_tiles, capacity), dtype=np.float64)
+        self.holder = np.full((n_tiles, capacity), -1, dtype=np.intp)
+        self.p1 = np.zeros(n_tiles, dtype=np.float64)
+        self.p2 = np.zeros(n_tiles, dtype=np.float64) if capacity > 1 else np.full(n_tiles, np.inf)
+        self.s1 = np.zeros(n_tiles, dtype=np.intp)
+
+    def refresh(self, tiles: np.ndarray | None = None) -> None:
+        t = slice(None) if tiles is None else np.unique(tiles)
+        pr = self.price[t]
+        self.s1[t] = pr.argmin(axis=1)
+        if self.capacity > 1:
+            part = np.partition(pr, 1, axis=1)
+            self.p1[t], self.p2[t] = part[:, 0], part[:, 1]
+        else:
+            self.p1[t] = pr[:, 0]
+
+
+def _bid_block(
+    c_block: np.ndarray,
+    bidders: np.ndarray,
+    slots: _Slots,
+    tile_of: np.ndarray,
+    local_pos: np.ndarray,
+    eps: float,
+) -> list:
+    """
+    Gauss-Seidel bidding for one block of bidders until each of them holds a slot.
+    The block's cost rows are reused; evicted bidders of other blocks are returned.
+    """
+    price, holder, capacity = slots.price, slots.holder, slots.capacity
+    local_pos[bidders] = np.arange(bidders.size)
+    lost = []
+    pending = np.arange(bidders.size)
+    while pending.size:
+        c = c_block[pending]
+        r = np.arange(pending.size)
+
+        v = c + slots.p1[None, :]
+        j1 = v.argmin(axis=1)
+        w1 = v[r, j1]
+        if v.shape[1] > 1:
+            v[r, j1] = np.inf
+            w2 = np.minimum(v.min(axis=1), c[r, j1] + slots.p2[j1])
+        else:
+            w2 = c[r, j1] + slots.p2[j1]
+        slot = slots.s1[j1]
+        inc = np.where(np.isfinite(w2), w2 - w1, 0.0) + eps
+        bid = price[j1, slot] + inc
+
+        # one winner per slot: highest bid (ties -> first bidder)
+        flat = j1 * capacity + slot
+        order = np.lexsort((-bid, flat))
+        first = np.ones(order.size, dtype=bool)
+        first[1:] = flat[order[1:]] != flat[order[:-1]]
+        win = order[first]
+
+        wt, ws, wb = j1[win], slot[win], bidders[pending[win]]
+        prev = holder[wt, ws]
+        evicted = prev[prev >= 0]
+        tile_of[evicted] = -1
+        holder[wt, ws] = wb
+        price[wt, ws] = bid[win]
+        tile_of[wb] = wt
+        slots.refresh(wt)
+
+        mine = local_pos[evicted]
+        lost.append(evicted[mine < 0])
+        pending = np.concatenate([pending[order[~first]], mine[mine >= 0]])
+
+    local_pos[bidders] = -1
+    return lost
+
+
+def _release_violators(cost: _CostRows, slots: _Slots, tile_of: np.ndarray, block: int, eps: float) -> np.ndarray:
+    """Unassign bidders whose slot is no longer within eps of their best."""
+    price, holder = slots.price, slots.holder
+    out = []
+    for a in range(0, tile_of.size, block):
+        rows = np.arange(a, min(tile_of.size, a + block))
+        rows = rows[tile_of[rows] >= 0]
+        c = cost(rows)
+        t = tile_of[rows]
+        s = np.argmax(holder[t] == rows[:, None], axis=1)
+        mine = c[np.arange(rows.size), t] + price[t, s]
+        bad = mine > (c + slots.p1[None, :]).min(axis=1) + eps
+        holder[t[bad], s[bad]] = -1
+        tile_of[rows[bad]] = -1
+        out.append(rows[bad])
+    slots.refresh()
+    return np.concatenate(out) if out else np.zeros(0, dtype=np.intp)
+
+
+def _reverse_stale(cost: _CostRows, slots: _Slots, tile_of: np.ndarray, floor: float, eps: float) -> int:
+    """
+    Reverse auction for unheld slots priced above `floor`, in Jacobi rounds: each such
+    tile either drops its unheld slots to the floor, or offers one slot to its best
+    bidder at the price that bidder's runner-up would pay (minus eps). A bidder takes
+    its best offer and leaves its old slot, which is examined next round.
+    Every move lowers the mover's cost by at least eps, so this terminates; eps-CS holds.
+    """
+    price, holder = slots.price, slots.holder
+    n = tile_of.size
+    bidders = np.arange(n)
+    slot_of = np.argmax(holder[tile_of] == bidders[:, None], axis=1)
+    # current cost incl. price per bidder
+    u = cost.pairs(bidders, tile_of).astype(np.float64) + price[tile_of, slot_of]
+
+    moves = 0
+    block = max(1, cost.block * cost.tiles_t.shape[1] // max(1, n))
+    while True:
+        stale = (holder < 0) & (price > floor)
+        tiles = np.flatnonzero(stale.any(axis=1))
+        if tiles.size == 0:
+            break
+
+        i1 = np.empty(tiles.size, dtype=np.intp)
+        g1 = np.empty(tiles.size)
+        g2 = np.full(tiles.size, -np.inf)
+        for a in range(0, tiles.size, block):
+            t = tiles[a : a + block]
+            gain = u[None, :] - cost.tile_rows(t)
+            rows = np.arange(t.size)
+            best = gain.argmax(axis=1)
+            i1[a : a + t.size] = best
+            g1[a : a + t.size] = gain[rows, best]
+            if n > 1:
+                gain[rows, best] = -np.inf
+                g2[a : a + t.size] = gain.max(axis=1)
+
+        # nobody wants these even at the floor price
+        drop = g1 - eps <= floor
+        price[tiles[drop]] = np.where(stale[tiles[drop]], floor, price[tiles[drop]])
+
+        offer = ~drop
+        t, i, g, p = tiles[offer], i1[offer], g1[offer], np.maximum(floor, g2[offer] - eps)
+        if t.size == 0:
+            break
+        s_free = np.argmax(stale[t], axis=1)
+        u_new = u[i] - g + p
+
+        # one offer per bidder: the one leaving it with the lowest cost
+        order = np.lexsort((u_new, i))
+        take = np.ones(order.size, dtype=bool)
+        take[1:] = i[order[1:]] != i[order[:-1]]
+        k = order[take]
+        t, s_free, i, p, u_new = t[k], s_free[k], i[k], p[k], u_new[k]
+
+        holder[tile_of[i], slot_of[i]] = -1
+        holder[t, s_free] = i
+        price[t, s_free] = p
+        tile_of[i], slot_of[i], u[i] = t, s_free, u_new
+        moves += int(i.size)
+
+    slots.refresh()
+    return moves
+
+
+def _auction(
+    cost: _CostRows,
+    n: int,
+    n_tiles: int,
+    capacity: int,
+    eps_final: float,
+    block: int,
+    spread: float,
+) -> tuple[np.ndarray, np.ndarray, int]:
+    """
+    Forward auction with epsilon scaling, objects are (tile, slot) pairs (`capacity`
+    slots per tile); a bidder looks at the cheapest slot of every tile. Between phases
+    prices and assignments are kept and only eps-CS violators re-bid.
+    More slots than bidders (asymmetric problem): after each phase a reverse stage brings
+    unheld slots down to the lowest held price, which keeps the result eps-optimal.
+    Returns (tile per bidder, slot prices shifted so the lowest held price is 0, rounds).
+    """
+    slots = _Slots(n_tiles, capacity)
+    tile_of = np.full(n, -1, dtype=np.intp)
+    local_pos = np.full(n, -1, dtype=np.intp)
+    rounds = 0
+
+    eps = max(eps_final, spread / 8.0)
+    unassigned = np.arange(n, dtype=np.intp)
+    while True:
+        while unassigned.size:
+            rounds += 1
+            lost = []
+            for a in range(0, unassigned.size, block):
+                bidders = unassigned[a : a + block]
+                lost.extend(_bid_block(cost(bidders), bidders, slots, tile_of, local_pos, eps))
+            unassigned = np.concatenate(lost) if lost else np.zeros(0, dtype=np.intp)
+
+        # reverse stage: unheld slots come down to the lowest held price
+        floor = float(slots.price[slots.holder >= 0].min())
+        _reverse_stale(cost, slots, tile_of, floor, eps)
+
+        if eps <= eps_final:
+            break
+        eps = max(eps_final, eps / 6.0)
+        unassigned = _release_violators(cost, slots, tile_of, block, eps)
+
+    return tile_of, np.maximum(slots.price - floor, 0.0), rounds
+
+
+def _dual_bound(cost: _CostRows, rows: np.ndarray, price: np.ndarray) -> float:
+    """LP dual: sum_i min_s (c_is + p_s) - sum_s p_s, valid for any prices p >= 0."""
+    p1 = price.min(axis=1)
+    total = 0.0
+    for _, c in cost.blocks(rows):
+        total += float((c + p1[None, :]).min(axis=1).astype(np.float64).sum())
+    return total - float(price.sum())
+
+
+def assign_global(
+    cell_labs: np.ndarray,
+    center: np.ndarray,
+    tile_labs: np.ndarray,
+    cap_center: int,
+    eps_final: float = DEFAULT_EPS_FINAL,
+    block_elems: int = DEFAULT_BLOCK_ELEMS,
+    max_cost_bytes: int = DEFAULT_MAX_COST_BYTES,
+) -> AssignmentResult:
+    """
+    Assign a tile to every cell at once.
+      cell_labs: (n_cells, 3) target Labs, center: bool (n_cells,), tile_labs: (n_tiles, 3)
+    cap_center <= 0 means unlimited center reuse. If the pool cannot honour the cap
+    (n_tiles * cap < center cells), the capacity is raised to the smallest feasible value.
+    """
+    t0 = time.perf_counter()
+    cell_labs = np.asarray(cell_labs, dtype=np.float32).reshape(-1, 3)
+    tile_labs = np.asarray(tile_labs, dtype=np.float32).reshape(-1, 3)
+    center = np.asarray(center, dtype=bool).reshape(-1)
+    n_tiles = tile_labs.shape[0]
+    if n_tiles == 0:
+        raise ValueError("assign_global needs at least one tile")
+
+    tiles = np.empty(cell_labs.shape[0], dtype=np.intp)
+    edge_rows = np.flatnonzero(~center)
+    center_rows = np.flatnonzero(center)
+    n_center = center_rows.size
+
+    if edge_rows.size:
+        tiles[edge_rows] = nearest_tiles(cell_labs[edge_rows], tile_labs, block_elems)
+
+    capacity = 0
+    rounds = 0
+    center_bound = 0.0
+    if n_center:
+        capacity = n_center if cap_center <= 0 else max(int(cap_center), math.ceil(n_center / n_tiles))
+        if capacity >= n_center:
+            # no effective cap: nearest tile is optimal
+            tiles[center_rows] = nearest_tiles(cell_labs[center_rows], tile_labs, block_elems)
+        else:
+            cost = _CostRows(cell_labs[center_rows], tile_labs, max_cost_bytes, block_elems)
+            first = cost(np.arange(min(n_center, cost.block)))
+            spread = float(first.max() - first.min())
+            local, price, rounds = _auction(
+                cost, n_center, n_tiles, capacity, eps_final, cost.block, spread
+            )
+            tiles[center_rows] = local
+            center_bound = _dual_bound(cost, np.arange(n_center), price)
+
+    d = lab_distances(cell_labs, tile_labs, tiles)
+    center_cost = float(d[center_rows].sum())
+    edge_cost = float(d[edge_rows].sum())
+    if n_center and rounds == 0:
+        center_bound = center_cost
+
+    return AssignmentResult(
+        tiles=tiles,
+        cost=center_cost + edge_cost,
+        center_cost=center_cost,
+        edge_cost=edge_cost,
+        lower_bound=min(center_bound, center_cost) + edge_cost,
+        capacity=int(capacity),
+        rounds=int(rounds),
+        solve_ms=(time.perf_counter() - t0) * 1000.0,
+    )
@@ -25,11 +25,12 @@ def run_probe():
     print(f"mean_center (dist<=0.25): {stats.mean_center:.4f}")
     print(f"mean_edges  (dist>=0.55): {stats.mean_edges:.4f}")
 
-    # Acceptance: edges should be higher than center in PREMIUM_SUBJECT_FOCUS
-    if stats.mean_edges <= stats.mean_center:
-        raise RuntimeError("B0 probe failed: edges are not more mosaic than center (mean_edges <= mean_center)")
+    # Acceptance: edges should be more mosaic than center in PREMIUM_SUBJECT_FOCUS.
+    # alpha is the TARGET strength (blend_math / alpha_at), so "more mosaic" = lower alpha.
+    if stats.mean_edges >= stats.mean_center:
+        raise RuntimeError("B0 probe failed: edges are not more mosaic than center (mean_edges >= mean_center)")
 
-    print("\n[OK] B0 probe passed: edges > center")
+    print("\n[OK] B0 probe passed: edges more mosaic than center (target alpha edges < center)")
 
 
 if __name__ == "__main__":
@@ -1,4 +1,11 @@
+from __future__ import annotations
+
 import math
+from dataclasses import dataclass
+
+import numpy as np
+
+from engine.core.focus_map import FocusMap, get_focus_map
 
 
 def _clamp01(x: float) -> float:
@@ -36,3 +43,67 @@ def alpha_at(x: float, y: float, blend: dict) -> float:
     s = _smoothstep(t)
 
     return (1.0 - s) * a_center + s * a_edge
+
+
+# -----------------------------
+# Vectorized (whole frame) - same alpha as alpha_at, via the shared FocusMap
+# -----------------------------
+def blend_focus_map(width: int, height: int, blend: dict, tile_size: int = 1) -> FocusMap:
+    """
+    FocusMap for a blend dict. alpha_at measures radii in [0..1] image units,
+    FocusMap in [-1..1] normalized units, hence the factor 2 on rx/ry.
+    """
+    rx = max(float(blend["ellipse_rx"]), 1e-6)
+    ry = max(float(blend["ellipse_ry"]), 1e-6)
+    focus = (float(blend["center_x"]), float(blend["center_y"]), 2.0 * rx, 2.0 * ry)
+    return get_focus_map(width, height, tile_size, [focus], max(float(blend["feather"]), 1e-6))
+
+
+def alpha_map(width: int, height: int, blend: dict) -> np.ndarray:
+    """alpha_at for every pixel center, float32 (H, W)."""
+    fm = blend_focus_map(width, height, blend)
+    return fm.alpha_map(float(blend["alpha_center"]), float(blend["alpha_edge"]))
+
+
+@dataclass
+class BlendStats:
+    width: int
+    height: int
+    alpha_center: float
+    alpha_edge: float
+    min_alpha: float
+    max_alpha: float
+    mean_alpha: float
+    mean_center: float
+    mean_edges: float
+
+
+def compute_blend_stats(width: int, height: int, blend: dict, step: int = 1) -> BlendStats:
+    """
+    Alpha statistics sampled every `step` px.
+    mean_center / mean_edges: samples within 0.25 / beyond 0.55 of the focus center
+    (distance in [0..1] image units).
+    """
+    step = max(1, int(step))
+    a = alpha_map(width, height, blend)[::step, ::step]
+
+    xs = (np.arange(0, width, step, dtype=np.float64) + 0.5) / width
+    ys = (np.arange(0, height, step, dtype=np.float64) + 0.5) / height
+    dx = xs[None, :] - float(blend["center_x"])
+    dy = ys[:, None] - float(blend["center_y"])
+    dist = np.sqrt(dx * dx + dy * dy)
+
+    center = a[dist <= 0.25]
+    edges = a[dist >= 0.55]
+
+    return BlendStats(
+        width=int(width),
+        height=int(height),
+        alpha_center=float(blend["alpha_center"]),
+        alpha_edge=float(blend["alpha_edge"]),
+        min_alpha=float(a.min()),
+        max_alpha=float(a.max()),
+        mean_alpha=float(a.mean()),
+        mean_center=float(center.mean()) if center.size else float("nan"),
+        mean_edges=float(edges.mean()) if edges.size else float("nan"),
+    )
@@ -118,3 +118,78 @@ def ellipse_mask(
     s = t * t * (3.0 - 2.0 * t)
     mask = 1.0 - s
     return mask.astype(np.float32)
+
+
+def foci_mask(
+    h: int,
+    w: int,
+    foci,
+    feather: float = 0.0,
+    y0: int = 0,
+    y1: int | None = None,
+) -> np.ndarray:
+    """
+    Soft multi-foci mask in [0..1], float32, shape (y1-y0, W), for image rows [y0, y1).
+    foci: iterable of (cx, cy, rx, ry) in normalized space (pixel centers mapped to [-1, 1],
+    ellipse center at (2*cx-1, 2*cy-1), radii rx, ry) - same convention as the cell grid.
+    feather: smoothstep falloff from dist=1 to dist=1+feather (0 = hard edge).
+    Several foci => union (max).
+    """
+    if h <= 0 or w <= 0:
+        raise ValueError("Invalid h,w")
+    y1 = h if y1 is None else int(y1)
+    f = float(feather)
+    if f < 0.0:
+        raise ValueError("feather must be >= 0")
+
+    xs = ((np.arange(w, dtype=np.float64) + 0.5) / w) * 2.0 - 1.0
+    ys = ((np.arange(y0, y1, dtype=np.float64) + 0.5) / h) * 2.0 - 1.0
+
+    mask = np.zeros((y1 - y0, w), dtype=np.float32)
+    for cx, cy, rx, ry in foci:
+        if rx <= 0 or ry <= 0:
+            raise ValueError("rx, ry must be > 0")
+        nx = (xs - (float(cx) * 2.0 - 1.0)) / float(rx)
+        ny = (ys - (float(cy) * 2.0 - 1.0)) / float(ry)
+        d2 = (ny * ny)[:, None] + (nx * nx)[None, :]
+        if f <= 0.0:
+            m = (d2 <= 1.0).astype(np.float32)
+        else:
+            t = clamp01((np.sqrt(d2) - 1.0) / f)
+            m = (1.0 - t * t * (3.0 - 2.0 * t)).astype(np.float32)
+        np.maximum(mask, m, out=mask)
+    return mask
+
+
+def blend_rows_u8(mosaic: np.ndarray, target: np.ndarray, alpha: np.ndarray) -> np.ndarray:
+    """Per-pixel blend of uint8 (h,W,3) rows with a float32 (h,W) TARGET strength -> uint8."""
+    m = mosaic.astype(np.float32) / 255.0
+    t = target.astype(np.float32) / 255.0
+    res = blend_with_alpha_map(m, t, np.asarray(alpha, dtype=np.float32))
+    return np.rint(res * 255.0).astype(np.uint8)
+
+
+def blend_strips(
+    mosaic: np.ndarray,
+    target: np.ndarray,
+    alpha_rows,
+    strip_rows: int = 256,
+) -> np.ndarray:
+    """
+    Full-frame per-pixel blend of uint8 (H,W,3) images, processed in row strips so
+    float32 working memory stays ~ strip_rows*W*3*4 bytes per buffer.
+    alpha_rows(y0, y1) -> float32 (y1-y0, W) TARGET strength for those rows.
+    Returns uint8 (H,W,3).
+    """
+    if mosaic.shape != target.shape:
+        raise ValueError(f"Shape mismatch: mosaic{mosaic.shape} vs target{target.shape}")
+    if mosaic.dtype != np.uint8 or target.dtype != np.uint8:
+        raise TypeError("blend_strips expects uint8 images")
+
+    h = mosaic.shape[0]
+    step = max(1, int(strip_rows))
+    out = np.empty_like(mosaic)
+    for y0 in range(0, h, step):
+        y1 = min(h, y0 + step)
+        out[y0:y1] = blend_rows_u8(mosaic[y0:y1], target[y0:y1], alpha_rows(y0, y1))
+    return out
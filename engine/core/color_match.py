@@ -2,12 +2,21 @@ from __future__ import annotations
 
 import json
 import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, List, Tuple
+from functools import lru_cache
+from typing import Callable, Dict, List, Tuple
 
+import numpy as np
 from PIL import Image
 
+from engine.core.feature_store import TileFeatureStore
+from engine.core.tracing import count
+from engine.io.decode import decode_rgb, decode_stats, merge_decode_stats, reset_decode_stats
+
 
 # -----------------------------
 # Color space: sRGB -> CIE Lab (D65)
@@ -55,6 +64,80 @@ def rgb_to_lab(r: int, g: int, b: int) -> Tuple[float, float, float]:
     return (L, a, b2)
 
 
+# -----------------------------
+# Batch (NumPy) path: uint8 sRGB (N,3) -> float32 Lab (N,3)
+# -----------------------------
+# exact _srgb_to_linear for every 8-bit code
+_SRGB_TO_LINEAR_LUT = np.array([_srgb_to_linear(float(i)) for i in range(256)], dtype=np.float64)
+
+_RGB_TO_XYZ = np.array(
+    [
+        [0.4124564, 0.3575761, 0.1804375],
+        [0.2126729, 0.7151522, 0.0721750],
+        [0.0193339, 0.1191920, 0.9503041],
+    ],
+    dtype=np.float64,
+)
+
+_WHITE_D65 = np.array([0.95047, 1.00000, 1.08883], dtype=np.float64)
+
+
+def _f_batch(t: np.ndarray) -> np.ndarray:
+    delta = 6 / 29
+    return np.where(t > delta**3, np.cbrt(t), t / (3 * delta**2) + 4 / 29)
+
+
+def _as_uint8_rgb(rgb) -> np.ndarray:
+    arr = np.asarray(rgb)
+    if arr.ndim == 0 or arr.shape[-1] != 3:
+        raise ValueError(f"Expected (..., 3) RGB array, got shape {arr.shape}")
+    if arr.dtype != np.uint8:
+        arr = np.clip(np.rint(arr), 0, 255).astype(np.uint8)
+    return arr
+
+
+def _linear_rgb_to_lab(lin: np.ndarray) -> np.ndarray:
+    xyz = lin @ _RGB_TO_XYZ.T
+    f = _f_batch(xyz / _WHITE_D65)
+
+    lab = np.empty(f.shape, dtype=np.float32)
+    lab[..., 0] = 116 * f[..., 1] - 16
+    lab[..., 1] = 500 * (f[..., 0] - f[..., 1])
+    lab[..., 2] = 200 * (f[..., 1] - f[..., 2])
+    return lab
+
+
+@lru_cache(maxsize=4)
+def get_rgb_lab_lut(bits: int = 6) -> np.ndarray:
+    """
+    Quantized RGB -> Lab table, shape (2**bits, 2**bits, 2**bits, 3) float32.
+    Each entry holds the Lab of its bin center (bits=6 -> 262k entries, 3 MB).
+    """
+    bits = int(bits)
+    if not (1 <= bits <= 8):
+        raise ValueError(f"bits must be in [1..8], got {bits}")
+    n = 1 << bits
+    step = 256 >> bits
+    codes = (np.arange(n, dtype=np.int32) * step + step // 2).astype(np.uint8)
+    lin = _SRGB_TO_LINEAR_LUT[codes]
+    grid = np.stack(np.meshgrid(lin, lin, lin, indexing="ij"), axis=-1)
+    return _linear_rgb_to_lab(grid)
+
+
+def rgb_to_lab_batch(rgb, lut_bits: int | None = None) -> np.ndarray:
+    """
+    Vectorized rgb_to_lab: uint8 (..., 3) -> float32 (..., 3).
+    Non-uint8 input is rounded and clipped to [0..255] first.
+    lut_bits: if set, read from the quantized 3D LUT (approximate, faster on huge inputs).
+    """
+    arr = _as_uint8_rgb(rgb)
+    if lut_bits is not None:
+        shift = 8 - int(lut_bits)
+        q = arr >> shift
+        return get_rgb_lab_lut(int(lut_bits))[q[..., 0], q[..., 1], q[..., 2]]
+    return _linear_rgb_to_lab(_SRGB_TO_LINEAR_LUT[arr])
+
+
 def mean_rgb(img: Image.Image) -> Tuple[int, int, int]:
     # ultra-fast mean via downscale to 1x1
     small = img.convert("RGB").resize((1, 1), resample=Image.BILINEAR)
@@ -63,8 +146,8 @@ def mean_rgb(img: Image.Image) -> Tuple[int, int, int]:
 
 
 def mean_lab(img: Image.Image) -> Tuple[float, float, float]:
-    r, g, b = mean_rgb(img)
-    return rgb_to_lab(r, g, b)
+    lab = rgb_to_lab_batch(np.array([mean_rgb(img)], dtype=np.uint8))[0]
+    return (float(lab[0]), float(lab[1]), float(lab[2]))
 
 
 @dataclass
@@ -78,60 +161,480 @@ def _cache_key_for_file(p: Path) -> str:
     return f"{p.name}:{st.st_mtime_ns}:{st.st_size}"
 
 
+# -----------------------------
+# Ingest (mean RGB of new tiles), serial or process pool
+# -----------------------------
+def _mean_rgb_chunk(
+    paths: List[str], isolated: bool = True, grid: int = 0, hashed: bool = False
+) -> Tuple[List[Tuple[str, object, str]], Dict]:
+    """
+    (name, rgb | None, error) per file + this chunk's decode counters (pool workers only).
+    grid > 0: rgb is the uint8 (grid, grid, 3) box-mean grid instead of the mean colour.
+    hashed: rgb is the 8-byte dHash of the tile instead.
+    """
+    if isolated:
+        reset_decode_stats()
+    out: List[Tuple[str, object, str]] = []
+    for path in paths:
+        p = Path(path)
+        try:
+            if hashed:
+                out.append((p.name, dhash(decode_rgb(p, (DHASH_SIZE + 1, DHASH_SIZE))), ""))
+            elif grid > 0:
+                img = decode_rgb(p, (grid, grid)).resize((grid, grid), resample=Image.BOX)
+                out.append((p.name, np.asarray(img, dtype=np.uint8), ""))
+            else:
+                # a 1x1 mean never needs more than the 1/8 DCT scale
+                out.append((p.name, mean_rgb(decode_rgb(p, (1, 1))), ""))
+        except Exception as e:
+            out.append((p.name, None, f"{type(e).__name__}: {e}"))
+    return out, (decode_stats() if isolated else {})
+
+
+def _resolve_workers(workers: int) -> int:
+    if workers < 0:
+        return os.cpu_count() or 1
+    return workers
+
+
+def _ingest_mean_rgb(
+    files: List[Path],
+    workers: int = 0,
+    chunk_size: int = 64,
+    progress_every_s: float = 1.0,
+    grid: int = 0,
+    hashed: bool = False,
+) -> Dict[str, Tuple[int, int, int]]:
+    """
+    Mean RGB for every file (grid > 0: grid x grid mean grid, hashed: dHash), keyed by name.
+    Unreadable files are logged and left out.
+    workers: 0/1 = in-process, N = process pool of N, -1 = one per CPU.
+    """
+    total = len(files)
+    if total == 0:
+        return {}
+
+    workers = _resolve_workers(int(workers))
+    chunk_size = max(1, int(chunk_size))
+    chunks = [[str(p) for p in files[i : i + chunk_size]] for i in range(0, total, chunk_size)]
+
+    rgb_by_name: Dict[str, Tuple[int, int, int]] = {}
+    skipped = 0
+    done = 0
+    t0 = time.perf_counter()
+    last_report = t0
+
+    def consume(result) -> None:
+        nonlocal skipped, done, last_report
+        rows, stats = result
+        merge_decode_stats(stats)
+        for name, rgb, err in rows:
+            done += 1
+            if rgb is None:
+                skipped += 1
+                print(f"[FEAT] skip unreadable tile {name} ({err})")
+                continue
+            rgb_by_name[name] = rgb
+
+        now = time.perf_counter()
+        if now - last_report >= progress_every_s and done < total:
+            last_report = now
+            print(f"[FEAT] ingest {done}/{total} ({done / (now - t0):.1f} tiles/s)")
+
+    if workers <= 1 or len(chunks) == 1:
+        workers = 1
+        for chunk in chunks:
+            consume(_mean_rgb_chunk(chunk, isolated=False, grid=grid, hashed=hashed))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_mean_rgb_chunk, chunk, True, grid, hashed) for chunk in chunks]
+            for fut in as_completed(futures):
+                consume(fut.result())
+
+    dt = max(time.perf_counter() - t0, 1e-9)
+    print(f"[FEAT] ingested {total - skipped}/{total} new tiles in {dt:.2f}s ({total / dt:.1f} tiles/s) workers={workers} skipped={skipped}")
+    return rgb_by_name
+
+
+LEGACY_CACHE_NAME = "tile_features_lab.json"
+
+
+def _legacy_cache_labs(store_dir: Path) -> Dict[str, Tuple[float, float, float]]:
+    """name:mtime:size -> lab from the former JSON cache next to the store (one-time migration)."""
+    legacy = store_dir.parent / LEGACY_CACHE_NAME
+    if not legacy.exists():
+        return {}
+    try:
+        data = json.loads(legacy.read_text(encoding="utf-8"))
+        return {k: tuple(v["lab"]) for k, v in data.items()}  # type: ignore
+    except Exception:
+        return {}
+
+
+def _features_from_store(store: TileFeatureStore) -> Tuple[List[str], np.ndarray]:
+    """Live tile ids sorted by name + their (N,3) float32 Labs (one gather from the mmap)."""
+    live = store.live_sorted()
+    rows = np.fromiter((row for _, row in live), dtype=np.int64, count=len(live))
+    labs = np.ascontiguousarray(store.descriptor("lab")[rows], dtype=np.float32).reshape(-1, 3)
+    return [name for name, _ in live], labs
+
+
 def build_tile_feature_cache(
     raw_tiles_dir: str,
     cache_path: str,
     limit: int | None = None,
+    workers: int = 0,
+    chunk_size: int = 64,
+    verify: bool = False,
 ) -> List[TileFeature]:
+    """load_tile_features as TileFeature objects (small libraries, tools)."""
+    tile_ids, labs = load_tile_features(raw_tiles_dir, cache_path, limit, workers, chunk_size, verify)
+    return [TileFeature(tile_id=tid, lab=tuple(lab)) for tid, lab in zip(tile_ids, labs.tolist())]  # type: ignore
+
+
+def load_tile_features(
+    raw_tiles_dir: str,
+    cache_path: str,
+    limit: int | None = None,
+    workers: int = 0,
+    chunk_size: int = 64,
+    verify: bool = False,
+) -> Tuple[List[str], np.ndarray]:
+    """
+    Sync the binary feature store at `cache_path` (a directory) with raw_tiles_dir and
+    return the live tile ids sorted by name and their (N,3) float32 mean Labs.
+    If the tiles directory is unchanged since the last sync (same dir mtime and limit),
+    nothing is listed or stat'ed: startup is one mmap. verify=True forces a full scan
+    (needed only when files were edited in place without add/remove/rename).
+    """
     exts = {".jpg", ".jpeg", ".png", ".webp"}
 
     root = Path(raw_tiles_dir)
-    cache_file = Path(cache_path)
-    cache_file.parent.mkdir(parents=True, exist_ok=True)
-
     if not root.exists() or not root.is_dir():
-        return []
+        return [], np.zeros((0, 3), dtype=np.float32)
 
-    # load existing cache
-    existing: Dict[str, Dict] = {}
-    if cache_file.exists():
-        try:
-            existing = json.loads(cache_file.read_text(encoding="utf-8"))
-        except Exception:
-            existing = {}
+    store = TileFeatureStore(cache_path)
+
+    # captured before listing: a change during the scan forces a rescan next time
+    sync = {"dir": str(root.resolve()), "dir_mtime_ns": root.stat().st_mtime_ns, "limit": limit}
+    if not verify and store.header.get("sync") == sync:
+        tile_ids, labs = _features_from_store(store)
+        count("feature_cache.hit", len(tile_ids))
+        return tile_ids, labs
 
-    feats: List[TileFeature] = []
     files = [p for p in root.iterdir() if p.is_file() and p.suffix.lower() in exts]
     files.sort(key=lambda p: p.name)
 
     if limit is not None:
         files = files[: int(limit)]
 
-    new_cache: Dict[str, Dict] = {}
+    legacy = _legacy_cache_labs(store.root) if store.rows == 0 else {}
+
+    seen = set()
+    stale_rows: List[int] = []
+    todo: List[Tuple[Path, os.stat_result]] = []
+    reused: List[Tuple[str, os.stat_result, Tuple[float, float, float]]] = []
     for p in files:
-        key = _cache_key_for_file(p)
-        if key in existing:
-            lab = tuple(existing[key]["lab"])
-            new_cache[key] = {"lab": list(lab)}
-            feats.append(TileFeature(tile_id=p.name, lab=lab))  # type: ignore
+        st = p.stat()
+        seen.add(p.name)
+        hit = store.lookup(p.name)
+        if hit is not None and hit[1] == st.st_mtime_ns and hit[2] == st.st_size:
             continue
+        if hit is not None:
+            stale_rows.append(hit[0])
+
+        lab = legacy.get(f"{p.name}:{st.st_mtime_ns}:{st.st_size}")
+        if lab is not None:
+            reused.append((p.name, st, lab))
+        else:
+            todo.append((p, st))
+
+    # removed tiles (or tiles now beyond `limit`)
+    stale_rows += [row for name, row in store.live.items() if name not in seen]
+    store.mark_dead(stale_rows)
+
+    count("feature_cache.hit", len(files) - len(todo) - len(reused))
+    count("feature_cache.legacy", len(reused))
+    count("feature_cache.miss", len(todo))
+    rgb_by_name = _ingest_mean_rgb([p for p, _ in todo], workers=workers, chunk_size=chunk_size)
+    todo = [(p, st) for p, st in todo if p.name in rgb_by_name]
+
+    # convert all new means in one batch, append in one go
+    new_labs = rgb_to_lab_batch(np.array([rgb_by_name[p.name] for p, _ in todo], dtype=np.uint8).reshape(-1, 3))
+    names = [name for name, _, _ in reused] + [p.name for p, _ in todo]
+    stats = [st for _, st, _ in reused] + [st for _, st in todo]
+    labs = np.concatenate([np.array([lab for _, _, lab in reused], dtype=np.float32).reshape(-1, 3), new_labs])
+
+    store.append(
+        names,
+        [st.st_mtime_ns for st in stats],
+        [st.st_size for st in stats],
+        {"lab": labs},
+    )
+    store.commit(sync)
+
+    return _features_from_store(store)
 
+
+# -----------------------------
+# Per-tile side descriptors (own feature stores, rows aligned with the feature cache)
+# -----------------------------
+def _sync_tile_store(
+    store: TileFeatureStore,
+    name: str,
+    root: Path,
+    tile_ids: List[str],
+    counter: str,
+    ingest: Callable[[List[Path]], Tuple[List[Path], np.ndarray]],
+    verify: bool = False,
+) -> None:
+    """
+    Bring descriptor `name` of `store` up to date for tile_ids; ingest(files) -> (done files, rows).
+    Same dir-mtime fast path as build_tile_feature_cache; verify=True stats every tile.
+    """
+    sync = {"dir": str(root.resolve()), "dir_mtime_ns": root.stat().st_mtime_ns, "rows": len(tile_ids)}
+    if not verify and store.header.get("sync") == sync and all(t in store.live for t in tile_ids):
+        count(f"{counter}.hit", len(tile_ids))
+        return
+
+    wanted = set(tile_ids)
+    stale_rows: List[int] = [row for t, row in store.live.items() if t not in wanted]
+    todo: List[Tuple[Path, os.stat_result]] = []
+    for t in tile_ids:
+        p = root / t
         try:
-            with Image.open(p) as im:
-                lab = mean_lab(im)
-        except Exception:
-            # skip unreadable tiles
+            st = p.stat()
+        except OSError:
             continue
+        hit = store.lookup(t)
+        if hit is not None and hit[1] == st.st_mtime_ns and hit[2] == st.st_size:
+            continue
+        if hit is not None:
+            stale_rows.append(hit[0])
+        todo.append((p, st))
+    store.mark_dead(stale_rows)
+
+    count(f"{counter}.hit", len(tile_ids) - len(todo))
+    count(f"{counter}.miss", len(todo))
+    stat_of = {p.name: st for p, st in todo}
+    done, rows = ingest([p for p, _ in todo])
+    store.append(
+        [p.name for p in done],
+        [stat_of[p.name].st_mtime_ns for p in done],
+        [stat_of[p.name].st_size for p in done],
+        {name: rows},
+    )
+    store.commit(sync)
+
+
+def _store_rows(store: TileFeatureStore, name: str, tile_ids: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """(positions in tile_ids that have a live row, their rows)."""
+    rows = [(i, store.live.get(t)) for i, t in enumerate(tile_ids)]
+    have = np.array([i for i, r in rows if r is not None], dtype=np.intp)
+    return have, np.asarray(store.descriptor(name)[[r for _, r in rows if r is not None]])
+
+
+# -----------------------------
+# Sub-cell descriptors: n x n Lab means per tile (float16, own feature store)
+# -----------------------------
+SUBCELL_GRIDS = (2, 3)
+
+
+def build_subcell_cache(
+    raw_tiles_dir: str,
+    cache_path: str,
+    tile_ids: List[str],
+    labs: np.ndarray,
+    grid: int = 3,
+    workers: int = 0,
+    chunk_size: int = 64,
+    verify: bool = False,
+) -> np.ndarray:
+    """
+    float16 (len(tile_ids), grid*grid*3) sub-cell Labs, rows aligned with tile_ids (row-major
+    sub-cells, L a b each). Kept in a feature store of its own at `cache_path`, synced like
+    build_tile_feature_cache; a tile that cannot be decoded gets its mean Lab in every sub-cell.
+    """
+    grid = int(grid)
+    if grid not in SUBCELL_GRIDS:
+        raise ValueError(f"subcell grid must be one of {SUBCELL_GRIDS}, got {grid}")
+    name = f"sub{grid}"
+    dim = grid * grid * 3
+    store = TileFeatureStore(cache_path, {name: ("float16", dim)})
+
+    def ingest(files: List[Path]) -> Tuple[List[Path], np.ndarray]:
+        grids = _ingest_mean_rgb(files, workers=workers, chunk_size=chunk_size, grid=grid)
+        done = [p for p in files if p.name in grids]
+        desc = rgb_to_lab_batch(np.array([grids[p.name] for p in done], dtype=np.uint8).reshape(-1, 3))
+        return done, desc.reshape(-1, dim).astype(np.float16)
+
+    _sync_tile_store(store, name, Path(raw_tiles_dir), tile_ids, "subcell_cache", ingest, verify=verify)
+
+    out = np.repeat(np.asarray(labs, dtype=np.float32).reshape(-1, 1, 3), grid * grid, axis=1).reshape(-1, dim)
+    out = out.astype(np.float16)
+    have, rows = _store_rows(store, name, tile_ids)
+    if have.size:
+        out[have] = rows
+    return out
 
-        new_cache[key] = {"lab": [lab[0], lab[1], lab[2]]}
-        feats.append(TileFeature(tile_id=p.name, lab=lab))
 
-    # write cache (atomic)
-    tmp = cache_file.with_suffix(".tmp")
-    tmp.write_text(json.dumps(new_cache, ensure_ascii=False), encoding="utf-8")
-    tmp.replace(cache_file)
+# -----------------------------
+# Near-duplicate tiles: dHash + Hamming clustering
+# -----------------------------
+# dHash: sign of the horizontal gradient on a 9x8 grey thumbnail -> 64 bits, robust to
+# re-export, resize and recompression ("x-2118.jpg" / "x-2118 (1).jpg").
+# Pairs within max_bits are found by multi-index hashing: split into max_bits + 1 bands,
+# two hashes that close share at least one band exactly, so only tiles in the same
+# (band, value) bucket are compared. A mean Lab guard keeps recoloured variants apart.
+# Clusters = connected components; the shortest tile id represents its cluster.
+DHASH_SIZE = 8
+DEDUPE_MAX_LAB = 4.0
+_POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def dhash(img: Image.Image) -> np.ndarray:
+    """uint8 (8,) difference hash of an image."""
+    grey = np.asarray(img.convert("L").resize((DHASH_SIZE + 1, DHASH_SIZE), resample=Image.BOX), dtype=np.int16)
+    return np.packbits((grey[:, 1:] > grey[:, :-1]).reshape(-1))
+
+
+def build_tile_hash_cache(
+    raw_tiles_dir: str,
+    cache_path: str,
+    tile_ids: List[str],
+    workers: int = 0,
+    chunk_size: int = 64,
+    verify: bool = False,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """(uint64 dHash per tile, hashed mask) aligned with tile_ids; own feature store at `cache_path`."""
+    store = TileFeatureStore(cache_path, {"dhash": ("uint8", DHASH_SIZE)})
+
+    def ingest(files: List[Path]) -> Tuple[List[Path], np.ndarray]:
+        hashes = _ingest_mean_rgb(files, workers=workers, chunk_size=chunk_size, hashed=True)
+        done = [p for p in files if p.name in hashes]
+        return done, np.array([hashes[p.name] for p in done], dtype=np.uint8).reshape(-1, DHASH_SIZE)
+
+    _sync_tile_store(store, "dhash", Path(raw_tiles_dir), tile_ids, "hash_cache", ingest, verify=verify)
+
+    hashes = np.zeros(len(tile_ids), dtype=np.uint64)
+    hashed = np.zeros(len(tile_ids), dtype=bool)
+    have, rows = _store_rows(store, "dhash", tile_ids)
+    if have.size:
+        hashes[have] = np.ascontiguousarray(rows, dtype=np.uint8).view(">u8").reshape(-1)
+        hashed[have] = True
+    return hashes, hashed
+
+
+def _hamming(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    x = np.ascontiguousarray(np.bitwise_xor(a, b), dtype=np.uint64)
+    return _POPCOUNT8[x.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def near_duplicate_pairs(hashes: np.ndarray, max_bits: int) -> np.ndarray:
+    """(P, 2) index pairs i < j with Hamming(hashes[i], hashes[j]) <= max_bits."""
+    n = hashes.shape[0]
+    bands = max(1, int(max_bits) + 1)
+    found: List[np.ndarray] = []
+    for b in range(bands):
+        lo, hi = b * 64 // bands, (b + 1) * 64 // bands
+        key = (hashes >> np.uint64(lo)) & np.uint64((1 << (hi - lo)) - 1)
+        order = np.argsort(key, kind="stable")
+        ks = key[order]
+        # members of a bucket are adjacent after the sort: compare each with the next d-th
+        d = 1
+        live = np.flatnonzero(ks[1:] == ks[:-1])
+        while live.size:
+            i, j = order[live], order[live + d]
+            close = _hamming(hashes[i], hashes[j]) <= max_bits
+            found.append(np.stack([np.minimum(i, j)[close], np.maximum(i, j)[close]], axis=1))
+            d += 1
+            live = live[live + d < n]
+            live = live[ks[live + d] == ks[live]]
+    if not found:
+        return np.zeros((0, 2), dtype=np.int64)
+    return np.unique(np.concatenate(found), axis=0)
+
+
+def _components(n: int, pairs: np.ndarray) -> np.ndarray:
+    """Smallest member index of the connected component of every node (label propagation)."""
+    labels = np.arange(n, dtype=np.int64)
+    if pairs.size == 0:
+        return labels
+    a, b = pairs[:, 0], pairs[:, 1]
+    while True:
+        m = np.minimum(labels[a], labels[b])
+        new = labels.copy()
+        np.minimum.at(new, a, m)
+        np.minimum.at(new, b, m)
+        new = new[new]  # pointer jumping
+        if np.array_equal(new, labels):
+            return labels
+        labels = new
+
 
-    return feats
+@dataclass
+class NearDuplicates:
+    keep: np.ndarray           # indices (into the input features) of the cluster representatives
+    representative: np.ndarray # (N,) representative index of every input tile
+    clusters: int              # clusters with more than one member
+    max_bits: int
+
+    @property
+    def removed(self) -> int:
+        return int(self.representative.shape[0] - self.keep.shape[0])
+
+
+def collapse_near_duplicates(
+    tile_ids: List[str],
+    labs: np.ndarray,
+    hashes: np.ndarray,
+    hashed: np.ndarray,
+    max_bits: int = 4,
+    max_lab: float = DEDUPE_MAX_LAB,
+) -> NearDuplicates:
+    """One tile per near-duplicate cluster (shortest tile id, then name order); keep = its rows."""
+    n = len(tile_ids)
+    idx = np.flatnonzero(hashed)
+    pairs = idx[near_duplicate_pairs(hashes[idx], max_bits)] if idx.size else np.zeros((0, 2), dtype=np.int64)
+    if pairs.size:
+        pairs = pairs[np.linalg.norm(labs[pairs[:, 0]] - labs[pairs[:, 1]], axis=1) <= max_lab]
+    comp = _components(n, pairs)
+
+    # representative: best (len, name) rank inside each component
+    rank = np.empty(n, dtype=np.int64)
+    rank[sorted(range(n), key=lambda i: (len(tile_ids[i]), tile_ids[i]))] = np.arange(n)
+    best = np.full(n, n, dtype=np.int64)
+    np.minimum.at(best, comp, rank)
+    by_rank = np.argsort(rank)
+    representative = by_rank[best[comp]]
+    keep = np.flatnonzero(representative == np.arange(n))
+    clusters = int(np.count_nonzero(np.bincount(comp, minlength=n) > 1))
+    return NearDuplicates(keep, representative, clusters, int(max_bits))
+
+
+def dedupe_tile_features(
+    raw_tiles_dir: str,
+    cache_path: str,
+    tile_ids: List[str],
+    labs: np.ndarray,
+    max_bits: int = 4,
+    workers: int = 0,
+    chunk_size: int = 64,
+    verify: bool = False,
+) -> Tuple[List[str], np.ndarray, NearDuplicates]:
+    """Ingest stage after load_tile_features: hash (cached), cluster, keep one tile per cluster -> ids, Labs, clusters."""
+    hashes, hashed = build_tile_hash_cache(
+        raw_tiles_dir, cache_path, tile_ids, workers=workers, chunk_size=chunk_size, verify=verify
+    )
+    dup = collapse_near_duplicates(tile_ids, labs, hashes, hashed, max_bits=max_bits)
+    count("dedupe.removed", dup.removed)
+    n = len(tile_ids)
+    if dup.removed:
+        print(
+            f"[FEAT] near-duplicates: {dup.removed} of {n} tiles in {dup.clusters} clusters collapsed "
+            f"-> pool {n - dup.removed} (-{dup.removed / max(1, n) * 100:.1f}%) max_bits={max_bits}"
+        )
+    return [tile_ids[i] for i in dup.keep.tolist()], np.ascontiguousarray(labs[dup.keep]), dup
 
 
 def distance_lab(a: Tuple[float, float, float], b: Tuple[float, float, float]) -> float:
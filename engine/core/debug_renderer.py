@@ -1,28 +1,36 @@
 from __future__ import annotations
 
-import math
 import random
-from dataclasses import dataclass
+import threading
+import time
+from contextlib import nullcontext
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Dict, List, Tuple
-from PIL import Image, ImageFilter
-def _letterbox_resize(im: Image.Image, size: tuple[int, int], fill=(220, 220, 220)) -> Image.Image:
-    """Resize preserving aspect ratio, pad to target size (no stretching)."""
-    tw, th = size
-    im = im.convert("RGB")
-    w, h = im.size
-    if w == 0 or h == 0:
-        return Image.new("RGB", (tw, th), fill)
-    scale = min(tw / w, th / h)
-    nw, nh = max(1, int(w * scale)), max(1, int(h * scale))
-    resized = im.resize((nw, nh), resample=Image.BILINEAR)
-    canvas = Image.new("RGB", (tw, th), fill)
-    ox = (tw - nw) // 2
-    oy = (th - nh) // 2
-    canvas.paste(resized, (ox, oy))
-    return canvas
-
-from engine.core.color_match import TileFeature, build_tile_feature_cache, distance_lab, mean_lab
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+from PIL import Image
+from engine.core.assignment import assign_global, lab_distances
+from engine.core.blend_math import blend_rows_u8, blend_strips
+from engine.core.color_match import (
+    NearDuplicates,
+    build_subcell_cache,
+    dedupe_tile_features,
+    load_tile_features,
+)
+from engine.core.focus_map import get_focus_map
+from engine.core.matcher import TileMatcher
+from engine.core.parallel_placement import place_bands
+from engine.core.placement_grid import PlacementGrid
+from engine.core.stage_cache import StageCache, StageSpec, file_fingerprint, fingerprint
+from engine.core.subcell import SubcellANN, SubcellRows, subcell_rmse
+from engine.core.target_analysis import TargetAnalysis, letterbox_rows
+from engine.core.tile_atlas import TileAtlas, build_tile_atlas, lazy_tile_atlas
+from engine.core.tile_index import IVFPQIndex, KDTreeIndex, load_ivfpq, load_kdtree
+from engine.core.tile_prefetch import TilePrefetcher
+from engine.core.tracing import RSSWatch, count, stage
+from engine.io.deep_zoom import DeepZoomWriter, write_deep_zoom
+from engine.io.png_stream import PNGStreamWriter
 
 
 @dataclass
@@ -52,6 +60,11 @@ class TargetMatchConfig:
     ellipse_rx: float = 0.38
     ellipse_ry: float = 0.55
 
+    # alpha falloff beyond the ellipse edge (dist 1 -> 1+feather), 0 = hard edge
+    feather: float = 0.0
+    # blend stage works in row strips of this height (bounds float32 working memory)
+    blend_strip_rows: int = 256
+
     # focus center (normalized 0..1)
     center_x: float = 0.50
     center_y: float = 0.45
@@ -63,181 +76,669 @@ class TargetMatchConfig:
     tile_blur: int = 0       # 0 = off, else GaussianBlur radius
 
     # selection strategy (IMPORTANT for noise)
-    pick_mode: str = "best"  # "best" (stable) or "topk_random" (more variety, more noise)
-
-
-def _in_ellipse(r: int, c: int, grid_w: int, grid_h: int, rx: float, ry: float, center_x: float, center_y: float) -> bool:
-    cx = center_x * 2.0 - 1.0
-    cy = center_y * 2.0 - 1.0
-    nx = ((c + 0.5) / grid_w) * 2.0 - 1.0 - cx
-    ny = ((r + 0.5) / grid_h) * 2.0 - 1.0 - cy
-    return (nx * nx) / (rx * rx) + (ny * ny) / (ry * ry) <= 1.0
-def _in_any_focus(r: int, c: int, cfg) -> bool:
+    # "best" (stable), "topk_random" (more variety, more noise) or
+    # "global" (whole-grid assignment: center cells capped at cap_center, edges nearest tile)
+    pick_mode: str = "best"
+    # global mode: also run the greedy raster placement to report its cost for comparison
+    global_compare: bool = True
+    # greedy modes: 0 = raster loop; N >= 1 = band-parallel placement (per-band cap budgets) on N
+    # processes (-1 = one per CPU). The result depends on seed + placement_bands only.
+    placement_workers: int = 0
+    placement_bands: int = 32
+
+    # sub-cell descriptors (raster placement only, rejected with global / band placement): match on an n x n grid of Lab means (2 or 3,
+    # 0 = mean Lab only) for the cells in subcell_scope ("focus" = center cells, or "all");
+    # tile descriptors are float16 in the feature store, PCA-reduced to subcell_pca dims if > 0
+    subcell_grid: int = 0
+    subcell_scope: str = "focus"
+    subcell_pca: int = 0
+
+    # nearest-neighbour indexes under <cache>/tile_index (only used with sample=0, where every
+    # pick scans the whole library). tile_index: "off", "kdtree" (exact Lab k-nearest, same
+    # picks as brute force) or "auto" (kdtree from index_min_tiles tiles).
+    # subcell_index: "exact" (full GEMM rows) or "ivfpq" (approximate: ivf_refine candidates
+    # from the ivf_nprobe closest lists, re-ranked on the exact descriptors)
+    tile_index: str = "auto"
+    index_min_tiles: int = 50000
+    subcell_index: str = "exact"
+    ivf_nprobe: int = 16
+    ivf_refine: int = 64
+
+    # tile library ingest: 0 = serial, N = process pool, -1 = one worker per CPU
+    ingest_workers: int = 0
+    ingest_chunk: int = 64
+    # near-duplicate collapsing at ingest: -1 = off, N = max dHash Hamming distance (of 64 bits,
+    # 3 catches re-exports; clustering cost grows steeply with N on large libraries);
+    # one tile per cluster stays in the pool, so A3 counts and the atlas see it as one tile
+    dedupe_bits: int = -1
+
+    # tile atlas: also keep a mip chain (S/2, S/4...) to serve other tile sizes, and resize an
+    # atlas for a new size from the closest level of an existing unblurred one instead of
+    # re-decoding it (pixels then depend on that level; off = every tile decoded from the library)
+    atlas_mips: bool = False
+    # "packed" = every library tile decoded once into the memory-mapped atlas; "lazy" = no atlas,
+    # only the tiles placed in this render are decoded, by prefetch_workers threads running up to
+    # prefetch_depth distinct tiles ahead of composition (raster matching feeds them as it places).
+    # For huge libraries and one-off renders; prefetch_workers=0 decodes inline.
+    atlas_mode: str = "packed"
+    prefetch_workers: int = 4
+    prefetch_depth: int = 256
+
+    # print-size output: place, blend and encode in strips of tile rows straight into a
+    # streamed PNG; the strip height is derived from this working-memory budget
+    stream: bool = False
+    memory_budget_mb: int = 512
+    # zlib level of the output PNG (6 = Pillow default; 1 is ~5x faster, slightly larger files)
+    png_compress_level: int = 6
+
+    # deep-zoom pyramid (<out stem>.dzi + <out stem>_files/) next to the output image;
+    # unchanged tiles of a previous export are kept as is
+    dzi: bool = False
+    dzi_tile_size: int = 254
+    dzi_format: str = "jpg"
+    dzi_workers: int = 0
+
+    # memoize target analysis, placement and raw mosaic under <out dir>/stage_cache, keyed by
+    # the config fields and inputs each stage reads (STAGE_SPECS); LRU beyond stage_cache_mb
+    stage_cache: bool = False
+    stage_cache_mb: int = 1024
+
+    # write the placement (int32 tile-index grid + tile-id table) as <out stem>.placement.npy
+    save_placement: bool = False
+
+
+def _focus_list(cfg) -> List[Tuple[float, float, float, float]]:
+    """(cx, cy, rx, ry) per focus; single profile ellipse when no multi-foci are set."""
     if cfg.foci:
-        for f in cfg.foci:
-            cx = float(f.get("cx", cfg.center_x))
-            cy = float(f.get("cy", cfg.center_y))
-            rx = float(f.get("rx", cfg.ellipse_rx))
-            ry = float(f.get("ry", cfg.ellipse_ry))
-            if _in_ellipse(r, c, cfg.grid_w, cfg.grid_h, rx, ry, cx, cy):
-                return True
-        return False
-    return _in_ellipse(r, c, cfg.grid_w, cfg.grid_h, cfg.ellipse_rx, cfg.ellipse_ry, cfg.center_x, cfg.center_y)
-
-
-def _tile_path(raw_tiles_dir: str, tile_id: str) -> Path:
-    return Path(raw_tiles_dir) / tile_id
-
-
-def _load_tile(tile_file: Path, tile_size: int, blur_radius: int) -> Image.Image | None:
-    try:
-        with Image.open(tile_file) as im:
-            tile = im.convert("RGB").resize((tile_size, tile_size), resample=Image.BILINEAR)
-            if blur_radius and blur_radius > 0:
-                tile = tile.filter(ImageFilter.GaussianBlur(radius=float(blur_radius)))
-            return tile
-    except Exception:
-        return None
-
-
-def _compute_target_cell_labs(
-    target_img: Image.Image, grid_w: int, grid_h: int, tile_size: int
-) -> List[Tuple[float, float, float]]:
-    # resize target exactly to mosaic size
-    w, h = grid_w * tile_size, grid_h * tile_size
-    t = _letterbox_resize(target_img, (w, h))
-
-    labs: List[Tuple[float, float, float]] = []
-    for r in range(grid_h):
-        for c in range(grid_w):
-            box = (c * tile_size, r * tile_size, (c + 1) * tile_size, (r + 1) * tile_size)
-            patch = t.crop(box)
-            labs.append(mean_lab(patch))
-    return labs
-
-
-def render_target_match_debug(cfg: TargetMatchConfig) -> Dict[str, int]:
-    raw_dir = Path(cfg.raw_tiles_dir)
-    target_path = Path(cfg.target_path)
-    out_path = Path(cfg.out_path)
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-
-    if not target_path.exists():
-        raise FileNotFoundError(f"Target not found: {target_path}")
-
-    # Build / load tile features cache
-    cache_path = str(out_path.parent / "tile_features_lab.json")
-    feats: List[TileFeature] = build_tile_feature_cache(str(raw_dir), cache_path, limit=None)
-    if not feats:
-        raise RuntimeError(f"No usable tiles found in: {raw_dir}")
-
-    # Load target
-    with Image.open(target_path) as tim:
-        target_img = tim.convert("RGB")
-
-    # Precompute target cell LABs
-    target_labs = _compute_target_cell_labs(target_img, cfg.grid_w, cfg.grid_h, cfg.tile_size)
-
-    rng = random.Random(int(cfg.seed))
-
-    # Helper: candidates for this cell
-    def sample_features() -> List[TileFeature]:
-        if cfg.sample and cfg.sample > 0 and cfg.sample < len(feats):
-            # deterministic sampling per run (same seed => same sampled pools)
-            return rng.sample(feats, cfg.sample)
-        return feats
-
-    # counts for diversity / repetition
-    center_counts: Dict[str, int] = {}
-    cap_fallbacks = 0
-    max_center_repeat = 0
-
-    # compose mosaic
-    W, H = cfg.grid_w * cfg.tile_size, cfg.grid_h * cfg.tile_size
-    mosaic = Image.new("RGB", (W, H), (220, 220, 220))
-
-    for r in range(cfg.grid_h):
-        for c in range(cfg.grid_w):
-            idx = r * cfg.grid_w + c
-            t_lab = target_labs[idx]
-
-            is_center = _in_any_focus(r, c, cfg)
-            k = cfg.k_center if is_center else cfg.k_edge
+        return [
+            (
+                float(f.get("cx", cfg.center_x)),
+                float(f.get("cy", cfg.center_y)),
+                float(f.get("rx", cfg.ellipse_rx)),
+                float(f.get("ry", cfg.ellipse_ry)),
+            )
+            for f in cfg.foci
+        ]
+    return [(cfg.center_x, cfg.center_y, cfg.ellipse_rx, cfg.ellipse_ry)]
+
+
+# canvas + target rows (uint8), alpha (float32) and the float32 blend temporaries
+_STREAM_BYTES_PER_PX = 64
+
+
+def _stream_strip_rows(cfg: TargetMatchConfig) -> int:
+    """Tile rows per strip so one strip's working set fits memory_budget_mb."""
+    row_bytes = cfg.tile_size * cfg.grid_w * cfg.tile_size * _STREAM_BYTES_PER_PX
+    return max(1, min(cfg.grid_h, int(cfg.memory_budget_mb) * (1 << 20) // max(1, row_bytes)))
+
+
+def _streamed_cell_labs(target_img: Image.Image, cfg: TargetMatchConfig, strip: int) -> Tuple[np.ndarray, np.ndarray | None]:
+    """Per-cell mean Labs (+ sub-cell descriptors) computed strip by strip (the full-res target is never built)."""
+    S = cfg.tile_size
+    n = int(cfg.subcell_grid)
+    size = (cfg.grid_w * S, cfg.grid_h * S)
+    out = np.empty((cfg.grid_h, cfg.grid_w, 3), dtype=np.float32)
+    sub = np.empty((cfg.grid_h, cfg.grid_w, n * n * 3), dtype=np.float32) if n else None
+    for r0 in range(0, cfg.grid_h, strip):
+        r1 = min(cfg.grid_h, r0 + strip)
+        analysis = TargetAnalysis(letterbox_rows(target_img, size, r0 * S, r1 * S))
+        out[r0:r1] = analysis.cell_labs(cfg.grid_w, r1 - r0, S)
+        if sub is not None:
+            sub[r0:r1] = analysis.sub_cell_labs(cfg.grid_w, r1 - r0, S, n).reshape(r1 - r0, cfg.grid_w, -1)
+    return out.reshape(-1, 3), (None if sub is None else sub.reshape(cfg.grid_w * cfg.grid_h, -1))
+
+
+def _compose_rows(
+    placement: np.ndarray, tiles: Callable[[int], np.ndarray | None], grid_w: int, S: int, r0: int, r1: int
+) -> np.ndarray:
+    """Mosaic pixels of tile rows [r0, r1); tiles(i) -> S x S pixels of tile i (None: cell left blank)."""
+    canvas = np.full(((r1 - r0) * S, grid_w * S, 3), 220, dtype=np.uint8)
+    for idx in np.flatnonzero(placement[r0 * grid_w : r1 * grid_w] >= 0):
+        r, c = divmod(int(idx), grid_w)
+        px = tiles(int(placement[r0 * grid_w + idx]))
+        if px is not None:
+            canvas[r * S : (r + 1) * S, c * S : (c + 1) * S] = px
+    return canvas
 
-            candidates = sample_features()
 
-            scored: List[Tuple[float, TileFeature]] = []
-            for tf in candidates:
-                cc = center_counts.get(tf.tile_id, 0)
+def _dzi_writer(cfg: TargetMatchConfig, out_path: Path, width: int, height: int) -> DeepZoomWriter:
+    return DeepZoomWriter(
+        out_path.parent,
+        out_path.stem,
+        width,
+        height,
+        tile_size=cfg.dzi_tile_size,
+        fmt=cfg.dzi_format,
+        workers=cfg.dzi_workers,
+    )
+
+
+def _greedy_placement(
+    matcher: TileMatcher,
+    target_labs: np.ndarray,
+    center: np.ndarray,
+    ok: np.ndarray,
+    sub_rows: SubcellRows | SubcellANN | None = None,
+    on_place: Callable[[int], None] | None = None,
+) -> np.ndarray:
+    """Raster-order picks; -1 where the picked tile has no usable pixels (not counted). on_place(ti) per placed cell."""
+    placement = np.full(target_labs.shape[0], -1, dtype=np.intp)
+    capping = matcher.cap_center > 0
+    for idx in range(target_labs.shape[0]):
+        is_center = bool(center[idx])
+        row = cand = None
+        if sub_rows is not None and idx in sub_rows:
+            row, cand = sub_rows.query(idx, matcher.capped if is_center and capping else None)
+        ti = matcher.pick(target_labs[idx], is_center, dist_row=row, candidates=cand)
+        if not ok[ti]:
+            continue
+        placement[idx] = ti
+        matcher.commit(ti, is_center)
+        if on_place is not None:
+            on_place(ti)
+    return placement
+
+
+# -----------------------------
+# Stage cache: config fields + inputs per cached stage
+# -----------------------------
+# Blend and encode are never cached: they are what tuning runs want to see change.
+# The pixel alpha mask is already memoized on disk by the focus map (focus_maps/).
+STAGE_SPECS: Dict[str, StageSpec] = {
+    "target_analysis": StageSpec(
+        "target_analysis",
+        ("grid_w", "grid_h", "tile_size", "stream", "memory_budget_mb", "subcell_grid"),
+        ("target",),
+    ),
+    "matching": StageSpec(
+        "matching",
+        (
+            "seed", "sample", "top_k", "a3_enable", "k_center", "k_edge", "cap_center",
+            "pick_mode", "global_compare", "placement_workers", "placement_bands",
+            "subcell_grid", "subcell_scope", "subcell_pca", "subcell_index", "ivf_nprobe", "ivf_refine",
+        ),
+        ("target_analysis", "tiles", "center_mask"),
+    ),
+    "compose": StageSpec("compose", ("grid_w", "grid_h", "tile_size", "tile_blur"), ("matching", "tiles")),
+}
+
+
+def _run_stage(sc: StageCache | None, name: str, cfg: TargetMatchConfig, inputs, compute):
+    """compute() -> (arrays, meta), through the stage cache when enabled -> (arrays, meta, key)."""
+    if sc is None:
+        arrays, meta = compute()
+        return arrays, meta, ""
+    return sc.run(STAGE_SPECS[name], cfg, inputs(), compute)
+
+
+def _placement_cost(target_labs: np.ndarray, tile_labs: np.ndarray, placement: np.ndarray) -> float:
+    placed = placement >= 0
+    return float(lab_distances(target_labs[placed], tile_labs, placement[placed]).sum())
+
+
+# Everything a TilePool is built from besides the library content: configs with the same
+# key share one warm pool (batch, daemon), and a pool only serves configs with its key.
+PoolKey = Tuple[str, int, int, int, int, str, bool]
+
+
+def tile_pool_key(cfg: TargetMatchConfig) -> PoolKey:
+    """(library dir, tile size, tile blur, sub-cell grid, dedupe bits, atlas mode, atlas mips)."""
+    return (
+        str(Path(cfg.raw_tiles_dir)),
+        int(cfg.tile_size),
+        int(cfg.tile_blur),
+        int(cfg.subcell_grid),
+        int(cfg.dedupe_bits),
+        str(cfg.atlas_mode),
+        bool(cfg.atlas_mips),
+    )
 
-                # B1: cap reuse only in center
-                if is_center and cfg.cap_center > 0 and cc >= cfg.cap_center:
-                    continue
 
-                d = distance_lab(t_lab, tf.lab)
+@dataclass
+class TilePool:
+    """Tile library loaded once and shared by many renders: tile ids, their Labs and the atlas."""
 
-                # A3 penalty: stronger in center, weaker on edges
-                if cfg.a3_enable and is_center:
-                    d = d * (1.0 + (1.0 - math.exp(-k * cc)))
-                elif cfg.a3_enable and not is_center:
-                    d = d * (1.0 + 0.10 * (1.0 - math.exp(-k * cc)))
+    raw_tiles_dir: str
+    tile_ids: List[str]
+    labs: np.ndarray  # (N,3) float32 mean Labs, row i = tile_ids[i]
+    atlas: TileAtlas
+    subcells: Dict[int, np.ndarray] = field(default_factory=dict)  # grid -> float16 (N, grid*grid*3)
+    cache_dir: str = ""
+    dedupe: NearDuplicates | None = None
+    index: KDTreeIndex | None = None
+    subcell_indexes: Dict[int, IVFPQIndex] = field(default_factory=dict)  # grid -> IVF-PQ
+    key: PoolKey | None = None  # tile_pool_key of the config it was loaded for
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+    _fingerprint: str | None = field(default=None, repr=False)
+
+    def fingerprint(self) -> str:
+        """Identity of the library content (file keys, Labs, usable mask, atlas row sources) for the stage cache."""
+        if self._fingerprint is None:
+            self._fingerprint = fingerprint(
+                str(Path(self.raw_tiles_dir).resolve()), self.atlas.keys, self.labs, self.atlas.ok, self.atlas.sources
+            )
+        return self._fingerprint
+
+    def serves(self, cfg: TargetMatchConfig) -> bool:
+        return self.key == tile_pool_key(cfg)
+
+    def lab_index(self, cfg: TargetMatchConfig) -> KDTreeIndex | None:
+        """Exact Lab index when cfg picks over the whole library (loaded once, then shared)."""
+        if not _wants_tile_index(cfg, len(self.tile_ids)):
+            return None
+        with self._lock:
+            if self.index is None:
+                with stage("tile_index"):
+                    self.index = load_kdtree(self.cache_dir, self.tile_ids, self.labs)
+        return self.index
+
+    def subcell_index(self, cfg: TargetMatchConfig) -> IVFPQIndex | None:
+        if not _wants_subcell_index(cfg):
+            return None
+        g = int(cfg.subcell_grid)
+        with self._lock:
+            if g not in self.subcell_indexes:
+                with stage("tile_index"):
+                    self.subcell_indexes[g] = load_ivfpq(self.cache_dir, self.tile_ids, self.subcells[g], g)
+        return self.subcell_indexes[g]
+
+
+def _wants_tile_index(cfg: TargetMatchConfig, n_tiles: int) -> bool:
+    if cfg.tile_index not in ("off", "auto", "kdtree"):
+        raise ValueError(f"tile_index must be off, auto or kdtree, got: {cfg.tile_index!r}")
+    if cfg.sample and 0 < int(cfg.sample) < n_tiles:
+        return False  # sampled picks scan `sample` tiles, not the library
+    return cfg.tile_index == "kdtree" or (cfg.tile_index == "auto" and n_tiles >= int(cfg.index_min_tiles))
+
+
+def _wants_subcell_index(cfg: TargetMatchConfig) -> bool:
+    if cfg.subcell_index not in ("exact", "ivfpq"):
+        raise ValueError(f"subcell_index must be exact or ivfpq, got: {cfg.subcell_index!r}")
+    return bool(cfg.subcell_grid) and cfg.subcell_index == "ivfpq"
+
+
+def load_tile_pool(cfg: TargetMatchConfig, cache_dir: str | Path, verify: bool = False) -> TilePool:
+    """
+    Feature cache + atlas for cfg's tile library and (tile_size, tile_blur), under cache_dir.
+    verify=True skips the stores' dir-mtime fast path (tiles edited in place, e.g. on reload).
+    """
+    raw_dir = Path(cfg.raw_tiles_dir)
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
 
-                scored.append((d, tf))
+    # Build / load tile features cache
+    with stage("feature_cache"):
+        tile_ids, labs = load_tile_features(
+            str(raw_dir),
+            str(cache_dir / "tile_features"),
+            limit=None,
+            workers=cfg.ingest_workers,
+            chunk_size=cfg.ingest_chunk,
+            verify=verify,
+        )
+    if not tile_ids:
+        raise RuntimeError(f"No usable tiles found in: {raw_dir}")
 
-            if not scored:
-                # cap blocked everything in center -> fallback to least used
-                if is_center:
-                    cap_fallbacks += 1
-                    min_cc = min(center_counts.get(f.tile_id, 0) for f in feats)
-                    pool = [f for f in feats if center_counts.get(f.tile_id, 0) == min_cc]
-                    tf = rng.choice(pool)
-                else:
-                    tf = rng.choice(feats)
+    dedupe = None
+    if cfg.dedupe_bits >= 0:
+        with stage("dedupe"):
+            tile_ids, labs, dedupe = dedupe_tile_features(
+                str(raw_dir),
+                str(cache_dir / "tile_hashes"),
+                tile_ids,
+                labs,
+                max_bits=int(cfg.dedupe_bits),
+                workers=cfg.ingest_workers,
+                chunk_size=cfg.ingest_chunk,
+                verify=verify,
+            )
+
+    # Pre-resized tiles: decoded once per (tile_size, tile_blur), memory-mapped (or per render, lazy)
+    if cfg.atlas_mode not in ("packed", "lazy"):
+        raise ValueError(f"atlas_mode must be packed or lazy, got: {cfg.atlas_mode!r}")
+    with stage("tile_load"):
+        if cfg.atlas_mode == "lazy":
+            atlas = lazy_tile_atlas(str(raw_dir), tile_ids, cfg.tile_size, cfg.tile_blur)
+        else:
+            atlas = build_tile_atlas(
+                str(raw_dir),
+                tile_ids,
+                str(cache_dir / "tile_atlas"),
+                cfg.tile_size,
+                cfg.tile_blur,
+                mips=cfg.atlas_mips,
+            )
+    count("tile_load.hit", atlas.reused)
+    count("tile_load.miss", atlas.decoded)
+    count("tile_load.derived", atlas.derived)
+
+    subcells: Dict[int, np.ndarray] = {}
+    if cfg.subcell_grid:
+        with stage("subcell_cache"):
+            g = int(cfg.subcell_grid)
+            subcells[g] = build_subcell_cache(
+                str(raw_dir),
+                str(cache_dir / f"tile_subcells_{g}"),
+                tile_ids,
+                labs,
+                grid=g,
+                workers=cfg.ingest_workers,
+                chunk_size=cfg.ingest_chunk,
+                verify=verify,
+            )
+
+    pool = TilePool(str(raw_dir), tile_ids, labs, atlas, subcells, cache_dir=str(cache_dir), dedupe=dedupe, key=tile_pool_key(cfg))
+    pool.lab_index(cfg)
+    pool.subcell_index(cfg)
+    return pool
+
+
+def _place(
+    cfg: TargetMatchConfig,
+    matcher: TileMatcher,
+    pool: TilePool,
+    target_labs: np.ndarray,
+    center: np.ndarray,
+    target_sub: np.ndarray | None = None,
+    on_place: Callable[[int], None] | None = None,
+) -> Tuple[np.ndarray, int, int, Dict[str, float]]:
+    """
+    Placement for the configured mode: (placement, max_center_repeat, cap_fallbacks, stats).
+    on_place(ti) streams the raster placement's picks as they are made (other modes don't call it).
+    """
+    stats: Dict[str, float] = {}
+    if cfg.pick_mode == "global":
+        # whole-grid assignment over the usable tiles only
+        usable = np.flatnonzero(pool.atlas.ok)
+        if usable.size == 0:
+            raise RuntimeError(f"No decodable tiles in: {cfg.raw_tiles_dir}")
+        res = assign_global(target_labs, center, matcher.labs[usable], cfg.cap_center)
+        placement = usable[res.tiles]
+        counts = np.bincount(placement[center], minlength=len(pool.tile_ids))
+        max_center_repeat = int(counts.max()) if center.any() else 0
+        cap_fallbacks = 0
+        stats.update(
+            assign_ms=round(res.solve_ms, 1),
+            assign_cost=round(res.cost, 2),
+            assign_lower_bound=round(res.lower_bound, 2),
+            assign_capacity=res.capacity,
+        )
+        if cfg.global_compare:
+            greedy = _greedy_placement(matcher, target_labs, center, pool.atlas.ok)
+            stats["greedy_cost"] = round(_placement_cost(target_labs, matcher.labs, greedy), 2)
+            stats["greedy_cap_fallbacks"] = matcher.cap_fallbacks
+    elif cfg.placement_workers != 0:
+        bp = place_bands(
+            target_labs,
+            center,
+            pool.labs,
+            pool.atlas.ok,
+            cfg.grid_w,
+            cfg.grid_h,
+            seed=int(cfg.seed),
+            bands=cfg.placement_bands,
+            workers=cfg.placement_workers,
+            top_k=cfg.top_k,
+            sample=cfg.sample,
+            a3_enable=cfg.a3_enable,
+            k_center=cfg.k_center,
+            k_edge=cfg.k_edge,
+            cap_center=cfg.cap_center,
+            pick_mode=cfg.pick_mode,
+        )
+        placement = bp.placement
+        max_center_repeat = bp.max_center_repeat
+        cap_fallbacks = bp.cap_fallbacks
+        stats.update(
+            placement_repairs=bp.repairs,
+            placement_ms=round(bp.demand_ms + bp.place_ms + bp.repair_ms, 1),
+            placement_critical_ms=round(bp.critical_ms, 1),
+            greedy_cost=round(_placement_cost(target_labs, matcher.labs, placement), 2),
+        )
+    else:
+        sub_rows: SubcellRows | SubcellANN | None = None
+        if cfg.subcell_grid:
+            g = int(cfg.subcell_grid)
+            cells = np.flatnonzero(center) if cfg.subcell_scope == "focus" else np.arange(center.shape[0])
+            ann = pool.subcell_index(cfg)
+            if ann is not None:
+                sub_rows = SubcellANN(ann, pool.subcells[g], target_sub, cells, g, cfg.ivf_nprobe, cfg.ivf_refine)
             else:
-                scored.sort(key=lambda x: x[0])
-                top = scored[: max(1, min(int(cfg.top_k), len(scored)))]
-
-                if cfg.pick_mode == "topk_random":
-                    tf = rng.choice([t[1] for t in top])
-                else:
-                    # "best" = deterministic, less noise
-                    tf = top[0][1]
-
-            # load & paste tile
-            tile_img = _load_tile(_tile_path(cfg.raw_tiles_dir, tf.tile_id), cfg.tile_size, cfg.tile_blur)
-            if tile_img is None:
-                continue
-
-            mosaic.paste(tile_img, (c * cfg.tile_size, r * cfg.tile_size))
-
-            # update counts
-            if is_center:
-                center_counts[tf.tile_id] = center_counts.get(tf.tile_id, 0) + 1
-                if center_counts[tf.tile_id] > max_center_repeat:
-                    max_center_repeat = center_counts[tf.tile_id]
-
-    # Portrait-first blend with target
-    target_resized = _letterbox_resize(target_img, (W, H))
-    blended = Image.new("RGB", (W, H))
-
-    for r in range(cfg.grid_h):
-        for c in range(cfg.grid_w):
-            is_center = _in_any_focus(r, c, cfg)
-            alpha = float(cfg.alpha_center) if is_center else float(cfg.alpha_edge)
+                sub_rows = SubcellRows(pool.subcells[g], target_sub, cells, g, pca_dims=cfg.subcell_pca)
+        placement = _greedy_placement(matcher, target_labs, center, pool.atlas.ok, sub_rows, on_place)
+        max_center_repeat = matcher.max_center_repeat
+        cap_fallbacks = matcher.cap_fallbacks
+        stats["greedy_cost"] = round(_placement_cost(target_labs, matcher.labs, placement), 2)
+        if matcher.index is not None:
+            stats.update(tile_index="kdtree", tile_index_delta=int(matcher.index.delta.size))
+        if isinstance(sub_rows, SubcellANN):
+            stats["subcell_index"] = f"ivfpq(nprobe={sub_rows.nprobe}, refine={sub_rows.refine})"
+        if sub_rows is not None:
+            placed = sub_rows.cells[placement[sub_rows.cells] >= 0]
+            err = subcell_rmse(pool.subcells[g][placement[placed]], target_sub[placed], g)
+            stats.update(
+                subcell_cells=int(sub_rows.cells.size),
+                subcell_dims=sub_rows.dims,
+                subcell_ms=round(sub_rows.ms, 1),
+                subcell_rmse=round(float(err.mean()) if err.size else 0.0, 3),
+            )
+
+    return placement, max_center_repeat, cap_fallbacks, stats
+
+
+def _dedupe_stats(cfg: TargetMatchConfig, pool: TilePool, matcher: TileMatcher, match_ms: float) -> Dict[str, float]:
+    """Pool shrink from near-duplicate collapsing + matching time it saved (estimated)."""
+    dup = pool.dedupe
+    n = len(pool.tile_ids)
+    # full-library brute-force picks scale with the pool; sampled or indexed picks barely do
+    linear = not (cfg.sample and 0 < cfg.sample < n) and matcher.index is None and cfg.pick_mode != "global"
+    return {
+        "dedupe_removed": dup.removed,
+        "dedupe_clusters": dup.clusters,
+        "dedupe_pool_before": n + dup.removed,
+        "dedupe_match_saved_ms": round(match_ms * dup.removed / max(1, n), 1) if linear else 0.0,
+    }
 
-            box = (c * cfg.tile_size, r * cfg.tile_size, (c + 1) * cfg.tile_size, (r + 1) * cfg.tile_size)
-            m_patch = mosaic.crop(box)
-            t_patch = target_resized.crop(box)
 
-            # blended = alpha*target + (1-alpha)*mosaic
-            blended_patch = Image.blend(m_patch, t_patch, alpha=alpha)
-            blended.paste(blended_patch, box[:2])
+def render_target_match_debug(cfg: TargetMatchConfig, pool: TilePool | None = None) -> Dict[str, float]:
+    target_path = Path(cfg.target_path)
+    out_path = Path(cfg.out_path)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
 
-    blended.save(out_path)
+    if not target_path.exists():
+        raise FileNotFoundError(f"Target not found: {target_path}")
+    if cfg.subcell_grid and (cfg.pick_mode == "global" or cfg.placement_workers != 0):
+        raise ValueError(
+            "subcell_grid applies to the raster placement only: "
+            f"set subcell_grid=0 for pick_mode={cfg.pick_mode!r} / placement_workers={cfg.placement_workers}"
+        )
+
+    # Tile library: features + atlas, loaded here unless a warm pool is passed in
+    if pool is None:
+        pool = load_tile_pool(cfg, out_path.parent)
+    elif not pool.serves(cfg):
+        raise ValueError(
+            f"Tile pool ({pool.raw_tiles_dir}, s={pool.atlas.tile_size}, blur={pool.atlas.tile_blur}) "
+            f"does not match config ({cfg.raw_tiles_dir}, s={cfg.tile_size}, blur={cfg.tile_blur})"
+        )
+
+    # lazy atlas: placed tiles are decoded on a thread pool ahead of composition (closed on any exit)
+    prefetch = TilePrefetcher(pool.atlas.decode, cfg.prefetch_workers, cfg.prefetch_depth) if pool.atlas.lazy else None
+    with RSSWatch() as rss, prefetch if prefetch is not None else nullcontext():
+        stats = _render(cfg, pool, prefetch)
+    # highest sampled RSS during this render (process-wide: concurrent jobs are included)
+    stats["peak_rss_mb"] = rss.peak_mb
+    return stats
+
+
+def _render(cfg: TargetMatchConfig, pool: TilePool, prefetch: TilePrefetcher | None) -> Dict[str, float]:
+    target_path = Path(cfg.target_path)
+    out_path = Path(cfg.out_path)
+    tile_ids, atlas = pool.tile_ids, pool.atlas
+
+    S = cfg.tile_size
+    W, H = cfg.grid_w * S, cfg.grid_h * S
+    if cfg.stream and out_path.suffix.lower() != ".png":
+        raise ValueError(f"Streamed rendering writes PNG only, got: {out_path}")
+
+    sc = StageCache(out_path.parent / "stage_cache", cfg.stage_cache_mb) if cfg.stage_cache else None
+    strip = _stream_strip_rows(cfg) if cfg.stream else 0
+    target_img: Image.Image | None = None
+
+    def load_target() -> Image.Image:
+        nonlocal target_img
+        if target_img is None:
+            with Image.open(target_path) as tim:
+                target_img = tim.convert("RGB")
+        return target_img
+
+    def analyse() -> Tuple[Dict[str, np.ndarray], Dict]:
+        if cfg.stream:
+            labs, sub = _streamed_cell_labs(load_target(), cfg, strip)
+            return {"labs": labs, **({"sub": sub} if sub is not None else {})}, {}
+        # Target analysis: letterbox once + summed-area table, all cell Labs in one gather
+        analysis = TargetAnalysis.from_image(load_target(), W, H)
+        out = {"labs": analysis.cell_labs(cfg.grid_w, cfg.grid_h, S).reshape(-1, 3), "rgb": analysis.rgb}
+        if cfg.subcell_grid:
+            g = int(cfg.subcell_grid)
+            out["sub"] = analysis.sub_cell_labs(cfg.grid_w, cfg.grid_h, S, g).reshape(cfg.grid_w * cfg.grid_h, -1)
+        return out, {}
+
+    with stage("target_analysis"):
+        ta, _, ta_key = _run_stage(sc, "target_analysis", cfg, lambda: {"target": file_fingerprint(target_path)}, analyse)
+    target_labs = ta["labs"]
+
+    matcher = TileMatcher.from_labs(
+        pool.labs,
+        random.Random(int(cfg.seed)),
+        tile_ids=tile_ids,
+        top_k=cfg.top_k,
+        sample=cfg.sample,
+        a3_enable=cfg.a3_enable,
+        k_center=cfg.k_center,
+        k_edge=cfg.k_edge,
+        cap_center=cfg.cap_center,
+        pick_mode=cfg.pick_mode,
+    )
+    lab_index = pool.lab_index(cfg)
+    if lab_index is not None:
+        matcher.use_index(lab_index)
+
+    # Focus geometry (cell mask + feathered pixel mask), shared by placement and blend
+    with stage("focus_map"):
+        focus = get_focus_map(W, H, S, _focus_list(cfg), cfg.feather, cache_dir=out_path.parent / "focus_maps")
+
+    center = focus.center_mask.reshape(-1)
+
+    def match() -> Tuple[Dict[str, np.ndarray], Dict]:
+        t0 = time.perf_counter()
+        placement, max_center_repeat, cap_fallbacks, stats = _place(
+            cfg, matcher, pool, target_labs, center, ta.get("sub"), prefetch.want if prefetch is not None else None
+        )
+        if pool.dedupe is not None and pool.dedupe.removed:
+            stats.update(_dedupe_stats(cfg, pool, matcher, (time.perf_counter() - t0) * 1000.0))
+        return {"placement": placement}, {"max_center_repeat": max_center_repeat, "cap_fallbacks": cap_fallbacks, "stats": stats}
+
+    with stage("matching", hot=True, mode=cfg.pick_mode):
+        m, m_meta, m_key = _run_stage(
+            sc,
+            "matching",
+            cfg,
+            lambda: {"target_analysis": ta_key, "tiles": pool.fingerprint(), "center_mask": fingerprint(center)},
+            match,
+        )
+    grid = PlacementGrid.from_indices(m["placement"], cfg.grid_w, cfg.grid_h, tile_ids)
+    placement = grid.tiles.reshape(-1)
+    max_center_repeat, cap_fallbacks = m_meta["max_center_repeat"], m_meta["cap_fallbacks"]
+    stats = dict(m_meta["stats"])
+    center_stats = grid.repeat_stats(focus.center_mask, top=0)
+    stats["center_unique"] = center_stats.unique
+    stats["center_dup_rate"] = round(center_stats.dup_rate, 4)
+    if cfg.save_placement:
+        grid.save(out_path.with_name(out_path.stem + ".placement.npy"))
+
+    def tile_source() -> Callable[[int], np.ndarray | None]:
+        if prefetch is None:
+            return lambda i: atlas.array[i]
+        if prefetch.wanted == 0:
+            # picks were not streamed (global / band placement, cached matching): queue them now
+            prefetch.want_all(placement)
+        return prefetch.get
+
+    if cfg.stream:
+        # strip by strip: compose, letterbox the target band, blend, append to the PNG (+ pyramid)
+        dzi_ctx = _dzi_writer(cfg, out_path, W, H) if cfg.dzi else nullcontext()
+        with PNGStreamWriter(out_path, W, H, compress_level=cfg.png_compress_level) as png, dzi_ctx as dz:
+            tiles = tile_source()
+            for r0 in range(0, cfg.grid_h, strip):
+                r1 = min(cfg.grid_h, r0 + strip)
+                y0, y1 = r0 * S, r1 * S
+                with stage("compose"):
+                    mosaic = _compose_rows(placement, tiles, cfg.grid_w, S, r0, r1)
+                with stage("target_analysis"):
+                    target = letterbox_rows(load_target(), (W, H), y0, y1)
+                with stage("blend"):
+                    rows = blend_rows_u8(mosaic, target, focus.alpha_rows(cfg.alpha_center, cfg.alpha_edge, y0, y1))
+                with stage("encode"):
+                    png.write_rows(rows)
+                if dz is not None:
+                    with stage("deep_zoom"):
+                        dz.write_rows(rows)
+        if dz is not None:
+            stats.update(dz.stats())
+        stats["strip_tile_rows"] = strip
+    else:
+        with stage("compose"):
+            mosaic, _, _ = _run_stage(
+                sc,
+                "compose",
+                cfg,
+                lambda: {"matching": m_key, "tiles": pool.fingerprint()},
+                lambda: ({"canvas": _compose_rows(placement, tile_source(), cfg.grid_w, S, 0, cfg.grid_h)}, {}),
+            )
+        canvas = mosaic["canvas"]
+
+        # Portrait-first blend with target: one per-pixel pass (feathered, multi-foci), in row strips
+        def alpha_rows(y0: int, y1: int) -> np.ndarray:
+            return focus.alpha_rows(cfg.alpha_center, cfg.alpha_edge, y0, y1)
+
+        with stage("blend", hot=True):
+            blended_arr = blend_strips(canvas, ta["rgb"], alpha_rows, strip_rows=cfg.blend_strip_rows)
+        with stage("encode"):
+            blended = Image.fromarray(blended_arr, mode="RGB")
+            if out_path.suffix.lower() == ".png":
+                blended.save(out_path, compress_level=cfg.png_compress_level)
+            else:
+                blended.save(out_path)
+        if cfg.dzi:
+            with stage("deep_zoom"):
+                stats.update(
+                    write_deep_zoom(
+                        blended_arr,
+                        out_path.parent,
+                        out_path.stem,
+                        tile_size=cfg.dzi_tile_size,
+                        fmt=cfg.dzi_format,
+                        workers=cfg.dzi_workers,
+                    )
+                )
+
+    decoded = atlas.decoded
+    if prefetch is not None:
+        prefetch.close()  # joins the decode threads, so the counters below are final
+        if prefetch.wanted:
+            stats.update(prefetch.stats())
+            decoded = int(stats["prefetch_tiles"])
+            count("tile_load.miss", decoded)
+
+    if sc is not None:
+        stats["stage_cache_hits"] = ",".join(sc.hits)
 
     return {
         "tiles_total": int(cfg.grid_w * cfg.grid_h),
-        "tiles_pool": int(len(feats)),
+        "tiles_pool": int(len(tile_ids)),
+        "atlas_decoded": int(decoded),
         "max_center_repeat": int(max_center_repeat),
         "cap_fallbacks": int(cap_fallbacks),
+        **stats,
     }
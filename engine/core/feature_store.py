@@ -0,0 +1,243 @@
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+
+# -----------------------------
+# Binary, incremental tile feature store
+# -----------------------------
+# Layout (one directory, one "generation" of files at a time):
+#   store.json          header: schema, generation, rows, dead, descriptors, sync info
+#   names.g<N>.txt      tile ids, one per line, append-only
+#   index.g<N>.bin      (mtime_ns, size, alive) per row, append-only, alive flipped in place
+#   <desc>.g<N>.bin     one columnar (rows, dim) matrix per descriptor, append-only
+# Changes are appended; the old row of a changed/removed tile is only marked dead.
+# Compaction rewrites live rows into the next generation, header last (atomic switch).
+SCHEMA_VERSION = 1
+
+DEFAULT_DESCRIPTORS: Dict[str, Tuple[str, int]] = {"lab": ("float32", 3)}
+
+INDEX_DTYPE = np.dtype([("mtime_ns", "<i8"), ("size", "<i8"), ("alive", "u1")])
+
+COMPACT_MIN_DEAD = 1024
+COMPACT_DEAD_RATIO = 0.25
+
+
+class TileFeatureStore:
+    """Columnar feature matrices + compact id/mtime/size index, memory-mapped on load."""
+
+    def __init__(self, root: str | Path, descriptors: Dict[str, Tuple[str, int]] | None = None):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.descriptors = {k: (str(v[0]), int(v[1])) for k, v in (descriptors or DEFAULT_DESCRIPTORS).items()}
+
+        header = self._read_header()
+        if header is None or not self._compatible(header):
+            # new store, or schema/descriptor change: start a fresh generation
+            old_gen = int(header.get("generation", 0)) if header else 0
+            for p in self.root.glob(f"*.g{old_gen}.*"):
+                p.unlink(missing_ok=True)
+            header = self._empty_header(old_gen + 1)
+            self._write_header(header)
+        self.header = header
+        self._open()
+
+    # ---------- header ----------
+    @property
+    def _header_file(self) -> Path:
+        return self.root / "store.json"
+
+    def _read_header(self) -> Dict | None:
+        if not self._header_file.exists():
+            return None
+        try:
+            return json.loads(self._header_file.read_text(encoding="utf-8"))
+        except Exception:
+            return None
+
+    def _compatible(self, header: Dict) -> bool:
+        stored = {k: (str(v[0]), int(v[1])) for k, v in header.get("descriptors", {}).items()}
+        return header.get("schema") == SCHEMA_VERSION and stored == self.descriptors
+
+    def _empty_header(self, generation: int) -> Dict:
+        return {
+            "schema": SCHEMA_VERSION,
+            "generation": int(generation),
+            "rows": 0,
+            "dead": 0,
+            "descriptors": {k: [v[0], v[1]] for k, v in self.descriptors.items()},
+            "sync": {},
+        }
+
+    def _write_header(self, header: Dict) -> None:
+        tmp = self._header_file.with_suffix(".tmp")
+        tmp.write_text(json.dumps(header, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(self._header_file)
+
+    # ---------- files ----------
+    def _names_file(self, gen: int) -> Path:
+        return self.root / f"names.g{gen}.txt"
+
+    def _index_file(self, gen: int) -> Path:
+        return self.root / f"index.g{gen}.bin"
+
+    def _desc_file(self, name: str, gen: int) -> Path:
+        return self.root / f"{name}.g{gen}.bin"
+
+    def _data_files(self, gen: int) -> List[Path]:
+        return [self._names_file(gen), self._index_file(gen)] + [self._desc_file(n, gen) for n in self.descriptors]
+
+    def _open(self) -> None:
+        gen = int(self.header["generation"])
+        rows = int(self.header["rows"])
+
+        if rows == 0:
+            self.names: List[str] = []
+            self.index = np.zeros(0, dtype=INDEX_DTYPE)
+            self.desc = {n: np.zeros((0, dim), dtype=dt) for n, (dt, dim) in self.descriptors.items()}
+        else:
+            text = self._names_file(gen).read_text(encoding="utf-8")
+            self.names = text.split("\n")[:rows]
+            self.index = np.memmap(self._index_file(gen), dtype=INDEX_DTYPE, mode="r+", shape=(rows,))
+            self.desc = {
+                n: np.memmap(self._desc_file(n, gen), dtype=dt, mode="r", shape=(rows, dim))
+                for n, (dt, dim) in self.descriptors.items()
+            }
+
+        alive = self.index["alive"].astype(bool) if rows else np.zeros(0, dtype=bool)
+        self.live: Dict[str, int] = {self.names[i]: int(i) for i in np.flatnonzero(alive)}
+
+    def _truncate_to_header(self) -> None:
+        # drop bytes from an append that crashed before its header update
+        gen = int(self.header["generation"])
+        rows = int(self.header["rows"])
+        sizes = {self._index_file(gen): rows * INDEX_DTYPE.itemsize}
+        for n, (dt, dim) in self.descriptors.items():
+            sizes[self._desc_file(n, gen)] = rows * np.dtype(dt).itemsize * dim
+        for path, size in sizes.items():
+            if path.exists() and path.stat().st_size != size:
+                os.truncate(path, size)
+
+        names_file = self._names_file(gen)
+        if names_file.exists():
+            lines = names_file.read_text(encoding="utf-8").split("\n")
+            if lines and lines[-1] == "":
+                lines.pop()
+            if len(lines) != rows:
+                names_file.write_text("".join(x + "\n" for x in lines[:rows]), encoding="utf-8")
+
+    # ---------- queries ----------
+    @property
+    def rows(self) -> int:
+        return int(self.header["rows"])
+
+    @property
+    def dead(self) -> int:
+        return int(self.header["dead"])
+
+    def lookup(self, name: str) -> Tuple[int, int, int] | None:
+        """(row, mtime_ns, size) of the live row for `name`, or None."""
+        row = self.live.get(name)
+        if row is None:
+            return None
+        rec = self.index[row]
+        return row, int(rec["mtime_ns"]), int(rec["size"])
+
+    def live_sorted(self) -> List[Tuple[str, int]]:
+        return sorted(self.live.items())
+
+    def descriptor(self, name: str) -> np.ndarray:
+        return self.desc[name]
+
+    # ---------- updates ----------
+    def mark_dead(self, rows: Sequence[int]) -> None:
+        rows = [int(r) for r in rows]
+        if not rows:
+            return
+        self.index["alive"][rows] = 0
+        self.index.flush()
+        for r in rows:
+            self.live.pop(self.names[r], None)
+        self.header["dead"] = int(self.header["dead"]) + len(rows)
+
+    def append(
+        self,
+        names: Sequence[str],
+        mtimes_ns: Sequence[int],
+        sizes: Sequence[int],
+        desc: Dict[str, np.ndarray],
+    ) -> None:
+        k = len(names)
+        if k == 0:
+            return
+        for n in names:
+            if "\n" in n:
+                raise ValueError(f"tile id with newline is not storable: {n!r}")
+        for n, (dt, dim) in self.descriptors.items():
+            if n not in desc or np.asarray(desc[n]).shape != (k, dim):
+                raise ValueError(f"descriptor '{n}' must be shaped ({k}, {dim})")
+
+        self._truncate_to_header()
+        gen = int(self.header["generation"])
+
+        rec = np.zeros(k, dtype=INDEX_DTYPE)
+        rec["mtime_ns"] = np.asarray(mtimes_ns, dtype=np.int64)
+        rec["size"] = np.asarray(sizes, dtype=np.int64)
+        rec["alive"] = 1
+
+        # the current memmaps must not outlive the files we grow
+        self.index = np.zeros(0, dtype=INDEX_DTYPE)
+        self.desc = {}
+
+        with open(self._index_file(gen), "ab") as f:
+            f.write(rec.tobytes())
+        for n, (dt, dim) in self.descriptors.items():
+            with open(self._desc_file(n, gen), "ab") as f:
+                f.write(np.ascontiguousarray(desc[n], dtype=dt).tobytes())
+        with open(self._names_file(gen), "a", encoding="utf-8") as f:
+            f.write("".join(n + "\n" for n in names))
+
+        self.header["rows"] = int(self.header["rows"]) + k
+        self._write_header(self.header)
+        self._open()
+
+    def needs_compaction(self) -> bool:
+        dead = self.dead
+        return dead >= COMPACT_MIN_DEAD and dead >= COMPACT_DEAD_RATIO * max(1, self.rows)
+
+    def compact(self) -> None:
+        """Rewrite live rows (sorted by tile id) into a new generation."""
+        old_gen = int(self.header["generation"])
+        new_gen = old_gen + 1
+        keep = [row for _, row in self.live_sorted()]
+
+        self._names_file(new_gen).write_text("".join(self.names[r] + "\n" for r in keep), encoding="utf-8")
+        self._index_file(new_gen).write_bytes(np.asarray(self.index[keep]).tobytes())
+        for n, (dt, dim) in self.descriptors.items():
+            self._desc_file(n, new_gen).write_bytes(np.ascontiguousarray(self.desc[n][keep], dtype=dt).tobytes())
+
+        self.index = np.zeros(0, dtype=INDEX_DTYPE)
+        self.desc = {}
+
+        self.header["generation"] = new_gen
+        self.header["rows"] = len(keep)
+        self.header["dead"] = 0
+        self._write_header(self.header)
+
+        for p in self._data_files(old_gen):
+            p.unlink(missing_ok=True)
+        self._open()
+
+    def commit(self, sync: Dict | None = None) -> None:
+        """Persist header (dead count, sync info); compacts first if too many dead rows."""
+        if sync is not None:
+            self.header["sync"] = sync
+        if self.needs_compaction():
+            self.compact()
+        else:
+            self._write_header(self.header)
@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Iterable, Tuple
+
+import numpy as np
+
+from engine.core.blend_math import foci_mask
+
+
+# (cx, cy, rx, ry): center in [0..1] image coords, radii in the [-1, 1] normalized space
+Focus = Tuple[float, float, float, float]
+
+_MEMO_SIZE = 8
+# above this, the pixel mask is never materialized whole (streamed print renders)
+FULL_MASK_MAX_PX = 1 << 25
+_MEMO: "OrderedDict[str, FocusMap]" = OrderedDict()
+
+
+def _grid_center_mask(grid_w: int, grid_h: int, foci: Tuple[Focus, ...]) -> np.ndarray:
+    """Cell-center membership, bool (grid_h, grid_w). Same float ops as the former per-cell tests."""
+    cols = np.arange(grid_w, dtype=np.float64)
+    rows = np.arange(grid_h, dtype=np.float64)
+    out = np.zeros((grid_h, grid_w), dtype=bool)
+    for cx, cy, rx, ry in foci:
+        nx = ((cols + 0.5) / grid_w) * 2.0 - 1.0 - (cx * 2.0 - 1.0)
+        ny = ((rows + 0.5) / grid_h) * 2.0 - 1.0 - (cy * 2.0 - 1.0)
+        out |= ((nx * nx)[None, :] / (rx * rx) + (ny * ny)[:, None] / (ry * ry)) <= 1.0
+    return out
+
+
+class FocusMap:
+    """
+    Focus geometry computed once for (width, height, tile_size, foci, feather):
+    - center_mask: bool (grid_h, grid_w), cell centers inside any focus ellipse
+    - mask():      float32 (H, W), pixel-level feathered union of the foci (lazy)
+    Alpha (TARGET strength) = alpha_edge + (alpha_center - alpha_edge) * mask.
+    """
+
+    def __init__(
+        self,
+        width: int,
+        height: int,
+        tile_size: int,
+        foci: Iterable[Focus],
+        feather: float = 0.0,
+        cache_dir: str | Path | None = None,
+    ):
+        self.width = int(width)
+        self.height = int(height)
+        self.tile_size = max(1, int(tile_size))
+        self.foci: Tuple[Focus, ...] = tuple(tuple(float(v) for v in f) for f in foci)  # type: ignore
+        self.feather = float(feather)
+        self.grid_w = self.width // self.tile_size
+        self.grid_h = self.height // self.tile_size
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+
+        self.center_mask = _grid_center_mask(self.grid_w, self.grid_h, self.foci)
+        self._mask: np.ndarray | None = None
+
+    @property
+    def key(self) -> str:
+        return focus_key(self.width, self.height, self.tile_size, self.foci, self.feather)
+
+    # ---------- pixel level ----------
+    def _disk_file(self) -> Path | None:
+        return None if self.cache_dir is None else self.cache_dir / f"focus_{self.key}.npy"
+
+    def mask(self) -> np.ndarray:
+        if self._mask is not None:
+            return self._mask
+
+        disk = self._disk_file()
+        if disk is not None and disk.exists():
+            try:
+                m = np.load(disk)
+                if m.shape == (self.height, self.width) and m.dtype == np.float32:
+                    self._mask = m
+                    return m
+            except Exception:
+                pass
+
+        m = foci_mask(self.height, self.width, self.foci, self.feather)
+        if disk is not None:
+            disk.parent.mkdir(parents=True, exist_ok=True)
+            # per process / thread temp name: concurrent renders may build the same mask
+            tmp = disk.with_name(f"{disk.stem}.{os.getpid()}_{threading.get_ident()}.tmp.npy")
+            np.save(tmp, m)
+            tmp.replace(disk)
+        self._mask = m
+        return m
+
+    def mask_rows(self, y0: int, y1: int) -> np.ndarray:
+        """
+        Rows [y0, y1) of the pixel mask. Only those rows are computed when no mask is
+        resident and there is no cache_dir, or when the frame exceeds FULL_MASK_MAX_PX.
+        """
+        whole = self.width * self.height <= FULL_MASK_MAX_PX
+        if self._mask is not None or (self.cache_dir is not None and whole):
+            return self.mask()[y0:y1]
+        return foci_mask(self.height, self.width, self.foci, self.feather, y0, y1)
+
+    def alpha_rows(self, alpha_center: float, alpha_edge: float, y0: int, y1: int) -> np.ndarray:
+        a_c, a_e = float(alpha_center), float(alpha_edge)
+        return a_e + (a_c - a_e) * self.mask_rows(y0, y1)
+
+    def alpha_map(self, alpha_center: float, alpha_edge: float) -> np.ndarray:
+        return self.alpha_rows(alpha_center, alpha_edge, 0, self.height)
+
+    def is_center(self, r: int, c: int) -> bool:
+        return bool(self.center_mask[r, c])
+
+
+def focus_key(width: int, height: int, tile_size: int, foci: Iterable[Focus], feather: float) -> str:
+    payload = json.dumps(
+        {
+            "w": int(width),
+            "h": int(height),
+            "s": int(tile_size),
+            "foci": [[float(v) for v in f] for f in foci],
+            "feather": float(feather),
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def get_focus_map(
+    width: int,
+    height: int,
+    tile_size: int,
+    foci: Iterable[Focus],
+    feather: float = 0.0,
+    cache_dir: str | Path | None = None,
+) -> FocusMap:
+    """In-memory memoized FocusMap (pixel masks additionally cached on disk when cache_dir is set)."""
+    foci = tuple(tuple(float(v) for v in f) for f in foci)
+    key = focus_key(width, height, tile_size, foci, feather)
+    fm = _MEMO.get(key)
+    if fm is not None:
+        _MEMO.move_to_end(key)
+        if fm.cache_dir is None and cache_dir is not None:
+            fm.cache_dir = Path(cache_dir)
+        return fm
+
+    fm = FocusMap(width, height, tile_size, foci, feather, cache_dir=cache_dir)  # type: ignore
+    _MEMO[key] = fm
+    if len(_MEMO) > _MEMO_SIZE:
+        _MEMO.popitem(last=False)
+    return fm
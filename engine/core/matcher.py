@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import math
+import random
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+from engine.core.color_match import TileFeature
+from engine.core.tile_index import Exclusion, KDTreeIndex
+
+
+class TileMatcher:
+    """
+    Vectorized A4 matcher (brute force).
+    - tile Labs live in one contiguous float32 (N,3) matrix
+    - A3 center/edge penalties, center counts and the B1 cap are per-tile vectors,
+      updated in place only for the tile that was just placed
+    Picks are identical to the former per-cell Python loop for a given seed.
+    With an exact Lab index (use_index) and no sampling, picks come from k-nearest
+    queries that skip capped tiles; they are identical to the brute-force picks.
+    """
+
+    def __init__(
+        self,
+        feats: Sequence[TileFeature],
+        rng: random.Random,
+        top_k: int = 25,
+        sample: int = 0,
+        a3_enable: bool = True,
+        k_center: float = 1.30,
+        k_edge: float = 0.05,
+        cap_center: int = 3,
+        pick_mode: str = "best",
+        labs: np.ndarray | None = None,
+        tile_ids: Sequence[str] | None = None,
+    ):
+        # tile_ids + labs: the features as arrays (a warm tile pool); feats are then not read
+        self.tile_ids: List[str] = [f.tile_id for f in feats] if tile_ids is None else list(tile_ids)
+        if not self.tile_ids:
+            raise ValueError("TileMatcher needs at least one tile feature")
+        # labs: precomputed (N,3) float32 Labs of feats (shared by a warm tile pool)
+        if labs is None:
+            labs = np.array([f.lab for f in feats], dtype=np.float32)
+        self.labs = np.ascontiguousarray(labs, dtype=np.float32).reshape(-1, 3)
+
+        self.rng = rng
+        self.top_k = int(top_k)
+        self.sample = int(sample)
+        self.a3_enable = bool(a3_enable)
+        self.k_center = float(k_center)
+        self.k_edge = float(k_edge)
+        self.cap_center = int(cap_center)
+        self.pick_mode = pick_mode
+
+        n = len(self.tile_ids)
+        self.center_counts = np.zeros(n, dtype=np.int32)
+        self.center_penalty = np.ones(n, dtype=np.float64)
+        self.edge_penalty = np.ones(n, dtype=np.float64)
+        self.capped = np.zeros(n, dtype=bool)
+        self.cap_budget: np.ndarray | None = None
+
+        self.cap_fallbacks = 0
+        self.max_center_repeat = 0
+
+        self.index: KDTreeIndex | None = None
+        self._capped_ex: Exclusion | None = None
+
+    @classmethod
+    def from_labs(
+        cls, labs: np.ndarray, rng: random.Random, tile_ids: Sequence[str] | None = None, **kwargs
+    ) -> "TileMatcher":
+        """Matcher over bare (N,3) Labs; tile ids default to row numbers (placement workers)."""
+        labs = np.ascontiguousarray(labs, dtype=np.float32).reshape(-1, 3)
+        ids = [str(i) for i in range(labs.shape[0])] if tile_ids is None else tile_ids
+        return cls([], rng, labs=labs, tile_ids=ids, **kwargs)
+
+    def __len__(self) -> int:
+        return len(self.tile_ids)
+
+    def load_counts(self, center_counts: np.ndarray, cap_budget: np.ndarray | None = None) -> None:
+        """
+        Reset A3/B1 state to a center usage snapshot (same penalties commit() would reach).
+        cap_budget: per-tile center cap used instead of cap_center (e.g. one band's share of it).
+        """
+        cc = np.asarray(center_counts, dtype=np.int32).copy()
+        self.cap_budget = None if cap_budget is None else np.asarray(cap_budget, dtype=np.int32)
+        self.center_counts = cc
+        self.center_penalty = 1.0 + (1.0 - np.exp(-self.k_center * cc.astype(np.float64)))
+        self.edge_penalty = 1.0 + 0.10 * (1.0 - np.exp(-self.k_edge * cc.astype(np.float64)))
+        if self.cap_center <= 0:
+            self.capped = np.zeros(cc.shape[0], dtype=bool)
+        else:
+            self.capped = cc >= (self.cap_center if self.cap_budget is None else self.cap_budget)
+        self.max_center_repeat = int(cc.max()) if cc.size else 0
+        if self.index is not None:
+            self._capped_ex = self.index.exclusion(self.capped)
+
+    def use_index(self, index: KDTreeIndex) -> None:
+        """Serve full-library picks (sample=0) from an exact Lab index over the same tiles."""
+        if index.n != len(self.tile_ids):
+            raise ValueError(f"Tile index holds {index.n} tiles, matcher has {len(self.tile_ids)}")
+        self.index = index
+        self._capped_ex = index.exclusion(self.capped)
+
+    def _candidates(self) -> np.ndarray | None:
+        n = len(self.tile_ids)
+        if self.sample and 0 < self.sample < n:
+            # same RNG consumption as rng.sample(feats, sample)
+            return np.array(self.rng.sample(range(n), self.sample), dtype=np.intp)
+        return None
+
+    def distances(self, t_lab: Tuple[float, float, float], idx: np.ndarray | None = None) -> np.ndarray:
+        """Raw Lab distances (float64) from one target Lab to all tiles (or the `idx` subset)."""
+        labs = self.labs if idx is None else self.labs[idx]
+        diff = labs - np.asarray(t_lab, dtype=np.float64)
+        return np.sqrt(diff[:, 0] ** 2 + diff[:, 1] ** 2 + diff[:, 2] ** 2)
+
+    def _fallback(self, is_center: bool) -> int:
+        # cap blocked everything in center -> fallback to least used
+        if is_center:
+            self.cap_fallbacks += 1
+            pool = np.flatnonzero(self.center_counts == self.center_counts.min())
+            return int(self.rng.choice(pool.tolist()))
+        return int(self.rng.choice(range(len(self.tile_ids))))
+
+    def _pick_indexed(self, t_lab: Tuple[float, float, float], is_center: bool) -> int:
+        penalty = (self.center_penalty if is_center else self.edge_penalty) if self.a3_enable else None
+        exclusion = self._capped_ex if is_center and self.cap_center > 0 else None
+        k = max(1, self.top_k) if self.pick_mode == "topk_random" else 1
+        top, _ = self.index.query(t_lab, k, penalty, exclusion)
+        if top.size == 0:
+            return self._fallback(is_center)
+        if self.pick_mode == "topk_random":
+            return int(self.rng.choice(top.tolist()))
+        return int(top[0])
+
+    def pick(
+        self,
+        t_lab: Tuple[float, float, float],
+        is_center: bool,
+        dist_row: np.ndarray | None = None,
+        candidates: np.ndarray | None = None,
+    ) -> int:
+        """
+        Return the tile index for one cell (does not update counts, see commit()).
+        dist_row: precomputed (N,) distances to every tile (e.g. sub-cell descriptors) used instead of the Lab distance.
+        candidates: restrict the pick to these tile indices (no sampling); dist_row is then aligned with them.
+        """
+        if candidates is not None:
+            cand = np.asarray(candidates, dtype=np.intp)
+            d = self.distances(t_lab, cand) if dist_row is None else dist_row
+        else:
+            cand = self._candidates()
+            if dist_row is None:
+                if cand is None and self.index is not None:
+                    return self._pick_indexed(t_lab, is_center)
+                d = self.distances(t_lab, cand)
+            else:
+                d = dist_row if cand is None else dist_row[cand]
+
+        if self.a3_enable:
+            penalty = self.center_penalty if is_center else self.edge_penalty
+            d = d * (penalty if cand is None else penalty[cand])
+
+        # B1: cap reuse only in center
+        if is_center and self.cap_center > 0:
+            capped = self.capped if cand is None else self.capped[cand]
+            pos = np.flatnonzero(~capped)
+        else:
+            pos = np.arange(d.shape[0])
+
+        if pos.size == 0:
+            return self._fallback(is_center)
+
+        dv = d[pos]
+        if self.pick_mode == "topk_random":
+            top = pos[self._stable_topk(dv, max(1, min(self.top_k, pos.size)))]
+            choice = self.rng.choice(top.tolist())
+        else:
+            # "best" = deterministic, less noise (argmin keeps the first of equal scores)
+            choice = int(pos[int(np.argmin(dv))])
+
+        return int(choice if cand is None else cand[choice])
+
+    @staticmethod
+    def _stable_topk(d: np.ndarray, k: int) -> np.ndarray:
+        """Positions of the k smallest values, ordered like a stable sort (ties keep input order)."""
+        if k >= d.shape[0]:
+            return np.argsort(d, kind="stable")
+        part = np.argpartition(d, k - 1)[:k]
+        thr = d[part].max()
+        below = np.flatnonzero(d < thr)
+        ties = np.flatnonzero(d == thr)[: k - below.size]
+        top = np.concatenate([below, ties])
+        return top[np.lexsort((top, d[top]))]
+
+    def commit(self, idx: int, is_center: bool) -> None:
+        """Record a placed tile: update its count, penalties and cap flag in place."""
+        if not is_center:
+            return
+        cc = int(self.center_counts[idx]) + 1
+        self.center_counts[idx] = cc
+        self.center_penalty[idx] = 1.0 + (1.0 - math.exp(-self.k_center * cc))
+        self.edge_penalty[idx] = 1.0 + 0.10 * (1.0 - math.exp(-self.k_edge * cc))
+        cap = self.cap_center if self.cap_budget is None else int(self.cap_budget[idx])
+        self.capped[idx] = self.cap_center > 0 and cc >= cap
+        if self._capped_ex is not None and self.capped[idx]:
+            self._capped_ex.exclude(idx)
+        if cc > self.max_center_repeat:
+            self.max_center_repeat = cc
@@ -0,0 +1,310 @@
+from __future__ import annotations
+
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from engine.core.matcher import TileMatcher
+
+
+# -----------------------------
+# Band-parallel placement (cap budgets)
+# -----------------------------
+# The grid is cut into `bands` horizontal bands of whole rows. The B1 center cap is the
+# only state the bands would have to share, so it is split up front instead of being
+# reconciled after the fact:
+#   demand   (parallel) every center cell names its `depth` nearest usable tiles;
+#   budgets  (serial, vectorized) each tile's cap is shared among the bands in proportion
+#            to their demand for it (largest remainder); tiles nobody asked for go to the
+#            bands whose budget falls short of their share of the center cells;
+#   place    (parallel, one pass) each band runs the raster loop with its budget as the
+#            per-tile cap. Budgets of a tile sum to the cap, so bands cannot conflict;
+#   repair   (serial) center cells whose band ran out of budget are re-picked in raster
+#            order against the merged counts, with the raster loop's cap and fallback.
+# A3 penalties see the band's own center usage only.
+# Per-cell RNGs are keyed by (seed, cell, attempt), so the mosaic depends on the seed
+# and the band count only, never on the number of workers or on scheduling.
+
+
+@dataclass
+class BandPlacement:
+    placement: np.ndarray  # (cells,) tile index, -1 = unusable tile (not counted)
+    center_counts: np.ndarray
+    cap_fallbacks: int
+    max_center_repeat: int
+    repairs: int          # center cells re-picked serially (band out of budget)
+    demand_ms: float
+    place_ms: float
+    repair_ms: float      # budgets + repair (the serial part)
+    critical_ms: float    # slowest demand chunk + slowest band + serial part (wall time with one worker per band)
+
+
+def _cell_rng(seed: int, cell: int, attempt: int) -> random.Random:
+    return random.Random(f"{seed}:{cell}:{attempt}")
+
+
+class _LazyCellRng:
+    """Seeds the cell's RNG on first use ("best" picks without sampling never draw)."""
+
+    def __init__(self, seed: int, cell: int, attempt: int):
+        self._key = (seed, cell, attempt)
+        self._rng: random.Random | None = None
+
+    def __getattr__(self, name: str):
+        if self._rng is None:
+            self._rng = _cell_rng(*self._key)
+        return getattr(self._rng, name)
+
+
+# shared inputs: (name, dtype, shape) -> attached once per worker
+_SHARED = ("labs", "target_labs", "center", "ok")
+_worker_state: Dict = {}
+
+
+def _attach(spec: Dict[str, Tuple[str, str, Tuple[int, ...]]], matcher_kwargs: Dict) -> None:
+    handles = {k: shared_memory.SharedMemory(name=spec[k][0]) for k in _SHARED}
+    arrays = {k: np.ndarray(spec[k][2], dtype=spec[k][1], buffer=handles[k].buf) for k in _SHARED}
+    _worker_state.clear()
+    _worker_state.update(
+        handles=handles,
+        arrays=arrays,
+        matcher=TileMatcher.from_labs(arrays["labs"], random.Random(0), **matcher_kwargs),
+    )
+
+
+def _demand(cells: np.ndarray, seed: int, depth: int) -> Tuple[np.ndarray, float]:
+    """(cells, depth) nearest usable tiles by raw Lab distance (-1 = none), from the cell's first candidate sample."""
+    t0 = time.perf_counter()
+    a = _worker_state["arrays"]
+    sample = _worker_state["matcher"].sample
+    labs, ok = a["labs"], a["ok"]
+    n_tiles = labs.shape[0]
+    usable = np.flatnonzero(ok)
+    depth = min(int(depth), usable.size)
+    out = np.full((cells.shape[0], depth), -1, dtype=np.intp)
+    if depth == 0:
+        return out, 0.0
+    if 0 < sample < n_tiles:
+        # same draw as the cell's first pick (attempt 0)
+        for j, cell in enumerate(cells.tolist()):
+            cand = np.array(_cell_rng(seed, cell, 0).sample(range(n_tiles), sample), dtype=np.intp)
+            cand = cand[ok[cand]]
+            k = min(depth, cand.size)
+            if k:
+                d = ((labs[cand] - a["target_labs"][cell]) ** 2).sum(axis=1)
+                out[j, :k] = cand[np.argpartition(d, k - 1)[:k]]
+    else:
+        ul = labs[usable]
+        block = max(1, (1 << 22) // usable.size)
+        for s in range(0, cells.shape[0], block):
+            t = a["target_labs"][cells[s : s + block]]
+            d = ((t[:, None, :] - ul[None, :, :]) ** 2).sum(axis=2)
+            out[s : s + block] = usable[np.argpartition(d, depth - 1, axis=1)[:, :depth]]
+    return out, (time.perf_counter() - t0) * 1000.0
+
+
+def _place(cells: np.ndarray, budget: np.ndarray | None, seed: int) -> Tuple[np.ndarray, np.ndarray, float]:
+    """One band in raster order under its cap budget -> picks, out-of-budget flags, ms."""
+    t0 = time.perf_counter()
+    a = _worker_state["arrays"]
+    m: TileMatcher = _worker_state["matcher"]
+    m.load_counts(np.zeros(a["labs"].shape[0], dtype=np.int32), budget)
+    m.cap_fallbacks = 0
+
+    tiles = np.full(cells.shape[0], -1, dtype=np.intp)
+    overflow = np.zeros(cells.shape[0], dtype=bool)
+    for j, cell in enumerate(cells.tolist()):
+        is_center = bool(a["center"][cell])
+        m.rng = _LazyCellRng(seed, cell, 0)
+        before = m.cap_fallbacks
+        ti = m.pick(a["target_labs"][cell], is_center)
+        if m.cap_fallbacks != before:
+            overflow[j] = True
+            continue
+        tiles[j] = ti
+        if a["ok"][ti]:
+            m.commit(ti, is_center)
+    return tiles, overflow, (time.perf_counter() - t0) * 1000.0
+
+
+def _demand_task(args) -> Tuple[np.ndarray, float]:
+    return _demand(*args)
+
+
+def _place_task(args) -> Tuple[np.ndarray, np.ndarray, float]:
+    return _place(*args)
+
+
+def _band_bounds(grid_w: int, grid_h: int, bands: int) -> List[Tuple[int, int]]:
+    bands = max(1, min(int(bands), grid_h))
+    edges = np.linspace(0, grid_h, bands + 1).round().astype(int)
+    return [(int(edges[b]) * grid_w, int(edges[b + 1]) * grid_w) for b in range(bands)]
+
+
+def _split(total: int, weights: np.ndarray) -> np.ndarray:
+    """`total` units in proportion to `weights` (largest remainder, ties to the lower index)."""
+    w = np.asarray(weights, dtype=np.float64)
+    if total <= 0 or w.sum() <= 0:
+        return np.zeros(w.shape[0], dtype=np.int64)
+    share = w * (total / w.sum())
+    out = np.floor(share).astype(np.int64)
+    out[np.argsort(-(share - out), kind="stable")[: total - int(out.sum())]] += 1
+    return out
+
+
+def _budgets(demand: np.ndarray, need: np.ndarray, cap: int) -> np.ndarray:
+    """
+    (bands, tiles) per-band share of every tile's center cap; each column sums to `cap`.
+    demand: (bands, tiles) how often a band's center cells named the tile; need: center cells per band.
+    """
+    bands, n_tiles = demand.shape
+    out = np.zeros((bands, n_tiles), dtype=np.int32)
+
+    total = demand.sum(axis=0)
+    asked = np.flatnonzero(total)
+    if asked.size:
+        share = demand[:, asked] * (cap / total[asked])
+        base = np.floor(share).astype(np.int32)
+        extra = (np.arange(bands)[:, None] < (cap - base.sum(axis=0))[None, :]).astype(np.int32)
+        order = np.argsort(-(share - base), axis=0, kind="stable")
+        np.put_along_axis(base, order, np.take_along_axis(base, order, axis=0) + extra, axis=0)
+        out[:, asked] = base
+
+    free = np.flatnonzero(total == 0)
+    if free.size:
+        # unasked tiles (whole caps, in index order) to the bands furthest below their share
+        fair = cap * n_tiles * need / max(1, int(need.sum()))
+        short = np.maximum(0.0, fair - out.sum(axis=1))
+        quota = _split(cap * free.size, short if short.sum() > 0 else need)
+        np.add.at(out, (np.repeat(np.arange(bands), quota), np.repeat(free, cap)), 1)
+    return out
+
+
+def place_bands(
+    target_labs: np.ndarray,
+    center: np.ndarray,
+    tile_labs: np.ndarray,
+    ok: np.ndarray,
+    grid_w: int,
+    grid_h: int,
+    seed: int,
+    bands: int = 32,
+    workers: int = 1,
+    depth: int = 4,
+    **matcher_kwargs,
+) -> BandPlacement:
+    """
+    Deterministic band-parallel greedy placement (same pick rule and cap as TileMatcher).
+    workers: 1 = in-process, N = process pool of N, -1 = one per CPU; results do not depend on it.
+    depth: nearest tiles per center cell that count as demand when the cap is shared out.
+    matcher_kwargs: TileMatcher settings (top_k, sample, a3_enable, k_center, k_edge, cap_center, pick_mode).
+    """
+    n_cells = target_labs.shape[0]
+    n_tiles = tile_labs.shape[0]
+    cap = int(matcher_kwargs.get("cap_center", 3))
+    workers = (os.cpu_count() or 1) if workers < 0 else max(1, int(workers))
+
+    inputs = {
+        "labs": np.ascontiguousarray(tile_labs, dtype=np.float32).reshape(-1, 3),
+        "target_labs": np.ascontiguousarray(target_labs, dtype=np.float32).reshape(-1, 3),
+        "center": np.ascontiguousarray(center, dtype=bool).reshape(-1),
+        "ok": np.ascontiguousarray(ok, dtype=bool).reshape(-1),
+    }
+    handles: Dict[str, shared_memory.SharedMemory] = {}
+    spec: Dict[str, Tuple[str, str, Tuple[int, ...]]] = {}
+    for k, arr in inputs.items():
+        shm = shared_memory.SharedMemory(create=True, size=max(1, arr.nbytes))
+        np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+        handles[k] = shm
+        spec[k] = (shm.name, arr.dtype.str, arr.shape)
+    center_v = inputs["center"]
+    ok_v = inputs["ok"]
+
+    band_cells = [np.arange(lo, hi, dtype=np.intp) for lo, hi in _band_bounds(grid_w, grid_h, bands)]
+    band_of = np.repeat(np.arange(len(band_cells)), [c.size for c in band_cells])
+    placement = np.full(n_cells, -1, dtype=np.intp)
+    demand_ms = place_ms = repair_ms = critical_ms = 0.0
+
+    pool = None
+    try:
+        if workers > 1 and len(band_cells) > 1:
+            pool = ProcessPoolExecutor(max_workers=workers, initializer=_attach, initargs=(spec, matcher_kwargs))
+        else:
+            _attach(spec, matcher_kwargs)
+        run = pool.map if pool is not None else map
+
+        budgets: List[np.ndarray | None] = [None] * len(band_cells)
+        centers = np.flatnonzero(center_v)
+        if cap > 0 and centers.size:
+            # demand: center cells in equal chunks (center cells cluster in the middle bands)
+            t0 = time.perf_counter()
+            chunks = [c for c in np.array_split(centers, len(band_cells)) if c.size]
+            parts = list(run(_demand_task, [(c, int(seed), depth) for c in chunks]))
+            near = np.concatenate([p[0] for p in parts])
+            t1 = time.perf_counter()
+            demand_ms = (t1 - t0) * 1000.0
+            critical_ms += max(p[1] for p in parts)
+
+            bands_n = len(band_cells)
+            keep = near >= 0
+            rows = np.broadcast_to(band_of[centers][:, None], near.shape)[keep]
+            demand = np.bincount(rows * n_tiles + near[keep], minlength=bands_n * n_tiles).reshape(bands_n, n_tiles)
+            need = np.bincount(band_of[centers], minlength=bands_n)
+            budgets = list(_budgets(demand, need, cap))
+            repair_ms += (time.perf_counter() - t1) * 1000.0
+
+        t0 = time.perf_counter()
+        results = list(run(_place_task, [(cells, b, int(seed)) for cells, b in zip(band_cells, budgets)]))
+        t1 = time.perf_counter()
+        place_ms = (t1 - t0) * 1000.0
+        critical_ms += max((r[2] for r in results), default=0.0)
+
+        repair: List[np.ndarray] = []
+        for cells, (tiles, overflow, _) in zip(band_cells, results):
+            placed = ~overflow
+            tiles = np.where(placed, tiles, 0)
+            placement[cells] = np.where(placed & ok_v[tiles], tiles, -1)
+            repair.append(cells[overflow])
+        repair_cells = np.concatenate(repair) if repair else np.zeros(0, dtype=np.intp)
+
+        # repair: raster order against the merged counts, exactly as the raster loop would
+        used = placement[center_v]
+        counts = np.bincount(used[used >= 0], minlength=n_tiles).astype(np.int32)
+        m = TileMatcher.from_labs(inputs["labs"], random.Random(0), **matcher_kwargs)
+        m.load_counts(counts)
+        for cell in repair_cells.tolist():
+            m.rng = _LazyCellRng(seed, cell, 1)
+            ti = m.pick(inputs["target_labs"][cell], True)
+            if ok_v[ti]:
+                placement[cell] = ti
+                m.commit(ti, True)
+        repair_ms += (time.perf_counter() - t1) * 1000.0
+        critical_ms += repair_ms
+        final_counts = m.center_counts.copy()
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True)
+        for h in _worker_state.pop("handles", {}).values():
+            h.close()
+        _worker_state.clear()
+        for shm in handles.values():
+            shm.close()
+            shm.unlink()
+
+    return BandPlacement(
+        placement=placement,
+        center_counts=final_counts,
+        cap_fallbacks=m.cap_fallbacks,
+        max_center_repeat=int(final_counts.max()) if final_counts.size else 0,
+        repairs=int(repair_cells.size),
+        demand_ms=demand_ms,
+        place_ms=place_ms,
+        repair_ms=repair_ms,
+        critical_ms=critical_ms,
+    )
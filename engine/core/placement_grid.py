@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import json
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple
+
+import numpy as np
+
+
+# -----------------------------
+# Placement grid (array-backed)
+# -----------------------------
+# One int32 (grid_h, grid_w) array of tile indices (-1 = empty cell) + the interned tile-id
+# table the indices point into. 4 bytes per cell instead of an (r, c, tile_id) tuple, and
+# every A3/B1 metric is a bincount over a cell mask.
+# On disk: <name>.npy (the index array) + <name>.tiles.json (tile-id table).
+EMPTY = -1
+
+
+@dataclass
+class RepeatStats:
+    total: int                  # placed cells in the mask
+    unique: int                 # distinct tiles among them
+    dup_rate: float             # 1 - unique / total
+    max_repeat: int
+    top: List[Tuple[str, int]] = field(default_factory=list)  # most repeated (tile_id, count)
+
+
+@dataclass
+class PlacementGrid:
+    tiles: np.ndarray           # int32 (grid_h, grid_w)
+    tile_ids: Sequence[str]
+
+    @classmethod
+    def empty(cls, grid_w: int, grid_h: int, tile_ids: Sequence[str]) -> "PlacementGrid":
+        return cls(np.full((grid_h, grid_w), EMPTY, dtype=np.int32), tile_ids)
+
+    @classmethod
+    def from_indices(cls, indices: np.ndarray, grid_w: int, grid_h: int, tile_ids: Sequence[str]) -> "PlacementGrid":
+        """Flat raster-order (or (grid_h, grid_w)) tile indices, -1 for empty cells."""
+        return cls(np.asarray(indices, dtype=np.int32).reshape(grid_h, grid_w), tile_ids)
+
+    @classmethod
+    def from_tuples(cls, placements: Iterable[Tuple[int, int, str]], grid_w: int, grid_h: int) -> "PlacementGrid":
+        """Legacy [(r, c, tile_id), ...] list; tile ids are interned in first-seen order."""
+        grid = cls.empty(grid_w, grid_h, [])
+        table: Dict[str, int] = {}
+        for r, c, tile_id in placements:
+            grid.tiles[r, c] = table.setdefault(tile_id, len(table))
+        grid.tile_ids = list(table)
+        return grid
+
+    @property
+    def grid_h(self) -> int:
+        return int(self.tiles.shape[0])
+
+    @property
+    def grid_w(self) -> int:
+        return int(self.tiles.shape[1])
+
+    def tile_id(self, r: int, c: int) -> str | None:
+        i = int(self.tiles[r, c])
+        return None if i < 0 else self.tile_ids[i]
+
+    def cells(self) -> Iterator[Tuple[int, int, str]]:
+        """(r, c, tile_id) of every placed cell in raster order, for tuple-based consumers."""
+        for idx in np.flatnonzero(self.tiles.reshape(-1) >= 0).tolist():
+            r, c = divmod(idx, self.grid_w)
+            yield r, c, self.tile_ids[int(self.tiles[r, c])]
+
+    # ---------- metrics ----------
+    def counts(self, mask: np.ndarray | None = None) -> np.ndarray:
+        """Placements per tile index (cells in `mask` only), length len(tile_ids)."""
+        t = self.tiles if mask is None else self.tiles[np.asarray(mask, dtype=bool)]
+        t = t[t >= 0]
+        return np.bincount(t.reshape(-1), minlength=len(self.tile_ids))
+
+    def repeat_stats(self, mask: np.ndarray | None = None, top: int = 10) -> RepeatStats:
+        """Repeat metrics of the cells in `mask`; ties in `top` keep first-placed order (raster)."""
+        t = self.tiles.reshape(-1) if mask is None else self.tiles[np.asarray(mask, dtype=bool)]
+        t = t[t >= 0]
+        counts = np.bincount(t, minlength=len(self.tile_ids))
+        total = int(counts.sum())
+        unique = int(np.count_nonzero(counts))
+        used, first = np.unique(t, return_index=True)
+        order = used[np.lexsort((first, -counts[used]))][: max(0, top)]
+        return RepeatStats(
+            total=total,
+            unique=unique,
+            dup_rate=0.0 if total == 0 else 1.0 - unique / total,
+            max_repeat=int(counts.max()) if counts.size else 0,
+            top=[(self.tile_ids[i], int(counts[i])) for i in order.tolist() if counts[i] > 0],
+        )
+
+    # ---------- persistence ----------
+    def save(self, path: str | Path) -> Path:
+        path = Path(path).with_suffix(".npy")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        np.save(path, self.tiles)
+        path.with_suffix(".tiles.json").write_text(json.dumps(list(self.tile_ids), ensure_ascii=False), encoding="utf-8")
+        return path
+
+    @classmethod
+    def load(cls, path: str | Path) -> "PlacementGrid":
+        path = Path(path).with_suffix(".npy")
+        tile_ids = json.loads(path.with_suffix(".tiles.json").read_text(encoding="utf-8"))
+        return cls(np.load(path).astype(np.int32, copy=False), tile_ids)
@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Tuple
+
+import numpy as np
+
+from engine.core.tracing import count
+
+
+STAGE_CACHE_VERSION = 1
+
+
+# -----------------------------
+# Content-addressed stage cache
+# -----------------------------
+# A stage declares the config fields it reads and the inputs it consumes (file
+# fingerprints, upstream stage keys). Its key is a hash of those values, so a tweak
+# only re-runs the stages downstream of what actually changed: an alpha change
+# re-blends from the cached raw mosaic, a cap change re-matches from the cached
+# target Lab grid.
+# Entries: <root>/<stage>/<key>/{<array>.npy, meta.json}; written to a temp dir then
+# renamed (atomic). Least recently used entries are evicted beyond max_mb.
+
+
+@dataclass(frozen=True)
+class StageSpec:
+    name: str
+    config_keys: Tuple[str, ...]
+    inputs: Tuple[str, ...] = ()
+
+
+def fingerprint(*parts) -> str:
+    """Short stable hash of JSON-able parts and/or numpy arrays."""
+    h = hashlib.sha1()
+    for p in parts:
+        if isinstance(p, np.ndarray):
+            h.update(f"{p.dtype.str}{p.shape}".encode())
+            h.update(np.ascontiguousarray(p).tobytes())
+        else:
+            h.update(json.dumps(p, sort_keys=True, default=str).encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()[:24]
+
+
+def _json_scalar(o):
+    if isinstance(o, np.generic):
+        return o.item()
+    raise TypeError(f"Not JSON serializable: {type(o).__name__}")
+
+
+def file_fingerprint(path: str | Path) -> str:
+    p = Path(path)
+    st = p.stat()
+    return fingerprint(str(p.resolve()), st.st_size, st.st_mtime_ns)
+
+
+class StageCache:
+    def __init__(self, root: str | Path, max_mb: int = 1024):
+        self.root = Path(root)
+        self.max_bytes = max(0, int(max_mb)) * 1024 * 1024
+        self.hits: list[str] = []
+
+    def key(self, spec: StageSpec, cfg, inputs: Dict[str, str]) -> str:
+        missing = set(spec.inputs) - set(inputs)
+        if missing:
+            raise KeyError(f"Stage {spec.name} is missing inputs: {sorted(missing)}")
+        values = {k: getattr(cfg, k) for k in spec.config_keys}
+        return fingerprint(STAGE_CACHE_VERSION, spec.name, values, {k: inputs[k] for k in spec.inputs})
+
+    def _entry(self, name: str, key: str) -> Path:
+        return self.root / name / key
+
+    def get(self, name: str, key: str) -> Tuple[Dict[str, np.ndarray], Dict] | None:
+        entry = self._entry(name, key)
+        meta_file = entry / "meta.json"
+        if not meta_file.exists():
+            return None
+        try:
+            meta = json.loads(meta_file.read_text(encoding="utf-8"))
+            arrays = {a: np.load(entry / f"{a}.npy") for a in meta.get("arrays", [])}
+        except Exception:
+            shutil.rmtree(entry, ignore_errors=True)
+            return None
+        os.utime(meta_file)  # LRU clock
+        return arrays, meta.get("meta", {})
+
+    def put(self, name: str, key: str, arrays: Dict[str, np.ndarray], meta: Dict | None = None) -> None:
+        entry = self._entry(name, key)
+        tmp = entry.with_name(f"{key}.tmp{os.getpid()}_{threading.get_ident()}")
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        for a, arr in arrays.items():
+            np.save(tmp / f"{a}.npy", np.ascontiguousarray(arr))
+        record = {"arrays": list(arrays), "meta": meta or {}, "created": time.time()}
+        (tmp / "meta.json").write_text(json.dumps(record, default=_json_scalar), encoding="utf-8")
+        shutil.rmtree(entry, ignore_errors=True)
+        try:
+            tmp.replace(entry)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)  # a concurrent writer got there first
+        self.evict()
+
+    def run(
+        self,
+        spec: StageSpec,
+        cfg,
+        inputs: Dict[str, str],
+        compute: Callable[[], Tuple[Dict[str, np.ndarray], Dict]],
+    ) -> Tuple[Dict[str, np.ndarray], Dict, str]:
+        """Cached outputs of `spec` or compute() (then stored) -> (arrays, meta, key)."""
+        key = self.key(spec, cfg, inputs)
+        got = self.get(spec.name, key)
+        if got is not None:
+            count(f"stage_cache.{spec.name}.hit")
+            self.hits.append(spec.name)
+            return got[0], got[1], key
+        count(f"stage_cache.{spec.name}.miss")
+        arrays, meta = compute()
+        self.put(spec.name, key, arrays, meta)
+        return arrays, meta, key
+
+    # ---------- eviction ----------
+    def _entries(self) -> Iterable[Tuple[float, int, Path]]:
+        if not self.root.exists():
+            return []
+        out = []
+        for meta_file in self.root.glob("*/*/meta.json"):
+            entry = meta_file.parent
+            try:
+                size = sum(f.stat().st_size for f in entry.iterdir())
+                out.append((meta_file.stat().st_mtime, size, entry))
+            except OSError:
+                continue
+        return out
+
+    def evict(self) -> int:
+        """Drop least recently used entries until the cache fits max_mb; returns entries removed."""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, entry in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            removed += 1
+        return removed
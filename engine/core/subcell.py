@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import time
+
+import numpy as np
+
+from engine.core.tile_index import IVFPQIndex
+
+
+# -----------------------------
+# Sub-cell descriptor matching
+# -----------------------------
+# A descriptor is the n x n grid of Lab means of a tile (or target cell), flattened to
+# n*n*3 values. Distance = RMS over sub-cells of the Lab distance, so it lives on the
+# same scale as the mean-Lab distance and the A3 penalties / B1 cap apply unchanged.
+# Tile descriptors are stored float16 (feature store); matching projects them once
+# (optional PCA to `dims` components, float32) and computes whole blocks of cell rows
+# with one GEMM: |t|^2 + |x|^2 - 2 t.x. Cells are served in raster order.
+# For very large libraries SubcellANN replaces the full rows by an IVF-PQ candidate set
+# (capped tiles skipped), re-ranked on the exact descriptors.
+
+DEFAULT_BLOCK_ELEMS = 1 << 22  # cells x tiles per distance block (16 MB float32)
+
+
+def pca_basis(desc: np.ndarray, dims: int) -> tuple[np.ndarray, np.ndarray]:
+    """(mean, components (D, dims)) of the tile descriptors; dims >= D keeps every axis."""
+    x = np.asarray(desc, dtype=np.float32)
+    mean = x.mean(axis=0)
+    if dims <= 0 or dims >= x.shape[1]:
+        return mean, np.eye(x.shape[1], dtype=np.float32)
+    # eigen-decomposition of the D x D covariance (D <= 27): cheap at any library size
+    cov = np.cov((x - mean).T.astype(np.float64))
+    w, v = np.linalg.eigh(cov)
+    order = np.argsort(w)[::-1][:dims]
+    return mean, np.ascontiguousarray(v[:, order], dtype=np.float32)
+
+
+class SubcellRows:
+    """Distance rows (cell -> every tile) for the descriptor cells, computed block-wise on demand."""
+
+    def __init__(
+        self,
+        tile_desc: np.ndarray,
+        cell_desc: np.ndarray,
+        cells: np.ndarray,
+        grid: int,
+        pca_dims: int = 0,
+        block_elems: int = DEFAULT_BLOCK_ELEMS,
+    ):
+        self.grid = int(grid)
+        mean, self.basis = pca_basis(tile_desc, pca_dims)
+        self.mean = mean
+        self.tiles = self._project(tile_desc)                   # float32 (N, d)
+        self.tile_sq = (self.tiles * self.tiles).sum(axis=1)
+        self.cells = np.asarray(cells, dtype=np.intp)           # raster order
+        self.cell_desc = np.asarray(cell_desc)
+        self.block = max(1, int(block_elems) // max(1, self.tiles.shape[0]))
+        self._pos = {int(c): i for i, c in enumerate(self.cells.tolist())}
+        self._rows: np.ndarray | None = None
+        self._start = 0
+        self.ms = 0.0
+
+    @property
+    def dims(self) -> int:
+        return int(self.basis.shape[1])
+
+    def _project(self, desc: np.ndarray) -> np.ndarray:
+        x = np.asarray(desc, dtype=np.float32) - self.mean
+        return np.ascontiguousarray(x @ self.basis)
+
+    def __contains__(self, cell: int) -> bool:
+        return int(cell) in self._pos
+
+    def row(self, cell: int) -> np.ndarray:
+        """float64 (N,) descriptor distances of one cell (its block is computed on first use)."""
+        i = self._pos[int(cell)]
+        if self._rows is None or not (self._start <= i < self._start + self._rows.shape[0]):
+            t0 = time.perf_counter()
+            self._start = i
+            x = self._project(self.cell_desc[self.cells[i : i + self.block]])
+            d2 = (x * x).sum(axis=1)[:, None] + self.tile_sq[None, :] - 2.0 * (x @ self.tiles.T)
+            self._rows = np.sqrt(np.maximum(d2, 0.0)) / self.grid
+            self.ms += (time.perf_counter() - t0) * 1000.0
+        return self._rows[i - self._start].astype(np.float64)
+
+    def query(self, cell: int, exclude: np.ndarray | None = None) -> tuple[np.ndarray, np.ndarray | None]:
+        """(distances, candidates) for TileMatcher.pick: the full row, no candidate restriction."""
+        return self.row(cell), None
+
+
+class SubcellANN:
+    """Approximate descriptor candidates per cell from an IVF-PQ index, exact distances on the candidates."""
+
+    def __init__(
+        self,
+        index: IVFPQIndex,
+        tile_desc: np.ndarray,
+        cell_desc: np.ndarray,
+        cells: np.ndarray,
+        grid: int,
+        nprobe: int = 8,
+        refine: int = 64,
+    ):
+        self.index = index
+        self.tile_desc = tile_desc
+        self.cell_desc = np.asarray(cell_desc)
+        self.cells = np.asarray(cells, dtype=np.intp)
+        self.grid = int(grid)
+        self.nprobe = int(nprobe)
+        self.refine = max(1, int(refine))
+        self._cells = set(self.cells.tolist())
+        self.ms = 0.0
+
+    @property
+    def dims(self) -> int:
+        return int(self.tile_desc.shape[1])
+
+    def __contains__(self, cell: int) -> bool:
+        return int(cell) in self._cells
+
+    def query(self, cell: int, exclude: np.ndarray | None = None) -> tuple[np.ndarray, np.ndarray | None]:
+        t0 = time.perf_counter()
+        x = np.asarray(self.cell_desc[int(cell)], dtype=np.float32)
+        cand = self.index.search(x, self.refine, self.nprobe, exclude)
+        diff = np.asarray(self.tile_desc[cand], dtype=np.float32) - x
+        d = np.sqrt((diff * diff).sum(axis=1)).astype(np.float64) / self.grid
+        self.ms += (time.perf_counter() - t0) * 1000.0
+        return d, cand
+
+
+def subcell_rmse(tile_desc: np.ndarray, cell_desc: np.ndarray, grid: int) -> np.ndarray:
+    """Exact (float32, no PCA) RMS sub-cell Lab error of each cell against its placed tile descriptor."""
+    diff = np.asarray(tile_desc, dtype=np.float32) - np.asarray(cell_desc, dtype=np.float32)
+    return np.sqrt((diff * diff).sum(axis=1)) / int(grid)
@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+from typing import Sequence
+
+import numpy as np
+from PIL import Image
+
+from engine.core.color_match import rgb_to_lab_batch
+
+
+def _letterbox_geometry(src_size: tuple[int, int], size: tuple[int, int]) -> tuple[int, int, int, int]:
+    """(nw, nh, ox, oy): resized source size and its offset inside the target canvas."""
+    tw, th = size
+    w, h = src_size
+    scale = min(tw / w, th / h)
+    nw, nh = max(1, int(w * scale)), max(1, int(h * scale))
+    return nw, nh, (tw - nw) // 2, (th - nh) // 2
+
+
+def _letterbox_resize(im: Image.Image, size: tuple[int, int], fill=(220, 220, 220)) -> Image.Image:
+    """Resize preserving aspect ratio, pad to target size (no stretching)."""
+    tw, th = size
+    im = im.convert("RGB")
+    w, h = im.size
+    if w == 0 or h == 0:
+        return Image.new("RGB", (tw, th), fill)
+    nw, nh, ox, oy = _letterbox_geometry((w, h), size)
+    resized = im.resize((nw, nh), resample=Image.BILINEAR)
+    canvas = Image.new("RGB", (tw, th), fill)
+    canvas.paste(resized, (ox, oy))
+    return canvas
+
+
+def letterbox_rows(im: Image.Image, size: tuple[int, int], y0: int, y1: int, fill=(220, 220, 220)) -> np.ndarray:
+    """
+    Rows [y0, y1) of the letterboxed target as uint8 (y1-y0, W, 3), without building the
+    full frame: only the matching source band is resampled (resize with box=).
+    Within one level of _letterbox_resize (resampling offsets differ slightly per band).
+    """
+    tw, th = size
+    out = np.empty((y1 - y0, tw, 3), dtype=np.uint8)
+    out[:] = np.asarray(fill, dtype=np.uint8)
+    w, h = im.size
+    if w == 0 or h == 0:
+        return out
+    nw, nh, ox, oy = _letterbox_geometry((w, h), size)
+    r0, r1 = max(y0, oy) - oy, min(y1, oy + nh) - oy
+    if r1 <= r0:
+        return out
+    band = im.resize((nw, r1 - r0), resample=Image.BILINEAR, box=(0, r0 * h / nh, w, r1 * h / nh))
+    out[r0 + oy - y0 : r1 + oy - y0, ox : ox + nw] = np.asarray(band.convert("RGB"), dtype=np.uint8)
+    return out
+
+
+class TargetAnalysis:
+    """
+    Letterboxed target as a uint8 (H,W,3) array + its summed-area table.
+    Any axis-aligned rectangle mean is O(1); a whole grid of means is one gather.
+    """
+
+    def __init__(self, rgb: np.ndarray):
+        if rgb.ndim != 3 or rgb.shape[2] != 3 or rgb.dtype != np.uint8:
+            raise ValueError(f"Expected uint8 (H,W,3) array, got {rgb.dtype} {rgb.shape}")
+        self.rgb = rgb
+        h, w = rgb.shape[:2]
+
+        # uint32 is exact up to ~16.8 Mpx (255*W*H < 2**32), int64 beyond
+        acc = np.uint32 if 255 * w * h < 2**32 else np.int64
+        sat = np.zeros((h + 1, w + 1, 3), dtype=acc)
+        inner = sat[1:, 1:]
+        np.cumsum(rgb, axis=1, dtype=acc, out=inner)
+        # vertical pass row by row: contiguous adds, faster than cumsum(axis=0)
+        for y in range(1, h):
+            np.add(inner[y - 1], inner[y], out=inner[y])
+        self.sat = sat
+
+    @classmethod
+    def from_image(cls, target_img: Image.Image, width: int, height: int) -> "TargetAnalysis":
+        return cls(np.asarray(_letterbox_resize(target_img, (width, height)), dtype=np.uint8))
+
+    @property
+    def width(self) -> int:
+        return int(self.rgb.shape[1])
+
+    @property
+    def height(self) -> int:
+        return int(self.rgb.shape[0])
+
+    # ---------- rectangles ----------
+    def rect_sum(self, x0, y0, x1, y1) -> np.ndarray:
+        """Sum of RGB over [x0,x1) x [y0,y1). Scalars or broadcastable int arrays."""
+        s = self.sat
+        a, b, c, d = (s[yy, xx].astype(np.int64) for yy, xx in ((y1, x1), (y0, x1), (y1, x0), (y0, x0)))
+        return a - b - c + d
+
+    def rect_mean_rgb(self, x0, y0, x1, y1) -> np.ndarray:
+        x0, y0, x1, y1 = (np.asarray(v, dtype=np.intp) for v in (x0, y0, x1, y1))
+        area = np.maximum((x1 - x0) * (y1 - y0), 1)[..., None]
+        return self.rect_sum(x0, y0, x1, y1) / area
+
+    def rect_mean_lab(self, x0, y0, x1, y1) -> np.ndarray:
+        return rgb_to_lab_batch(self.rect_mean_rgb(x0, y0, x1, y1))
+
+    # ---------- grids ----------
+    def grid_mean_rgb(self, xs: Sequence[int], ys: Sequence[int]) -> np.ndarray:
+        """
+        Means over a (possibly non-uniform) grid given its edges:
+        xs = [x0, x1, ..., xn], ys = [y0, ..., ym] -> float64 (m, n, 3).
+        """
+        xs = np.asarray(xs, dtype=np.intp)
+        ys = np.asarray(ys, dtype=np.intp)
+        return self.rect_mean_rgb(xs[None, :-1], ys[:-1, None], xs[None, 1:], ys[1:, None])
+
+    def cell_mean_rgb(self, grid_w: int, grid_h: int, tile_size: int) -> np.ndarray:
+        xs = np.arange(grid_w + 1) * tile_size
+        ys = np.arange(grid_h + 1) * tile_size
+        return self.grid_mean_rgb(xs, ys)
+
+    def cell_labs(self, grid_w: int, grid_h: int, tile_size: int) -> np.ndarray:
+        """Per-cell mean Lab, float32 (grid_h, grid_w, 3)."""
+        return rgb_to_lab_batch(self.cell_mean_rgb(grid_w, grid_h, tile_size))
+
+    def sub_cell_labs(self, grid_w: int, grid_h: int, tile_size: int, n: int) -> np.ndarray:
+        """n x n sub-cell mean Labs per cell, float32 (grid_h, grid_w, n, n, 3)."""
+        sub = (np.arange(n + 1) * tile_size) // n
+        xs = (np.arange(grid_w)[:, None] * tile_size + sub[None, :-1]).reshape(-1)
+        ys = (np.arange(grid_h)[:, None] * tile_size + sub[None, :-1]).reshape(-1)
+        xs = np.append(xs, grid_w * tile_size)
+        ys = np.append(ys, grid_h * tile_size)
+        labs = rgb_to_lab_batch(self.grid_mean_rgb(xs, ys))
+        return labs.reshape(grid_h, n, grid_w, n, 3).transpose(0, 2, 1, 3, 4)
@@ -0,0 +1,359 @@
+from __future__ import annotations
+
+import json
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Sequence
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+from engine.core.color_match import _cache_key_for_file
+from engine.io.decode import decode_rgb
+
+
+ATLAS_VERSION = 3
+MIN_MIP_SIZE = 8
+
+
+# -----------------------------
+# Decode (one tile -> S x S RGB)
+# -----------------------------
+def _decode_tile(tile_file: Path, tile_size: int, blur_radius: int) -> np.ndarray | None:
+    try:
+        # smallest decode scale that still covers S x S
+        tile = decode_rgb(tile_file, (tile_size, tile_size)).resize((tile_size, tile_size), resample=Image.BILINEAR)
+        if blur_radius and blur_radius > 0:
+            tile = tile.filter(ImageFilter.GaussianBlur(radius=float(blur_radius)))
+        return np.asarray(tile, dtype=np.uint8)
+    except Exception:
+        return None
+
+
+def _mip_sizes(tile_size: int) -> List[int]:
+    sizes = []
+    s = tile_size
+    while (s + 1) // 2 >= MIN_MIP_SIZE:
+        s = (s + 1) // 2
+        sizes.append(s)
+    return sizes
+
+
+def _downsample2(level: np.ndarray) -> np.ndarray:
+    n, s = level.shape[0], level.shape[1]
+    out = np.empty((n, (s + 1) // 2, (s + 1) // 2, 3), dtype=np.uint8)
+    for i in range(n):
+        out[i] = np.asarray(Image.fromarray(level[i]).reduce(2), dtype=np.uint8)
+    return out
+
+
+# -----------------------------
+# Atlas
+# -----------------------------
+@dataclass
+class TileAtlas:
+    """
+    Packed, pre-resized tiles: uint8 (N, S, S, 3), memory-mapped from output/tile_atlas.
+    Row i holds tile_ids[i]; ok[i] is False for unreadable tiles.
+    Optional mip chain (S/2, S/4, ... >= 8 px) serves other tile sizes without re-decoding:
+    tile(i, size) here, and build_tile_atlas(mips=True) for a new size (derived from the
+    closest level). sources[i] names the level row i was derived from ("" = decoded).
+    Lazy atlases (lazy_tile_atlas) hold no pixels: tiles are decoded on demand from `root`.
+    """
+
+    tile_size: int
+    tile_blur: int
+    tile_ids: List[str]
+    array: np.ndarray
+    ok: np.ndarray
+    mips: Dict[int, np.ndarray] = field(default_factory=dict)
+    decoded: int = 0
+    reused: int = 0
+    derived: int = 0  # rows resized from another (unblurred) atlas instead of decoded
+    keys: List[str] = field(default_factory=list)  # name:mtime:size per row (invalidation key)
+    sources: List[str] = field(default_factory=list)  # per row: source level stem, "" = decoded
+    root: str = ""  # tile library dir (lazy atlases only)
+
+    lru_size: int = 4096
+    _lru: "OrderedDict[tuple[int, int], np.ndarray]" = field(default_factory=OrderedDict, repr=False)
+
+    def __len__(self) -> int:
+        return len(self.tile_ids)
+
+    @property
+    def lazy(self) -> bool:
+        return bool(self.root)
+
+    def decode(self, i: int) -> np.ndarray | None:
+        """Tile i decoded from the library at native S (what the packed level stores)."""
+        return _decode_tile(Path(self.root) / self.tile_ids[i], self.tile_size, self.tile_blur)
+
+    def tile(self, i: int, size: int | None = None) -> np.ndarray | None:
+        """Tile i at `size` px (default: native S). Non-native sizes are resized from the closest level and LRU-cached."""
+        if not self.ok[i]:
+            return None
+        if self.lazy:
+            px = self.decode(i)
+            if px is None or size is None or size == self.tile_size:
+                return px
+            return np.asarray(Image.fromarray(px).resize((size, size), resample=Image.BILINEAR), dtype=np.uint8)
+        if size is None or size == self.tile_size:
+            return self.array[i]
+        if size in self.mips:
+            return self.mips[size][i]
+
+        key = (int(i), int(size))
+        hit = self._lru.get(key)
+        if hit is not None:
+            self._lru.move_to_end(key)
+            return hit
+
+        # closest level that is still >= requested size (fallback: native)
+        src = self.array
+        for s in sorted(self.mips):
+            if s >= size:
+                src = self.mips[s]
+                break
+        out = np.asarray(Image.fromarray(src[i]).resize((size, size), resample=Image.BILINEAR), dtype=np.uint8)
+
+        self._lru[key] = out
+        if len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+        return out
+
+
+def _atlas_stem(tile_size: int, tile_blur: int) -> str:
+    return f"atlas_s{int(tile_size)}_b{int(tile_blur)}"
+
+
+def _open_level(path: Path, n: int, size: int, mode: str = "r") -> np.ndarray:
+    if n == 0:
+        return np.zeros((0, size, size, 3), dtype=np.uint8)
+    return np.memmap(path, dtype=np.uint8, mode=mode, shape=(n, size, size, 3))
+
+
+@dataclass
+class _LevelSource:
+    """Closest level >= the wanted size of another unblurred atlas in the same dir."""
+
+    name: str  # level file stem, e.g. atlas_s64_b0_m32
+    size: int
+    level: np.ndarray
+    rows: Dict[str, int]  # invalidation key -> row (usable rows only)
+
+
+def _level_sources(out_dir: Path, tile_size: int, skip_stem: str) -> List[_LevelSource]:
+    """Unblurred atlases with a native or mip level >= tile_size, closest level first."""
+    sources: List[_LevelSource] = []
+    for index_file in out_dir.glob("atlas_s*_b0.json"):
+        if index_file.stem == skip_stem:
+            continue
+        try:
+            index = json.loads(index_file.read_text(encoding="utf-8"))
+        except Exception:
+            continue
+        if index.get("version") != ATLAS_VERSION or int(index.get("tile_blur", -1)) != 0:
+            continue
+        src_size = int(index["tile_size"])
+        sizes = [s for s in [src_size] + list(index.get("mips", [])) if s >= tile_size]
+        if not sizes:
+            continue
+        size = min(sizes)
+        name = index_file.stem if size == src_size else f"{index_file.stem}_m{size}"
+        path = out_dir / f"{name}.u8"
+        keys, ok = index.get("keys", []), index.get("ok", [])
+        if not keys or not path.exists():
+            continue
+        rows = {k: i for i, (k, good) in enumerate(zip(keys, ok)) if good}
+        sources.append(_LevelSource(name, size, _open_level(path, len(keys), size), rows))
+    return sorted(sources, key=lambda src: src.size)
+
+
+def _derive_tile(src: np.ndarray, tile_size: int, blur_radius: int) -> np.ndarray:
+    tile = Image.fromarray(src)
+    if tile.width != tile_size:
+        tile = tile.resize((tile_size, tile_size), resample=Image.BILINEAR)
+    if blur_radius and blur_radius > 0:
+        tile = tile.filter(ImageFilter.GaussianBlur(radius=float(blur_radius)))
+    return np.asarray(tile, dtype=np.uint8)
+
+
+def _file_keys(root: Path, tile_ids: Sequence[str]) -> List[str]:
+    keys: List[str] = []
+    for tid in tile_ids:
+        try:
+            keys.append(_cache_key_for_file(root / tid))
+        except OSError:
+            keys.append(f"{tid}:missing")
+    return keys
+
+
+def lazy_tile_atlas(raw_tiles_dir: str, tile_ids: Sequence[str], tile_size: int, tile_blur: int = 0) -> TileAtlas:
+    """
+    Atlas without a packed level: nothing is decoded up front, tiles are decoded per render
+    (see TilePrefetcher). Rows are assumed usable: the feature cache only keeps decodable tiles.
+    """
+    n = len(tile_ids)
+    return TileAtlas(
+        tile_size=int(tile_size),
+        tile_blur=int(tile_blur),
+        tile_ids=list(tile_ids),
+        array=np.zeros((0, int(tile_size), int(tile_size), 3), dtype=np.uint8),
+        ok=np.ones(n, dtype=bool),
+        keys=_file_keys(Path(raw_tiles_dir), tile_ids),
+        root=str(raw_tiles_dir),
+    )
+
+
+def build_tile_atlas(
+    raw_tiles_dir: str,
+    tile_ids: Sequence[str],
+    atlas_dir: str,
+    tile_size: int,
+    tile_blur: int = 0,
+    mips: bool = False,
+) -> TileAtlas:
+    """
+    Load (or build / incrementally update) the atlas for one (tile_size, tile_blur).
+    Entries are invalidated with the same name:mtime:size key as the feature cache;
+    unchanged entries are copied from the previous atlas, only new/changed tiles are decoded.
+    mips=True also writes the mip chain and lets a tile missing here but present (same key) in
+    another unblurred atlas of this dir with a level >= tile_size be resized from that level
+    instead (then blurred): a new tile size, e.g. in a sweep, costs a resize per tile rather
+    than a full decode. The pixels then depend on which atlases exist, so each row records its
+    source level (TileAtlas.sources). With mips=False every row is decoded from the library.
+    """
+    root = Path(raw_tiles_dir)
+    out_dir = Path(atlas_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    tile_size = int(tile_size)
+    tile_blur = int(tile_blur)
+    stem = _atlas_stem(tile_size, tile_blur)
+    index_file = out_dir / f"{stem}.json"
+    mip_sizes = _mip_sizes(tile_size) if mips else []
+
+    keys = _file_keys(root, tile_ids)
+
+    # previous atlas (if any)
+    prev_index: Dict = {}
+    if index_file.exists():
+        try:
+            prev_index = json.loads(index_file.read_text(encoding="utf-8"))
+        except Exception:
+            prev_index = {}
+    if prev_index.get("version") != ATLAS_VERSION:
+        prev_index = {}
+
+    prev_keys: List[str] = list(prev_index.get("keys", []))
+    prev_ok: List[bool] = list(prev_index.get("ok", []))
+    prev_mips: List[int] = list(prev_index.get("mips", []))
+    prev_sources: List[str] = list(prev_index.get("sources", [""] * len(prev_keys)))
+    n = len(tile_ids)
+
+    # fast path: nothing changed -> just map the files (derived rows only where derivation is on)
+    if (
+        prev_keys == keys
+        and prev_mips == mip_sizes
+        and (mips or not any(prev_sources))
+        and (n == 0 or (out_dir / f"{stem}.u8").exists())
+    ):
+        atlas = TileAtlas(
+            tile_size=tile_size,
+            tile_blur=tile_blur,
+            tile_ids=list(tile_ids),
+            array=_open_level(out_dir / f"{stem}.u8", n, tile_size),
+            ok=np.array(prev_ok, dtype=bool).reshape(n),
+            mips={s: _open_level(out_dir / f"{stem}_m{s}.u8", n, s) for s in mip_sizes},
+            reused=n,
+            keys=keys,
+            sources=prev_sources,
+        )
+        return atlas
+
+    prev_rows = {k: i for i, k in enumerate(prev_keys)}
+    prev_arr = _open_level(out_dir / f"{stem}.u8", len(prev_keys), tile_size) if prev_keys else None
+
+    tmp_file = out_dir / f"{stem}.u8.tmp"
+    arr = _open_level(tmp_file, n, tile_size, mode="w+")
+    ok = np.zeros(n, dtype=bool)
+    sources_out = [""] * n
+    decoded = reused = derived = 0
+    sources: List[_LevelSource] | None = None  # looked up on the first miss
+
+    for i, (tid, key) in enumerate(zip(tile_ids, keys)):
+        j = prev_rows.get(key)
+        if j is not None and prev_arr is not None and prev_ok[j] and (mips or not prev_sources[j]):
+            arr[i] = prev_arr[j]
+            ok[i] = True
+            sources_out[i] = prev_sources[j]
+            reused += 1
+            continue
+
+        if mips:
+            if sources is None:
+                sources = _level_sources(out_dir, tile_size, stem)
+            src = next((src for src in sources if key in src.rows), None)
+            if src is not None:
+                arr[i] = _derive_tile(src.level[src.rows[key]], tile_size, tile_blur)
+                ok[i] = True
+                sources_out[i] = src.name
+                derived += 1
+                continue
+
+        tile = _decode_tile(root / tid, tile_size, tile_blur)
+        decoded += 1
+        if tile is None:
+            arr[i] = 220
+            continue
+        arr[i] = tile
+        ok[i] = True
+
+    if n:
+        arr.flush()
+    del arr, prev_arr, sources
+
+    # mip chain is cheap to rebuild from the packed level
+    base = _open_level(tmp_file, n, tile_size) if n else np.zeros((0, tile_size, tile_size, 3), dtype=np.uint8)
+    level = base
+    for s in mip_sizes:
+        level = _downsample2(level)
+        mtmp = out_dir / f"{stem}_m{s}.u8.tmp"
+        if n:
+            mm = _open_level(mtmp, n, s, mode="w+")
+            mm[:] = level
+            mm.flush()
+            del mm
+            mtmp.replace(out_dir / f"{stem}_m{s}.u8")
+    del base, level
+
+    # data first, index last (atomic)
+    if n:
+        tmp_file.replace(out_dir / f"{stem}.u8")
+    index = {
+        "version": ATLAS_VERSION,
+        "tile_size": tile_size,
+        "tile_blur": tile_blur,
+        "mips": mip_sizes,
+        "keys": keys,
+        "ok": ok.tolist(),
+        "sources": sources_out,
+    }
+    tmp_index = index_file.with_suffix(".tmp")
+    tmp_index.write_text(json.dumps(index, ensure_ascii=False), encoding="utf-8")
+    tmp_index.replace(index_file)
+
+    return TileAtlas(
+        tile_size=tile_size,
+        tile_blur=tile_blur,
+        tile_ids=list(tile_ids),
+        array=_open_level(out_dir / f"{stem}.u8", n, tile_size),
+        ok=ok,
+        mips={s: _open_level(out_dir / f"{stem}_m{s}.u8", n, s) for s in mip_sizes},
+        decoded=decoded,
+        reused=reused,
+        derived=derived,
+        keys=keys,
+        sources=sources_out,
+    )
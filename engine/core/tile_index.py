@@ -0,0 +1,466 @@
+from __future__ import annotations
+
+import heapq
+import math
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Sequence, Tuple
+
+import numpy as np
+
+from engine.core.tracing import count
+
+
+INDEX_VERSION = 1
+
+
+# -----------------------------
+# Nearest-neighbour tile indexes
+# -----------------------------
+# KDTreeIndex: exact k-nearest over mean Labs (3-D). Best-first search over tight node
+# boxes; a per-query penalty >= 1 (A3) multiplies the distances and an Exclusion (capped
+# tiles, B1) removes points, so "k nearest, penalized, excluding capped" is answered
+# exactly without rescanning: a fully capped subtree has an alive count of 0 and is
+# never entered. Ties are broken on the tile index, like the brute-force matcher.
+# IVFPQIndex: approximate search over high-dimensional descriptors (sub-cell Labs).
+# Coarse k-means lists + product quantization of the residual (one sub-quantizer per
+# sub-cell, 256 codes); candidates of the nprobe closest lists are ranked by table
+# lookups, capped tiles are skipped before ranking.
+# Both persist under <cache_dir>/tile_index next to the feature store, keyed by tile id,
+# and follow library changes incrementally: removed tiles become dead slots, new tiles go
+# to a brute-force delta (KD) or are encoded into their list (IVF); the index is rebuilt
+# only once the changes outgrow KD_REBUILD_RATIO / IVF_RETRAIN_RATIO of it.
+
+KD_LEAF_SIZE = 32
+KD_REBUILD_RATIO = 0.05
+IVF_RETRAIN_RATIO = 0.5
+IVF_KSUB = 256
+IVF_TRAIN_PER_CENTROID = 32   # coarse k-means sample per list
+IVF_TRAIN_PER_CODE = 64       # PQ codebook sample per code
+KMEANS_ITERS = 12
+
+
+def _slot_map(stored_ids: Sequence[str], stored_vecs: np.ndarray, tile_ids: Sequence[str], vecs: np.ndarray) -> np.ndarray:
+    """Current tile index of every stored slot, -1 where the tile is gone or its vector changed."""
+    pos = {t: i for i, t in enumerate(tile_ids)}
+    slots = np.array([pos.get(t, -1) for t in stored_ids], dtype=np.int64)
+    live = np.flatnonzero(slots >= 0)
+    if live.size:
+        same = np.all(np.asarray(stored_vecs)[live] == np.asarray(vecs)[slots[live]], axis=1)
+        slots[live[~same]] = -1
+    return slots
+
+
+def _delta(slot_ids: np.ndarray, n: int) -> np.ndarray:
+    """Current tile indices that no slot holds (tiles added since the index was built)."""
+    held = np.zeros(n, dtype=bool)
+    held[slot_ids[slot_ids >= 0]] = True
+    return np.flatnonzero(~held)
+
+
+def _levels_up(n_nodes: int):
+    """(first, last) node range of every internal level of an implicit tree, deepest first."""
+    depth = int(math.log2(n_nodes + 1)) - 1
+    for level in range(depth - 1, -1, -1):
+        yield 2**level - 1, 2 ** (level + 1) - 1
+
+
+def _save_npz(path: Path, tile_ids: np.ndarray, **arrays: np.ndarray) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.stem}.tmp{os.getpid()}_{threading.get_ident()}.npz")
+    np.savez(tmp, version=np.int64(INDEX_VERSION), tile_ids=tile_ids, **arrays)
+    tmp.replace(path)
+
+
+def _load_npz(path: Path) -> Dict[str, np.ndarray] | None:
+    if not path.exists():
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as z:
+            data = {k: z[k] for k in z.files}
+    except Exception:
+        return None
+    if int(data.get("version", -1)) != INDEX_VERSION:
+        return None
+    return data
+
+
+# -----------------------------
+# Exact: KD-tree over mean Labs
+# -----------------------------
+class Exclusion:
+    """Per-matcher excluded tiles (e.g. capped) + alive counts of the tree nodes they live in."""
+
+    def __init__(self, index: "KDTreeIndex", excluded: np.ndarray | None = None):
+        self.index = index
+        self.ok = np.ones(index.n, dtype=bool)
+        self.alive = index.alive.copy()
+        if excluded is not None and np.any(excluded):
+            self.ok[np.asarray(excluded, dtype=bool)] = False
+            self.alive = index.node_counts(self.ok)
+
+    def exclude(self, i: int) -> None:
+        if not self.ok[i]:
+            return
+        self.ok[i] = False
+        node = int(self.index.leaf_of[i])
+        while node >= 0:
+            self.alive[node] -= 1
+            node = (node - 1) // 2 if node > 0 else -1
+
+
+class KDTreeIndex:
+    def __init__(
+        self,
+        pts: np.ndarray,
+        slot_ids: np.ndarray,
+        points: np.ndarray,
+        lo: np.ndarray,
+        hi: np.ndarray,
+        start: np.ndarray,
+        end: np.ndarray,
+    ):
+        self.pts = pts                # float32 (M, d), slots in leaf order
+        self.slot_ids = slot_ids      # (M,) current tile index per slot, -1 = dead
+        self.points = points          # float32 (n, d) current tile points (delta lookups)
+        self.lo, self.hi = lo, hi     # float64 (nodes, d) tight boxes of the live slots
+        self.start, self.end = start, end
+        self.n_nodes = int(start.shape[0])
+        self.first_leaf = self.n_nodes // 2
+        self.n = int(points.shape[0])
+
+        # leaf of every current tile; -1 for delta tiles (added since the build, not in the tree)
+        self.leaf_of = np.full(self.n, -1, dtype=np.int64)
+        leaf = np.repeat(np.arange(self.first_leaf, self.n_nodes), end[self.first_leaf :] - start[self.first_leaf :])
+        held = slot_ids >= 0
+        self.leaf_of[slot_ids[held]] = leaf[held]
+        self.delta = _delta(slot_ids, self.n)
+        self.alive = self.node_counts(np.ones(self.n, dtype=bool))
+
+    # ---------- build ----------
+    @classmethod
+    def build(cls, points: np.ndarray, leaf_size: int = KD_LEAF_SIZE) -> "KDTreeIndex":
+        points = np.ascontiguousarray(points, dtype=np.float32)
+        n = points.shape[0]
+        depth = max(0, math.ceil(math.log2(max(1, n) / leaf_size)))
+        n_nodes = 2 ** (depth + 1) - 1
+        order = np.arange(n, dtype=np.int64)
+        start = np.zeros(n_nodes, dtype=np.int64)
+        end = np.zeros(n_nodes, dtype=np.int64)
+        end[0] = n
+        for node in range(n_nodes // 2):
+            s, e = int(start[node]), int(end[node])
+            mid = (e - s) // 2
+            if e - s >= 2:
+                seg = order[s:e]
+                p = points[seg]
+                dim = int(np.argmax(p.max(axis=0) - p.min(axis=0)))
+                order[s:e] = seg[np.argpartition(p[:, dim], mid)]
+            start[2 * node + 1], end[2 * node + 1] = s, s + mid
+            start[2 * node + 2], end[2 * node + 2] = s + mid, e
+        pts = points[order]
+        lo, hi = cls._boxes(pts, order >= 0, start, end)
+        return cls(pts, order, points, lo, hi, start, end)
+
+    @staticmethod
+    def _boxes(pts: np.ndarray, live: np.ndarray, start: np.ndarray, end: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        n_nodes = start.shape[0]
+        first_leaf = n_nodes // 2
+        p = pts.astype(np.float64)
+        lo = np.full((n_nodes, p.shape[1]), np.inf)
+        hi = np.full((n_nodes, p.shape[1]), -np.inf)
+        # leaves are contiguous, non-empty slot ranges; dead slots must not widen the boxes
+        starts = start[first_leaf:]
+        lo[first_leaf:] = np.minimum.reduceat(np.where(live[:, None], p, np.inf), starts, axis=0)
+        hi[first_leaf:] = np.maximum.reduceat(np.where(live[:, None], p, -np.inf), starts, axis=0)
+        for a, b in _levels_up(n_nodes):
+            lo[a:b] = np.minimum(lo[2 * a + 1 : 2 * b + 1 : 2], lo[2 * a + 2 : 2 * b + 2 : 2])
+            hi[a:b] = np.maximum(hi[2 * a + 1 : 2 * b + 1 : 2], hi[2 * a + 2 : 2 * b + 2 : 2])
+        return lo, hi
+
+    def node_counts(self, ok: np.ndarray) -> np.ndarray:
+        """Tree points with ok[tile] per node (delta tiles are not counted)."""
+        counts = np.zeros(self.n_nodes, dtype=np.int64)
+        live = np.flatnonzero((self.leaf_of >= 0) & ok)
+        np.add.at(counts, self.leaf_of[live], 1)
+        for a, b in _levels_up(self.n_nodes):
+            counts[a:b] = counts[2 * a + 1 : 2 * b + 1 : 2] + counts[2 * a + 2 : 2 * b + 2 : 2]
+        return counts
+
+    def exclusion(self, excluded: np.ndarray | None = None) -> Exclusion:
+        return Exclusion(self, excluded)
+
+    # ---------- query ----------
+    def _score(self, pts: np.ndarray, ids: np.ndarray, q: np.ndarray, penalty: np.ndarray | None) -> np.ndarray:
+        # same expression as TileMatcher.distances: identical values, identical picks
+        diff = pts - q
+        d = np.sqrt(diff[:, 0] ** 2 + diff[:, 1] ** 2 + diff[:, 2] ** 2)
+        return d if penalty is None else d * penalty[ids]
+
+    def query(
+        self,
+        q,
+        k: int = 1,
+        penalty: np.ndarray | None = None,
+        exclusion: Exclusion | None = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (tile indices, scores) of the k best tiles ordered by (score, index);
+        score = Lab distance * penalty[tile] (penalty >= 1), excluded tiles skipped.
+        """
+        q = np.asarray(q, dtype=np.float64).reshape(-1)
+        ok = None if exclusion is None else exclusion.ok
+        alive = self.alive if exclusion is None else exclusion.alive
+        best_s = np.empty(0, dtype=np.float64)
+        best_i = np.empty(0, dtype=np.int64)
+        worst = math.inf
+
+        def merge(ids: np.ndarray, scores: np.ndarray) -> None:
+            nonlocal best_s, best_i, worst
+            s = np.concatenate([best_s, scores])
+            i = np.concatenate([best_i, ids])
+            keep = np.lexsort((i, s))[:k]
+            best_s, best_i = s[keep], i[keep]
+            if best_s.shape[0] >= k:
+                worst = float(best_s[-1])
+
+        if self.delta.size:
+            ids = self.delta if ok is None else self.delta[ok[self.delta]]
+            if ids.size:
+                # delta points are not in the tree: scored against their current Lab
+                merge(ids, self._score(self.points[ids], ids, q, penalty))
+
+        heap = [(0.0, 0)] if alive[0] > 0 else []
+        while heap:
+            bound, node = heapq.heappop(heap)
+            if bound > worst:
+                break
+            if node >= self.first_leaf:
+                s, e = int(self.start[node]), int(self.end[node])
+                ids = self.slot_ids[s:e]
+                keep = ids >= 0 if ok is None else (ids >= 0) & ok[np.maximum(ids, 0)]
+                if keep.any():
+                    ids = ids[keep]
+                    merge(ids, self._score(self.pts[s:e][keep], ids, q, penalty))
+                continue
+            kids = (2 * node + 1, 2 * node + 2)
+            gap = np.maximum(np.maximum(self.lo[list(kids)] - q, q - self.hi[list(kids)]), 0.0)
+            bounds = np.sqrt(gap[:, 0] ** 2 + gap[:, 1] ** 2 + gap[:, 2] ** 2)
+            for child, b in zip(kids, bounds.tolist()):
+                if alive[child] > 0 and b <= worst:
+                    heapq.heappush(heap, (b, child))
+        return best_i, best_s
+
+    # ---------- persistence / incremental update ----------
+    @property
+    def changed(self) -> int:
+        return int(self.delta.size + np.count_nonzero(self.slot_ids < 0))
+
+    def save(self, path: Path, tile_ids: Sequence[str]) -> None:
+        names = np.array([tile_ids[i] if i >= 0 else "" for i in self.slot_ids.tolist()])
+        _save_npz(path, names, pts=self.pts, start=self.start, end=self.end)
+
+    @classmethod
+    def load(cls, path: Path, tile_ids: Sequence[str], points: np.ndarray) -> "KDTreeIndex | None":
+        data = _load_npz(path)
+        if data is None or data["pts"].shape[1:] != points.shape[1:]:
+            return None
+        slot_ids = _slot_map(data["tile_ids"].tolist(), data["pts"], tile_ids, points)
+        lo, hi = cls._boxes(data["pts"], slot_ids >= 0, data["start"], data["end"])
+        return cls(data["pts"], slot_ids, points, lo, hi, data["start"], data["end"])
+
+
+def load_kdtree(cache_dir: str | Path, tile_ids: Sequence[str], labs: np.ndarray) -> KDTreeIndex:
+    """Exact Lab index for tile_ids, reused / updated from <cache_dir>/tile_index."""
+    path = Path(cache_dir) / "tile_index" / "lab_kdtree.npz"
+    labs = np.ascontiguousarray(labs, dtype=np.float32).reshape(-1, 3)
+    index = KDTreeIndex.load(path, tile_ids, labs)
+    if index is not None and index.changed <= KD_REBUILD_RATIO * max(1, len(tile_ids)):
+        count("tile_index.kdtree.hit")
+        count("tile_index.kdtree.delta", int(index.delta.size))
+        return index
+    count("tile_index.kdtree.build")
+    index = KDTreeIndex.build(labs)
+    index.save(path, tile_ids)
+    return index
+
+
+# -----------------------------
+# Approximate: IVF + product quantization
+# -----------------------------
+def _sq_dists(x: np.ndarray, c: np.ndarray, block: int = 16384) -> np.ndarray:
+    """(len(x), len(c)) squared L2 distances, float32, computed in row blocks."""
+    c_sq = (c * c).sum(axis=1)
+    out = np.empty((x.shape[0], c.shape[0]), dtype=np.float32)
+    for b0 in range(0, x.shape[0], block):
+        xb = x[b0 : b0 + block]
+        out[b0 : b0 + block] = (xb * xb).sum(axis=1)[:, None] + c_sq[None, :] - 2.0 * (xb @ c.T)
+    return np.maximum(out, 0.0, out=out)
+
+
+def _nearest(x: np.ndarray, c: np.ndarray, block: int = 16384) -> np.ndarray:
+    c_sq = (c * c).sum(axis=1)
+    out = np.empty(x.shape[0], dtype=np.int64)
+    for b0 in range(0, x.shape[0], block):
+        xb = x[b0 : b0 + block]
+        out[b0 : b0 + block] = np.argmin(c_sq[None, :] - 2.0 * (xb @ c.T), axis=1)
+    return out
+
+
+def _kmeans(x: np.ndarray, k: int, rng: np.random.Generator, iters: int = KMEANS_ITERS) -> np.ndarray:
+    k = max(1, min(int(k), x.shape[0]))
+    c = x[rng.choice(x.shape[0], k, replace=False)].copy()
+    for _ in range(iters):
+        a = _nearest(x, c)
+        sizes = np.bincount(a, minlength=k)
+        sums = np.stack([np.bincount(a, weights=x[:, j], minlength=k) for j in range(x.shape[1])], axis=1)
+        filled = sizes > 0
+        c[filled] = (sums[filled] / sizes[filled, None]).astype(np.float32)
+        empty = np.flatnonzero(~filled)
+        if empty.size:
+            c[empty] = x[rng.choice(x.shape[0], empty.size, replace=False)]
+    return c
+
+
+class IVFPQIndex:
+    def __init__(
+        self,
+        centroids: np.ndarray,
+        codebooks: np.ndarray,
+        codes: np.ndarray,
+        lists: np.ndarray,
+        slot_ids: np.ndarray,
+        trained: int,
+    ):
+        self.centroids = centroids    # float32 (nlist, D)
+        self.codebooks = codebooks    # float32 (m, ksub, D/m)
+        self.codes = codes            # uint8 (M, m), slot order
+        self.lists = lists            # int32 (M,) coarse list of every slot
+        self.slot_ids = slot_ids      # (M,) current tile index per slot, -1 = dead
+        self.trained = int(trained)
+        self.added = np.zeros(0, dtype=np.int64)
+        self.m = int(codebooks.shape[0])
+        self.dsub = int(codebooks.shape[2])
+        self._group()
+
+    def _group(self) -> None:
+        self.order = np.argsort(self.lists, kind="stable")
+        self.offsets = np.searchsorted(self.lists[self.order], np.arange(self.centroids.shape[0] + 1))
+
+    @property
+    def nlist(self) -> int:
+        return int(self.centroids.shape[0])
+
+    # ---------- build ----------
+    @classmethod
+    def train(cls, desc: np.ndarray, m: int, seed: int = 0) -> "IVFPQIndex":
+        x = np.ascontiguousarray(desc, dtype=np.float32)
+        n, dim = x.shape
+        if dim % m:
+            raise ValueError(f"descriptor dim {dim} is not divisible into {m} sub-quantizers")
+        rng = np.random.default_rng(seed)
+        nlist = int(np.clip(round(4 * math.sqrt(n)), 1, 4096))
+
+        def sample(size: int) -> np.ndarray:
+            return x[rng.choice(n, size, replace=False)] if n > size else x
+
+        centroids = _kmeans(sample(IVF_TRAIN_PER_CENTROID * nlist), nlist, rng)
+        pq = sample(IVF_TRAIN_PER_CODE * IVF_KSUB)
+        resid = (pq - centroids[_nearest(pq, centroids)]).reshape(pq.shape[0], m, dim // m)
+        codebooks = np.stack([_kmeans(np.ascontiguousarray(resid[:, j]), IVF_KSUB, rng) for j in range(m)])
+        if codebooks.shape[1] < IVF_KSUB:  # tiny libraries: pad so codes stay uint8-indexable
+            codebooks = np.concatenate([codebooks, np.repeat(codebooks[:, -1:], IVF_KSUB - codebooks.shape[1], axis=1)], axis=1)
+        index = cls(centroids, codebooks, np.zeros((0, m), np.uint8), np.zeros(0, np.int32), np.zeros(0, np.int64), n)
+        index.add(x, np.arange(n))
+        return index
+
+    def _encode(self, x: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        lists = _nearest(x, self.centroids).astype(np.int32)
+        resid = (x - self.centroids[lists]).reshape(x.shape[0], self.m, self.dsub)
+        codes = np.stack([_nearest(np.ascontiguousarray(resid[:, j]), self.codebooks[j]) for j in range(self.m)], axis=1)
+        return codes.astype(np.uint8), lists
+
+    def add(self, desc: np.ndarray, ids: np.ndarray) -> None:
+        """Encode new tiles (current indices `ids`) into their lists; no retraining."""
+        if len(ids) == 0:
+            return
+        codes, lists = self._encode(np.ascontiguousarray(desc, dtype=np.float32))
+        self.codes = np.concatenate([self.codes, codes])
+        self.lists = np.concatenate([self.lists, lists])
+        self.slot_ids = np.concatenate([self.slot_ids, np.asarray(ids, dtype=np.int64)])
+        self._group()
+
+    # ---------- query ----------
+    def search(self, x: np.ndarray, k: int, nprobe: int = 8, exclude: np.ndarray | None = None) -> np.ndarray:
+        """Tile indices of the (about) k nearest by asymmetric PQ distance, excluded tiles skipped."""
+        x = np.asarray(x, dtype=np.float32).reshape(-1)
+        cd = ((self.centroids - x) ** 2).sum(axis=1)
+        nprobe = max(1, min(int(nprobe), self.nlist))
+        probe = np.argpartition(cd, nprobe - 1)[:nprobe] if nprobe < self.nlist else np.arange(self.nlist)
+
+        sizes = self.offsets[probe + 1] - self.offsets[probe]
+        slots = np.concatenate([self.order[self.offsets[p] : self.offsets[p + 1]] for p in probe.tolist()])
+        ids = self.slot_ids[slots]
+        keep = ids >= 0
+        if exclude is not None:
+            keep &= ~exclude[np.maximum(ids, 0)]
+        which = np.repeat(np.arange(probe.size), sizes)[keep]
+        slots, ids = slots[keep], ids[keep]
+        if ids.size == 0:
+            return ids
+
+        # distance tables: per probed list, per sub-quantizer, per code
+        resid = (x - self.centroids[probe]).reshape(probe.size, self.m, 1, self.dsub)
+        tables = ((resid - self.codebooks[None]) ** 2).sum(axis=3)
+        adc = tables[which[:, None], np.arange(self.m)[None, :], self.codes[slots]].sum(axis=1)
+        if ids.size > k:
+            top = np.argpartition(adc, k - 1)[:k]
+            ids = ids[top]
+        return np.sort(ids)
+
+    # ---------- persistence / incremental update ----------
+    @property
+    def changed(self) -> int:
+        return int(self.slot_ids.shape[0] - self.trained + np.count_nonzero(self.slot_ids < 0))
+
+    def save(self, path: Path, tile_ids: Sequence[str], desc: np.ndarray) -> None:
+        names = np.array([tile_ids[i] if i >= 0 else "" for i in self.slot_ids.tolist()])
+        live = np.maximum(self.slot_ids, 0)
+        _save_npz(
+            path,
+            names,
+            centroids=self.centroids,
+            codebooks=self.codebooks,
+            codes=self.codes,
+            lists=self.lists,
+            desc=np.asarray(desc)[live],
+            trained=np.int64(self.trained),
+        )
+
+    @classmethod
+    def load(cls, path: Path, tile_ids: Sequence[str], desc: np.ndarray) -> "IVFPQIndex | None":
+        data = _load_npz(path)
+        if data is None or data["desc"].shape[1:] != desc.shape[1:]:
+            return None
+        slot_ids = _slot_map(data["tile_ids"].tolist(), data["desc"], tile_ids, desc)
+        index = cls(data["centroids"], data["codebooks"], data["codes"], data["lists"], slot_ids, int(data["trained"]))
+        index.added = _delta(slot_ids, len(tile_ids))
+        index.add(np.asarray(desc)[index.added], index.added)
+        return index
+
+
+def load_ivfpq(cache_dir: str | Path, tile_ids: Sequence[str], desc: np.ndarray, grid: int) -> IVFPQIndex:
+    """Approximate index over (n, grid*grid*3) sub-cell descriptors, reused / updated from <cache_dir>/tile_index."""
+    path = Path(cache_dir) / "tile_index" / f"sub{int(grid)}_ivfpq.npz"
+    index = IVFPQIndex.load(path, tile_ids, desc)
+    if index is not None and index.changed <= IVF_RETRAIN_RATIO * max(1, index.trained):
+        count("tile_index.ivfpq.hit")
+        if index.added.size:
+            count("tile_index.ivfpq.added", int(index.added.size))
+            index.save(path, tile_ids, desc)
+        return index
+    count("tile_index.ivfpq.build")
+    index = IVFPQIndex.train(desc, m=int(grid) * int(grid))
+    index.save(path, tile_ids, desc)
+    return index
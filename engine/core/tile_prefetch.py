@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+import numpy as np
+
+
+# -----------------------------
+# Tile decode prefetching (lazy atlas)
+# -----------------------------
+# Producer / consumer around a lazy atlas:
+#   want(i)  placement emits tile i (in composition order, possibly while matching still runs)
+#   get(i)   composition takes tile i's pixels, blocking only if its decode is not done yet
+# A thread pool (Pillow releases the GIL in decode / resize) keeps at most `depth` distinct
+# tiles ahead of the consumer. Each tile is decoded once per render and dropped after its
+# last placement. Blocking gets are "stalls": many of them => raise workers (or depth).
+class TilePrefetcher:
+    def __init__(self, decode: Callable[[int], np.ndarray | None], workers: int = 4, depth: int = 256):
+        self._decode = decode
+        self.workers = max(0, int(workers))
+        self.depth = max(1, int(depth))
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="tile-prefetch") if self.workers else None
+
+        self._order: List[int] = []        # distinct tiles in first-use order
+        self._pos: Dict[int, int] = {}     # tile -> position in _order
+        self._uses: Dict[int, int] = {}    # placements not consumed yet
+        self._futures: Dict[int, Future] = {}
+        self._submitted = 0                # _order[:_submitted] are decoding / decoded
+        self._consumed = 0                 # consumer has reached _order[:_consumed]
+
+        self.stalls = 0
+        self.stall_ms = 0.0
+        self.decode_ms = 0.0
+        self.failed = 0
+        self.peak_resident = 0
+        self._lock = threading.Lock()  # decode counters are updated from the workers
+
+    def __enter__(self) -> "TilePrefetcher":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+        self._futures.clear()
+
+    @property
+    def wanted(self) -> int:
+        return len(self._order)
+
+    # ---------- producer ----------
+    def want(self, i: int) -> None:
+        i = int(i)
+        n = self._uses.get(i, 0)
+        self._uses[i] = n + 1
+        if n == 0 and i not in self._futures:
+            # first use (or first use again after the tile was released)
+            self._pos[i] = len(self._order)
+            self._order.append(i)
+            self._fill()
+
+    def want_all(self, placement: np.ndarray) -> None:
+        """Every placed cell (>= 0) of a flat raster-order placement."""
+        for i in placement[placement >= 0].tolist():
+            self.want(i)
+
+    # ---------- consumer ----------
+    def get(self, i: int) -> np.ndarray | None:
+        i = int(i)
+        self._consumed = max(self._consumed, self._pos[i] + 1)
+        self._fill()
+        fut = self._futures[i]
+        if not fut.done():
+            t0 = time.perf_counter()
+            px = fut.result()
+            self.stalls += 1
+            self.stall_ms += (time.perf_counter() - t0) * 1000.0
+        else:
+            px = fut.result()
+        self._uses[i] -= 1
+        if self._uses[i] == 0:
+            del self._futures[i]
+        return px
+
+    # ---------- internals ----------
+    def _fill(self) -> None:
+        # serial (workers=0): no look-ahead, the consumer decodes each tile itself (all stall)
+        end = min(len(self._order), self._consumed + (self.depth if self._pool is not None else 0))
+        while self._submitted < end:
+            i = self._order[self._submitted]
+            self._submitted += 1
+            if self._pool is None:
+                t0 = time.perf_counter()
+                fut: Future = Future()
+                fut.set_result(self._timed_decode(i))
+                self.stalls += 1
+                self.stall_ms += (time.perf_counter() - t0) * 1000.0
+            else:
+                fut = self._pool.submit(self._timed_decode, i)
+            self._futures[i] = fut
+        self.peak_resident = max(self.peak_resident, len(self._futures))
+
+    def _timed_decode(self, i: int) -> np.ndarray | None:
+        t0 = time.perf_counter()
+        px = self._decode(i)
+        with self._lock:
+            self.decode_ms += (time.perf_counter() - t0) * 1000.0  # summed over workers
+            self.failed += px is None
+        return px
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "prefetch_workers": self.workers,
+            "prefetch_depth": self.depth,
+            "prefetch_tiles": self._submitted,
+            "prefetch_failed": self.failed,
+            "prefetch_stalls": self.stalls,
+            "prefetch_stall_ms": round(self.stall_ms, 1),
+            "prefetch_decode_ms": round(self.decode_ms, 1),
+            "prefetch_peak_resident": self.peak_resident,
+        }
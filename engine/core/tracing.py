@@ -0,0 +1,295 @@
+from __future__ import annotations
+
+import cProfile
+import io
+import itertools
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+# -----------------------------
+# Stage tracing (wall / CPU / peak RSS per stage, cache counters)
+# -----------------------------
+# Per span: cpu_ms is the calling thread's CPU, process_cpu_ms the whole process's (helper
+# threads, but also concurrent jobs in batch / daemon). peak_rss_mb is the highest *current*
+# RSS sampled while the span was open (process-wide, so concurrent jobs show up too);
+# process_peak_rss_mb in the report is the lifetime high-water mark (ru_maxrss).
+# Library code marks its stages with `with stage("blend"):` and its cache outcomes
+# with `count("feature_cache.hit", n)`. Both are no-ops unless a Tracer is active
+# (`with tracing(tracer):`), so the hot paths pay nothing by default.
+# A Tracer writes a JSON run report and, optionally, a Chrome trace (chrome://tracing,
+# Perfetto). With profile=True, stages opened with hot=True also run under cProfile.
+
+
+RSS_SAMPLE_S = 0.005
+_PAGE_BYTES = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def peak_rss_mb() -> float:
+    """Process peak RSS so far (ru_maxrss: KiB on Linux, bytes on macOS)."""
+    if resource is None:
+        return 0.0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024.0 * 1024.0 if sys.platform == "darwin" else 1024.0), 1)
+
+
+def current_rss_mb() -> float | None:
+    """Resident set size right now (/proc/self/statm); None where /proc is not available."""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return round(int(f.read().split()[1]) * _PAGE_BYTES / (1024.0 * 1024.0), 1)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class _RSSSampler:
+    """
+    Running max of the current RSS for every open watch, sampled on one daemon thread that
+    lives while any watch is open. Without /proc, watches fall back to ru_maxrss.
+    """
+
+    def __init__(self, interval: float = RSS_SAMPLE_S):
+        self.interval = float(interval)
+        self.available = current_rss_mb() is not None
+        self._lock = threading.Lock()
+        self._open: Dict[int, float] = {}
+        self._ids = itertools.count()
+        self._running = False
+
+    def open(self) -> Tuple[int, float]:
+        rss = current_rss_mb() if self.available else peak_rss_mb()
+        with self._lock:
+            k = next(self._ids)
+            self._open[k] = rss
+            if self.available and not self._running:
+                self._running = True
+                threading.Thread(target=self._run, name="rss-sampler", daemon=True).start()
+        return k, rss
+
+    def close(self, k: int) -> Tuple[float, float]:
+        """-> (peak, current) RSS in MB."""
+        rss = current_rss_mb() if self.available else peak_rss_mb()
+        with self._lock:
+            return max(self._open.pop(k), rss), rss
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            rss = current_rss_mb() or 0.0
+            with self._lock:
+                if not self._open:
+                    self._running = False
+                    return
+                for k, peak in self._open.items():
+                    if rss > peak:
+                        self._open[k] = rss
+
+
+_SAMPLER = _RSSSampler()
+
+
+class RSSWatch:
+    """`with RSSWatch() as w:` -> w.peak_mb: highest current RSS inside the block (process-wide)."""
+
+    def start(self) -> "RSSWatch":
+        self._key, self.start_mb = _SAMPLER.open()
+        self.peak_mb = self.end_mb = self.start_mb
+        return self
+
+    def stop(self) -> None:
+        self.peak_mb, self.end_mb = _SAMPLER.close(self._key)
+
+    def __enter__(self) -> "RSSWatch":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    @property
+    def growth_mb(self) -> float:
+        return round(self.end_mb - self.start_mb, 1)
+
+
+def _children_cpu_s() -> float:
+    if resource is None:
+        return 0.0
+    ru = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return ru.ru_utime + ru.ru_stime
+
+
+class Tracer:
+    def __init__(self, profile: bool = False, profile_top: int = 25):
+        self.profile = bool(profile)
+        self.profile_top = int(profile_top)
+        self.t0 = time.perf_counter()
+        self.started_at = time.time()
+        self.spans: List[Dict] = []
+        self.counters: Dict[str, int] = {}
+        self.profiles: Dict[str, str] = {}
+        self._depth = 0
+        self._profiler: cProfile.Profile | None = None
+
+    @contextmanager
+    def stage(self, name: str, hot: bool = False, **args) -> Iterator[None]:
+        t_wall = time.perf_counter()
+        t_cpu = time.thread_time()
+        t_proc = time.process_time()
+        t_child = _children_cpu_s()
+        rss = RSSWatch().start()
+
+        prof = None
+        if hot and self.profile and self._profiler is None:
+            prof = self._profiler = cProfile.Profile()
+            prof.enable()
+        self._depth += 1
+        try:
+            yield
+        finally:
+            self._depth -= 1
+            if prof is not None:
+                prof.disable()
+                self._profiler = None
+                self._keep_profile(name, prof)
+            end = time.perf_counter()
+            rss.stop()
+            self.spans.append(
+                {
+                    "name": name,
+                    "depth": self._depth,
+                    "start_ms": round((t_wall - self.t0) * 1000.0, 3),
+                    "wall_ms": round((end - t_wall) * 1000.0, 3),
+                    "cpu_ms": round((time.thread_time() - t_cpu) * 1000.0, 3),
+                    "process_cpu_ms": round((time.process_time() - t_proc) * 1000.0, 3),
+                    "child_cpu_ms": round((_children_cpu_s() - t_child) * 1000.0, 3),
+                    "peak_rss_mb": rss.peak_mb,
+                    "rss_growth_mb": rss.growth_mb,
+                    "tid": threading.get_ident(),
+                    **({"args": args} if args else {}),
+                }
+            )
+
+    def count(self, name: str, n: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + int(n)
+
+    def _keep_profile(self, name: str, prof: cProfile.Profile) -> None:
+        out = io.StringIO()
+        st = pstats.Stats(prof, stream=out)
+        st.sort_stats("cumulative").print_stats(self.profile_top)
+        # several spans of the same stage (e.g. per strip) append to one listing
+        self.profiles[name] = self.profiles.get(name, "") + out.getvalue()
+
+    # ---------- output ----------
+    def totals(self) -> Dict[str, Dict[str, float]]:
+        """Per stage name: calls, summed wall/CPU ms, max peak RSS."""
+        out: Dict[str, Dict[str, float]] = {}
+        for s in self.spans:
+            t = out.setdefault(
+                s["name"],
+                {"calls": 0, "wall_ms": 0.0, "cpu_ms": 0.0, "process_cpu_ms": 0.0, "child_cpu_ms": 0.0, "peak_rss_mb": 0.0},
+            )
+            t["calls"] += 1
+            for k in ("wall_ms", "cpu_ms", "process_cpu_ms", "child_cpu_ms"):
+                t[k] = round(t[k] + s[k], 3)
+            t["peak_rss_mb"] = max(t["peak_rss_mb"], s["peak_rss_mb"])
+        return out
+
+    def report(self, **extra) -> Dict:
+        spans = sorted(self.spans, key=lambda s: s["start_ms"])
+        return {
+            "started_at": self.started_at,
+            "wall_ms": round((time.perf_counter() - self.t0) * 1000.0, 3),
+            "peak_rss_mb": max((s["peak_rss_mb"] for s in spans), default=0.0),
+            "process_cpu_ms": round(time.process_time() * 1000.0, 3),
+            "process_peak_rss_mb": peak_rss_mb(),
+            "pid": os.getpid(),
+            "stages": self.totals(),
+            "counters": dict(sorted(self.counters.items())),
+            "spans": spans,
+            **({"profiles": self.profiles} if self.profiles else {}),
+            **extra,
+        }
+
+    def write_report(self, path: str | Path, **extra) -> Path:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(self.report(**extra), indent=1), encoding="utf-8")
+        return path
+
+    def write_chrome_trace(self, path: str | Path) -> Path:
+        """Trace Event Format: one complete ("X") event per span, counters as "C" events at the end."""
+        pid = os.getpid()
+        events: List[Dict] = [{"name": "process_name", "ph": "M", "pid": pid, "args": {"name": "zenko-render"}}]
+        for s in sorted(self.spans, key=lambda s: s["start_ms"]):
+            events.append(
+                {
+                    "name": s["name"],
+                    "ph": "X",
+                    "pid": pid,
+                    "tid": s["tid"],
+                    "ts": round(s["start_ms"] * 1000.0, 1),
+                    "dur": round(s["wall_ms"] * 1000.0, 1),
+                    "args": {"cpu_ms": s["cpu_ms"], "peak_rss_mb": s["peak_rss_mb"], **s.get("args", {})},
+                }
+            )
+        end_us = round((time.perf_counter() - self.t0) * 1e6, 1)
+        if self.counters:
+            events.append({"name": "counters", "ph": "C", "pid": pid, "ts": end_us, "args": dict(self.counters)})
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}), encoding="utf-8")
+        return path
+
+    def format_summary(self) -> List[str]:
+        lines = []
+        for name, t in self.totals().items():
+            lines.append(
+                f"[TRACE] {name:<16} wall={t['wall_ms']:9.1f}ms cpu={t['cpu_ms']:9.1f}ms "
+                f"calls={int(t['calls'])} peak_rss={t['peak_rss_mb']}MB"
+            )
+        if self.counters:
+            lines.append("[TRACE] counters " + " ".join(f"{k}={v}" for k, v in sorted(self.counters.items())))
+        return lines
+
+
+_current: ContextVar[Tracer | None] = ContextVar("zenko_tracer", default=None)
+
+
+@contextmanager
+def tracing(tracer: Tracer) -> Iterator[Tracer]:
+    token = _current.set(tracer)
+    try:
+        yield tracer
+    finally:
+        _current.reset(token)
+
+
+def stage(name: str, hot: bool = False, **args):
+    tracer = _current.get()
+    return tracer.stage(name, hot=hot, **args) if tracer is not None else nullcontext()
+
+
+def count(name: str, n: int = 1) -> None:
+    tracer = _current.get()
+    if tracer is not None and n:
+        tracer.count(name, n)
+
+
+def traced(fn, *args, **kwargs):
+    """fn(*args, **kwargs) under a fresh Tracer (e.g. one render on a worker thread/process) -> (result, tracer)."""
+    tracer = Tracer()
+    with tracing(tracer):
+        result = fn(*args, **kwargs)
+    return result, tracer
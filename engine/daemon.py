@@ -0,0 +1,378 @@
+from __future__ import annotations
+
+import asyncio
+import itertools
+import json
+import os
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Deque, Dict, List, Tuple
+from urllib.parse import urlsplit
+
+from engine.bootstrap import build_target_match_config
+from engine.core.debug_renderer import PoolKey, TargetMatchConfig, TilePool, load_tile_pool, render_target_match_debug, tile_pool_key
+from engine.core.tracing import traced
+from engine.profiles.registry import load_profile, merge_profile
+
+
+# -----------------------------
+# Render daemon: resident profile + tile pools, asyncio job queue, local HTTP API
+# -----------------------------
+# Endpoints (HTTP/1.1 on host:port and/or a Unix socket):
+#   POST /render     {"target": ..., "name"?, "output"?, "format"?: "png"|"jpg", "profile"?: {...overrides}}
+#                    -> NDJSON stream: queued, started, done|failed (output path + stats + timings)
+#   GET  /jobs/<id>  job record
+#   GET  /stats      queue depth, running, per-job timings, tile pool generation
+#   POST /reload     reload the tile library now
+#   GET  /health
+# Renders run on a thread pool of `concurrency` workers sharing the resident pools
+# (memory-mapped atlas, read-only). The tile library is polled and reloaded in the
+# background when files change; jobs already running keep the pool they started with.
+
+
+@dataclass
+class DaemonConfig:
+    host: str = "127.0.0.1"
+    port: int = 8765  # 0 = no TCP listener
+    unix_socket: str | None = None
+    concurrency: int = 1
+    queue_size: int = 64
+    reload_interval_s: float = 2.0  # 0 = no tile library watcher
+    history: int = 200
+    # proofs favour turnaround: fast PNG deflate unless the job's profile sets render.png_compress_level
+    png_compress_level: int = 1
+
+
+@dataclass
+class RenderJob:
+    id: int
+    name: str
+    cfg: TargetMatchConfig
+    submitted: float = field(default_factory=time.perf_counter)
+    started: float | None = None
+    finished: float | None = None
+    status: str = "queued"
+    stats: Dict | None = None
+    stages: Dict | None = None
+    error: str | None = None
+    generation: int = 0
+    started_event: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+    done_event: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+
+    def record(self) -> Dict:
+        rec: Dict = {
+            "job": self.id,
+            "name": self.name,
+            "status": self.status,
+            "target": self.cfg.target_path,
+            "output": self.cfg.out_path,
+            "tile_generation": self.generation,
+        }
+        if self.started is not None:
+            rec["queue_ms"] = round((self.started - self.submitted) * 1000.0, 1)
+        if self.finished is not None and self.started is not None:
+            rec["render_ms"] = round((self.finished - self.started) * 1000.0, 1)
+            rec["total_ms"] = round((self.finished - self.submitted) * 1000.0, 1)
+        if self.stats is not None:
+            rec["stats"] = self.stats
+        if self.stages is not None:
+            rec["stages"] = self.stages
+        if self.error is not None:
+            rec["error"] = self.error
+        return rec
+
+
+def _library_signature(raw_tiles_dir: str) -> Tuple:
+    """(name, mtime_ns, size) of every file in the tile library: changes on add/remove/edit."""
+    try:
+        with os.scandir(raw_tiles_dir) as it:
+            return tuple(sorted((e.name, e.stat().st_mtime_ns, e.stat().st_size) for e in it if e.is_file()))
+    except OSError:
+        return ()
+
+
+class RenderDaemon:
+    def __init__(self, config: dict, dcfg: DaemonConfig):
+        self.paths = config["paths"]
+        self.profile = load_profile(config["engine"].get("profile", ""))
+        self.dcfg = dcfg
+        self.out_dir = Path(self.paths.get("output", "output")) / "daemon"
+        self.cache_dir = str(Path(self.paths.get("output", "output")))
+
+        self._executor = ThreadPoolExecutor(max_workers=max(1, dcfg.concurrency) + 1)
+        self._queue: asyncio.Queue[RenderJob] | None = None
+        self._pools: Dict[PoolKey, TilePool] = {}
+        self._pool_cfgs: Dict[PoolKey, TargetMatchConfig] = {}
+        self._pool_lock: asyncio.Lock | None = None
+        self._ids = itertools.count(1)
+        self._jobs: Dict[int, RenderJob] = {}
+        self._history: Deque[RenderJob] = deque(maxlen=dcfg.history)
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.generation = 0
+        self.reloads: List[Dict] = []
+        self.started_at = time.time()
+
+    # ---------- tile pools ----------
+    @staticmethod
+    def _pool_label(key: PoolKey) -> str:
+        return (
+            f"s{key[1]}_b{key[2]}"
+            + (f"_sub{key[3]}" if key[3] else "")
+            + (f"_dd{key[4]}" if key[4] >= 0 else "")
+            + (f"_{key[5]}" if key[5] != "packed" else "")
+            + ("_mips" if key[6] else "")
+        )
+
+    async def _pool_for(self, cfg: TargetMatchConfig) -> TilePool:
+        key = tile_pool_key(cfg)
+        pool = self._pools.get(key)
+        if pool is not None:
+            return pool
+        async with self._pool_lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                loop = asyncio.get_running_loop()
+                pool = await loop.run_in_executor(self._executor, load_tile_pool, cfg, self.cache_dir)
+                self._pools[key] = pool
+                self._pool_cfgs[key] = cfg
+        return pool
+
+    async def reload(self, reason: str) -> Dict:
+        """
+        Rebuild every resident pool (incremental: only new/changed tiles are decoded), then swap.
+        verify=True: the library signature also catches in-place edits, which the stores' dir-mtime
+        fast path would miss.
+        """
+        async with self._pool_lock:
+            t0 = time.perf_counter()
+            loop = asyncio.get_running_loop()
+            fresh: Dict[PoolKey, TilePool] = {}
+            for key in self._pools:
+                fresh[key] = await loop.run_in_executor(
+                    self._executor, load_tile_pool, self._pool_cfgs[key], self.cache_dir, True
+                )
+            self._pools = fresh
+            self.generation += 1
+            info = {
+                "generation": self.generation,
+                "reason": reason,
+                "ms": round((time.perf_counter() - t0) * 1000.0, 1),
+                "tiles": {self._pool_label(k): len(p.tile_ids) for k, p in fresh.items()},
+            }
+            self.reloads = (self.reloads + [info])[-20:]
+            print(f"[DAEMON] tile library reloaded gen={self.generation} ({reason}) in {info['ms']}ms tiles={info['tiles']}")
+            return info
+
+    async def _watch_library(self) -> None:
+        raw_dir = str(self.paths.get("raw_tiles", "data/raw_tiles"))
+        loop = asyncio.get_running_loop()
+        sig = await loop.run_in_executor(self._executor, _library_signature, raw_dir)
+        pending = None
+        while True:
+            await asyncio.sleep(self.dcfg.reload_interval_s)
+            now = await loop.run_in_executor(self._executor, _library_signature, raw_dir)
+            if now == sig:
+                pending = None
+                continue
+            # wait for one quiet interval so a copy in progress is not picked up half way
+            if now != pending:
+                pending = now
+                continue
+            sig, pending = now, None
+            try:
+                await self.reload("raw_tiles changed")
+            except Exception as e:
+                print(f"[DAEMON] reload failed: {type(e).__name__}: {e}")
+
+    # ---------- jobs ----------
+    def _job_config(self, req: Dict, name: str) -> TargetMatchConfig:
+        profile = merge_profile(self.profile, {"render": {"png_compress_level": self.dcfg.png_compress_level}})
+        profile = merge_profile(profile, req.get("profile"))
+        fmt = str(req.get("format", "png")).lower().lstrip(".")
+        if fmt not in ("png", "jpg"):
+            raise ValueError(f"Unsupported output format: {fmt}")
+        out_path = req.get("output") or str(self.out_dir / f"{name}.{fmt}")
+        return build_target_match_config(profile, self.paths, str(req.get("target", "")), out_path)
+
+    def submit(self, req: Dict) -> RenderJob:
+        if not req.get("target"):
+            raise ValueError("render request needs a 'target' path")
+        job_id = next(self._ids)
+        name = str(req.get("name") or f"{Path(str(req['target'])).stem}_{job_id:05d}")
+        job = RenderJob(job_id, name, self._job_config(req, name))
+        self._queue.put_nowait(job)  # QueueFull -> 503
+        # job records live as long as the history ring (queued/running jobs are always in it)
+        if len(self._history) == self._history.maxlen:
+            self._jobs.pop(self._history[0].id, None)
+        self._history.append(job)
+        self._jobs[job_id] = job
+        return job
+
+    async def _worker(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._queue.get()
+            job.started = time.perf_counter()
+            job.status = "running"
+            self.running += 1
+            job.started_event.set()
+            try:
+                pool = await self._pool_for(job.cfg)
+                job.generation = self.generation
+                job.stats, tracer = await loop.run_in_executor(self._executor, traced, render_target_match_debug, job.cfg, pool)
+                job.stages = tracer.totals()
+                job.status = "done"
+                self.completed += 1
+            except Exception as e:
+                job.status = "failed"
+                job.error = f"{type(e).__name__}: {e}"
+                self.failed += 1
+                print(f"[DAEMON] job {job.id} failed: {job.error}\n{traceback.format_exc()}")
+            finally:
+                job.finished = time.perf_counter()
+                self.running -= 1
+                job.done_event.set()
+                self._queue.task_done()
+
+    def stats(self) -> Dict:
+        finished = [j for j in self._history if j.status == "done"]
+        render_ms = sorted((j.finished - j.started) * 1000.0 for j in finished)
+        queue_ms = sorted((j.started - j.submitted) * 1000.0 for j in finished)
+
+        def pct(xs: List[float], q: float) -> float | None:
+            return round(xs[min(len(xs) - 1, int(q * len(xs)))], 1) if xs else None
+
+        return {
+            "uptime_s": round(time.time() - self.started_at, 1),
+            "queue_depth": self._queue.qsize(),
+            "queue_size": self.dcfg.queue_size,
+            "running": self.running,
+            "concurrency": self.dcfg.concurrency,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "render_ms": {"p50": pct(render_ms, 0.5), "p95": pct(render_ms, 0.95), "max": pct(render_ms, 1.0)},
+            "queue_ms": {"p50": pct(queue_ms, 0.5), "p95": pct(queue_ms, 0.95), "max": pct(queue_ms, 1.0)},
+            "tile_generation": self.generation,
+            "tile_pools": {self._pool_label(k): len(p.tile_ids) for k, p in self._pools.items()},
+            "reloads": self.reloads,
+            "recent_jobs": [j.record() for j in list(self._history)[-20:]],
+        }
+
+    # ---------- HTTP ----------
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+            lines = head.decode("latin-1").split("\r\n")
+            method, target, _ = lines[0].split(" ", 2)
+            headers = {k.strip().lower(): v.strip() for k, v in (ln.split(":", 1) for ln in lines[1:] if ":" in ln)}
+            body = await reader.readexactly(int(headers.get("content-length", 0) or 0))
+            path = urlsplit(target).path.rstrip("/") or "/"
+
+            if method == "GET" and path == "/health":
+                await _send_json(writer, 200, {"ok": True, "tile_generation": self.generation})
+            elif method == "GET" and path == "/stats":
+                await _send_json(writer, 200, self.stats())
+            elif method == "GET" and path.startswith("/jobs/"):
+                job = self._jobs.get(int(path.rsplit("/", 1)[1]) if path.rsplit("/", 1)[1].isdigit() else -1)
+                if job is None:
+                    await _send_json(writer, 404, {"error": "unknown job"})
+                else:
+                    await _send_json(writer, 200, job.record())
+            elif method == "POST" and path == "/reload":
+                await _send_json(writer, 200, await self.reload("requested"))
+            elif method == "POST" and path == "/render":
+                await self._render_stream(writer, json.loads(body or b"{}"))
+            else:
+                await _send_json(writer, 404, {"error": f"no route {method} {path}"})
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            try:
+                await _send_json(writer, 400, {"error": f"{type(e).__name__}: {e}"})
+            except ConnectionError:
+                pass
+        finally:
+            writer.close()
+
+    async def _render_stream(self, writer: asyncio.StreamWriter, req: Dict) -> None:
+        try:
+            job = self.submit(req)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            await _send_json(writer, 503, {"error": "queue full", "queue_depth": self._queue.qsize()})
+            return
+
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n"
+            b"Transfer-Encoding: chunked\r\nConnection: close\r\n\r\n"
+        )
+        await _send_event(writer, {"event": "queued", "job": job.id, "queue_depth": self._queue.qsize()})
+        await job.started_event.wait()
+        await _send_event(writer, {"event": "started", "job": job.id})
+        await job.done_event.wait()
+        await _send_event(writer, {"event": job.status, **job.record()})
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def serve(self) -> None:
+        self._queue = asyncio.Queue(maxsize=max(1, self.dcfg.queue_size))
+        self._pool_lock = asyncio.Lock()
+
+        # warm the default pool before accepting jobs
+        await self._pool_for(self._job_config({"target": ""}, "warmup"))
+
+        servers = []
+        if self.dcfg.port:
+            servers.append(await asyncio.start_server(self._handle, self.dcfg.host, self.dcfg.port))
+            print(f"[DAEMON] listening on http://{self.dcfg.host}:{self.dcfg.port}")
+        if self.dcfg.unix_socket:
+            Path(self.dcfg.unix_socket).unlink(missing_ok=True)
+            servers.append(await asyncio.start_unix_server(self._handle, self.dcfg.unix_socket))
+            print(f"[DAEMON] listening on unix:{self.dcfg.unix_socket}")
+        if not servers:
+            raise ValueError("Daemon needs a TCP port or a Unix socket")
+
+        tasks = [asyncio.create_task(self._worker()) for _ in range(max(1, self.dcfg.concurrency))]
+        if self.dcfg.reload_interval_s > 0:
+            tasks.append(asyncio.create_task(self._watch_library()))
+        print(f"[DAEMON] ready: concurrency={self.dcfg.concurrency} queue_size={self.dcfg.queue_size}")
+        try:
+            await asyncio.gather(*(s.serve_forever() for s in servers), *tasks)
+        finally:
+            for t in tasks:
+                t.cancel()
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 503: "Service Unavailable"}
+
+
+async def _send_json(writer: asyncio.StreamWriter, status: int, payload: Dict) -> None:
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    writer.write(
+        f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1")
+        + body
+    )
+    await writer.drain()
+
+
+async def _send_event(writer: asyncio.StreamWriter, event: Dict) -> None:
+    line = json.dumps(event, ensure_ascii=False).encode("utf-8") + b"\n"
+    writer.write(f"{len(line):x}\r\n".encode("latin-1") + line + b"\r\n")
+    await writer.drain()
+
+
+def run_daemon(config: dict, dcfg: DaemonConfig) -> None:
+    try:
+        asyncio.run(RenderDaemon(config, dcfg).serve())
+    except KeyboardInterrupt:
+        print("[DAEMON] stopped")
@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Tuple
+
+from PIL import Image
+
+
+# -----------------------------
+# Per-format decode counters
+# -----------------------------
+# format -> {"files", "seconds", "source_px", "decoded_px"}
+DECODE_STATS: Dict[str, Dict[str, float]] = {}
+_STATS_LOCK = threading.Lock()  # tiles may be decoded on prefetch threads
+
+
+def reset_decode_stats() -> None:
+    DECODE_STATS.clear()
+
+
+def decode_stats() -> Dict[str, Dict[str, float]]:
+    return {fmt: dict(v) for fmt, v in DECODE_STATS.items()}
+
+
+def merge_decode_stats(other: Dict[str, Dict[str, float]]) -> None:
+    """Fold counters collected elsewhere (e.g. in a worker process) into DECODE_STATS."""
+    for fmt, v in other.items():
+        acc = DECODE_STATS.setdefault(fmt, {"files": 0, "seconds": 0.0, "source_px": 0, "decoded_px": 0})
+        for k, x in v.items():
+            acc[k] = acc.get(k, 0) + x
+
+
+def format_decode_stats() -> list[str]:
+    lines = []
+    for fmt in sorted(DECODE_STATS):
+        v = DECODE_STATS[fmt]
+        files = int(v["files"])
+        ms = v["seconds"] * 1000.0
+        ratio = (v["decoded_px"] / v["source_px"]) if v["source_px"] else 1.0
+        lines.append(
+            f"[DECODE] {fmt:<5} files={files} total_ms={ms:.1f} "
+            f"ms/file={ms / max(1, files):.2f} decoded_px_ratio={ratio:.4f}"
+        )
+    return lines
+
+
+def _record(fmt: str, seconds: float, source_px: int, decoded_px: int) -> None:
+    with _STATS_LOCK:
+        acc = DECODE_STATS.setdefault(fmt, {"files": 0, "seconds": 0.0, "source_px": 0, "decoded_px": 0})
+        acc["files"] += 1
+        acc["seconds"] += seconds
+        acc["source_px"] += source_px
+        acc["decoded_px"] += decoded_px
+
+
+# -----------------------------
+# Reduced-resolution decode
+# -----------------------------
+def _reduce_factor(size: Tuple[int, int], min_size: Tuple[int, int]) -> int:
+    w, h = size
+    mw, mh = max(1, int(min_size[0])), max(1, int(min_size[1]))
+    return max(1, min(w // mw, h // mh))
+
+
+def decode_rgb(path: str | Path, min_size: Tuple[int, int] | None = None) -> Image.Image:
+    """
+    Open + decode an image as RGB, at the smallest scale that still covers min_size (w, h).
+    - JPEG: DCT-domain scaling via Image.draft (1/2, 1/4, 1/8), no full-size decode
+    - other formats (WebP, PNG...): integer box reduce right after decode
+    min_size=None => full resolution.
+    """
+    t0 = time.perf_counter()
+    with Image.open(path) as im:
+        fmt = im.format or Path(path).suffix.lstrip(".").upper() or "?"
+        source = im.size
+
+        if min_size is not None and fmt == "JPEG":
+            im.draft("RGB", (max(1, int(min_size[0])), max(1, int(min_size[1]))))
+            out = im.convert("RGB")
+        else:
+            out = im.convert("RGB")
+            if min_size is not None:
+                factor = _reduce_factor(out.size, min_size)
+                if factor > 1:
+                    out = out.reduce(factor)
+
+    _record(fmt, time.perf_counter() - t0, source[0] * source[1], out.size[0] * out.size[1])
+    return out
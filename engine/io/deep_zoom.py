@@ -0,0 +1,300 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import math
+import os
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import Deque, Dict, List, Set, Tuple
+
+import numpy as np
+from PIL import Image
+
+
+# -----------------------------
+# Deep Zoom (DZI) pyramid writer
+# -----------------------------
+# Layout read by OpenSeadragon & co:
+#   <name>.dzi                           XML descriptor
+#   <name>_files/<level>/<col>_<row>.<fmt>
+#   <name>_files/manifest.json           pixel hash per tile (incremental re-export)
+# The manifest is removed before the first tile is overwritten and written again on close,
+# so a failed export never leaves hashes that no longer match the files; abort() keeps the
+# previous entries of the tiles it did not touch.
+# Level max_level is full resolution, each level below is a 2x box reduce of the
+# one above, down to 1x1 at level 0. Rows are pushed top to bottom, so a whole
+# frame or the streamed renderer's strips feed it with the same bounded memory.
+MANIFEST_VERSION = 1
+
+_DZI_XML = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" TileSize="{tile}" Overlap="{overlap}" Format="{fmt}">\n'
+    '  <Size Width="{w}" Height="{h}"/>\n'
+    "</Image>\n"
+)
+
+
+def _encode_tiles(jobs: List[Tuple[str, np.ndarray]], fmt: str, quality: int) -> int:
+    for path, arr in jobs:
+        im = Image.fromarray(arr, mode="RGB")
+        if fmt == "jpg":
+            im.save(path, quality=quality)
+        else:
+            im.save(path, compress_level=6)
+    return len(jobs)
+
+
+def _tile_hash(arr: np.ndarray) -> str:
+    return hashlib.blake2b(np.ascontiguousarray(arr).data, digest_size=10).hexdigest()
+
+
+def _reduce2(rows: np.ndarray) -> np.ndarray:
+    """2x box reduce of a block of rows (a trailing odd row or column is averaged alone)."""
+    return np.asarray(Image.fromarray(rows, mode="RGB").reduce(2), dtype=np.uint8)
+
+
+class _Level:
+    """Rows of one pyramid level still needed by unfinished tile rows."""
+
+    def __init__(self, index: int, width: int, height: int):
+        self.index = index
+        self.width = width
+        self.height = height
+        self.buf = np.empty((0, width, 3), dtype=np.uint8)
+        self.buf_y0 = 0  # level y of buf[0]
+        self.received = 0  # rows pushed so far
+        self.next_tile_row = 0
+        self.carry: np.ndarray | None = None  # odd row waiting for its pair (reduce to the next level)
+
+
+class DeepZoomWriter:
+    """
+    Build a DZI pyramid from top-to-bottom row strips:
+        with DeepZoomWriter(out_dir, "mosaic", w, h, workers=4) as dz:
+            dz.write_rows(strip)   # uint8 (rows, w, 3)
+    workers: 0/1 = encode in-process, N = process pool of N, -1 = one per CPU.
+    Tiles whose pixels hash the same as in the previous export are not re-encoded.
+    """
+
+    def __init__(
+        self,
+        out_dir: str | Path,
+        name: str,
+        width: int,
+        height: int,
+        tile_size: int = 254,
+        overlap: int = 1,
+        fmt: str = "jpg",
+        quality: int = 90,
+        workers: int = 0,
+    ):
+        fmt = fmt.lower().replace("jpeg", "jpg")
+        if fmt not in ("jpg", "png"):
+            raise ValueError(f"Unsupported DZI tile format: {fmt}")
+        if width <= 0 or height <= 0 or tile_size <= 0 or overlap < 0:
+            raise ValueError(f"Invalid DZI geometry {width}x{height} tile={tile_size} overlap={overlap}")
+
+        self.out_dir = Path(out_dir)
+        self.name = name
+        self.width = int(width)
+        self.height = int(height)
+        self.tile_size = int(tile_size)
+        self.overlap = int(overlap)
+        self.fmt = fmt
+        self.quality = int(quality)
+        self.files_dir = self.out_dir / f"{name}_files"
+
+        self.max_level = int(math.ceil(math.log2(max(self.width, self.height)))) if max(self.width, self.height) > 1 else 0
+        self.levels: List[_Level] = []
+        w, h = self.width, self.height
+        for lvl in range(self.max_level, -1, -1):
+            self.levels.append(_Level(lvl, w, h))
+            w, h = (w + 1) // 2, (h + 1) // 2
+
+        # header keys that invalidate every tile when they change
+        self._params = {
+            "version": MANIFEST_VERSION,
+            "width": self.width,
+            "height": self.height,
+            "tile_size": self.tile_size,
+            "overlap": self.overlap,
+            "format": self.fmt,
+            "quality": self.quality,
+        }
+        self._prev_tiles = self._load_manifest()
+        self._tiles: Dict[str, str] = {}
+        self._touched: Set[str] = set()  # tiles (re)encoded by this export
+        self.tiles_written = 0
+        self.tiles_skipped = 0
+
+        for lv in self.levels:
+            (self.files_dir / str(lv.index)).mkdir(parents=True, exist_ok=True)
+
+        workers = (os.cpu_count() or 1) if workers < 0 else int(workers)
+        self.workers = max(1, workers)
+        self._pool = ProcessPoolExecutor(max_workers=self.workers) if self.workers > 1 else None
+        self._pending: Deque[Future] = deque()
+        self._closed = False
+
+    # ---------- manifest ----------
+    @property
+    def _manifest_file(self) -> Path:
+        return self.files_dir / "manifest.json"
+
+    def _load_manifest(self) -> Dict[str, str]:
+        try:
+            data = json.loads(self._manifest_file.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+        if data.get("params") != self._params:
+            return {}
+        return dict(data.get("tiles", {}))
+
+    def _write_manifest(self, tiles: Dict[str, str]) -> None:
+        tmp = self._manifest_file.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps({"params": self._params, "tiles": tiles}), encoding="utf-8")
+        os.replace(tmp, self._manifest_file)
+
+    # ---------- rows ----------
+    def write_rows(self, rows: np.ndarray) -> None:
+        rows = np.asarray(rows)
+        top = self.levels[0]
+        if rows.dtype != np.uint8 or rows.ndim != 3 or rows.shape[1:] != (top.width, 3):
+            raise ValueError(f"Expected uint8 (n, {top.width}, 3) rows, got {rows.dtype} {rows.shape}")
+        if top.received + rows.shape[0] > top.height:
+            raise ValueError("More rows than the declared DZI height")
+        # own copy: the tail is kept across calls for the next tile row's overlap
+        self._push(0, np.array(rows, copy=True))
+
+    def _push(self, i: int, rows: np.ndarray) -> None:
+        lv = self.levels[i]
+        if rows.shape[0] == 0:
+            return
+        lv.buf = np.concatenate([lv.buf, rows]) if lv.buf.shape[0] else rows
+        lv.received += rows.shape[0]
+        self._cut_ready(lv)
+
+        if i + 1 < len(self.levels):
+            pair = np.concatenate([lv.carry, rows]) if lv.carry is not None else rows
+            even = pair.shape[0] & ~1
+            lv.carry = pair[even:] if pair.shape[0] > even else None
+            if lv.carry is not None and lv.received == lv.height:
+                even, lv.carry = pair.shape[0], None  # last odd row reduces on its own
+            if even:
+                self._push(i + 1, _reduce2(pair[:even]))
+
+    def _cut_ready(self, lv: _Level) -> None:
+        T, ov = self.tile_size, self.overlap
+        n_rows = -(-lv.height // T)
+        while lv.next_tile_row < n_rows:
+            r = lv.next_tile_row
+            y0 = max(0, r * T - ov)
+            y1 = min(lv.height, (r + 1) * T + ov)
+            if lv.received < y1:
+                return
+            self._emit_tile_row(lv, r, lv.buf[y0 - lv.buf_y0 : y1 - lv.buf_y0])
+            lv.next_tile_row += 1
+            # keep only what the next tile row's top overlap still needs
+            keep_from = max(0, (r + 1) * T - ov)
+            drop = keep_from - lv.buf_y0
+            if drop > 0:
+                lv.buf = lv.buf[drop:]
+                lv.buf_y0 = keep_from
+
+    def _emit_tile_row(self, lv: _Level, r: int, band: np.ndarray) -> None:
+        T, ov = self.tile_size, self.overlap
+        jobs: List[Tuple[str, np.ndarray]] = []
+        keys: List[str] = []
+        for c in range(-(-lv.width // T)):
+            x0 = max(0, c * T - ov)
+            x1 = min(lv.width, (c + 1) * T + ov)
+            tile = np.ascontiguousarray(band[:, x0:x1])
+            key = f"{lv.index}/{c}_{r}"
+            digest = _tile_hash(tile)
+            self._tiles[key] = digest
+            path = self.files_dir / str(lv.index) / f"{c}_{r}.{self.fmt}"
+            if self._prev_tiles.get(key) == digest and path.exists():
+                self.tiles_skipped += 1
+                continue
+            jobs.append((str(path), tile))
+            keys.append(key)
+        if not jobs:
+            return
+        if not self._touched:
+            self._manifest_file.unlink(missing_ok=True)  # its hashes stop matching the files from here on
+        self._touched.update(keys)
+        self.tiles_written += len(jobs)
+
+        if self._pool is None:
+            _encode_tiles(jobs, self.fmt, self.quality)
+            return
+        # bounded in-flight work: memory stays at a few tile rows per worker
+        while len(self._pending) >= 2 * self.workers:
+            self._pending.popleft().result()
+        self._pending.append(self._pool.submit(_encode_tiles, jobs, self.fmt, self.quality))
+
+    # ---------- lifecycle ----------
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            top = self.levels[0]
+            if top.received != top.height:
+                raise ValueError(f"DZI incomplete: {top.received}/{top.height} rows written")
+            while self._pending:
+                self._pending.popleft().result()
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True)
+                self._pool = None
+
+        # tiles of a previous export that no longer exist in this geometry
+        for key in set(self._prev_tiles) - set(self._tiles):
+            lvl, cr = key.split("/", 1)
+            (self.files_dir / lvl / f"{cr}.{self.fmt}").unlink(missing_ok=True)
+        self._write_manifest(self._tiles)
+        (self.out_dir / f"{self.name}.dzi").write_text(
+            _DZI_XML.format(tile=self.tile_size, overlap=self.overlap, fmt=self.fmt, w=self.width, h=self.height),
+            encoding="utf-8",
+        )
+
+    def abort(self) -> None:
+        self._closed = True
+        self._pending.clear()
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+        if self._touched and self._prev_tiles:
+            # untouched tiles still hold the previous export's pixels
+            self._write_manifest({k: v for k, v in self._prev_tiles.items() if k not in self._touched})
+
+    def __enter__(self) -> "DeepZoomWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "dzi_levels": len(self.levels),
+            "dzi_tiles_written": self.tiles_written,
+            "dzi_tiles_skipped": self.tiles_skipped,
+        }
+
+
+def write_deep_zoom(
+    image: np.ndarray, out_dir: str | Path, name: str, **kwargs
+) -> Dict[str, int]:
+    """One-shot export of a whole uint8 (H,W,3) frame."""
+    h, w = image.shape[:2]
+    with DeepZoomWriter(out_dir, name, w, h, **kwargs) as dz:
+        step = max(dz.tile_size, 1024)
+        for y in range(0, h, step):
+            dz.write_rows(image[y : y + step])
+    return dz.stats()
@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import os
+import struct
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+
+# -----------------------------
+# Row-streamed PNG writer (RGB8)
+# -----------------------------
+# Rows are filtered ("Up"), deflated incrementally and flushed as IDAT chunks,
+# so memory stays at one strip + the zlib window whatever the image height.
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+_FILTER_UP = 2
+IDAT_CHUNK_BYTES = 1 << 20
+
+
+def _chunk(tag: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+
+class PNGStreamWriter:
+    """
+    Write a width x height RGB PNG strip by strip:
+        with PNGStreamWriter(path, w, h) as png:
+            png.write_rows(strip)   # uint8 (rows, w, 3), top to bottom
+    The file is written to a temp path and moved in place on a complete close.
+    """
+
+    def __init__(self, path: str | Path, width: int, height: int, compress_level: int = 6):
+        self.path = Path(path)
+        self.width = int(width)
+        self.height = int(height)
+        if self.width <= 0 or self.height <= 0:
+            raise ValueError(f"Invalid PNG size {self.width}x{self.height}")
+
+        self.rows_written = 0
+        self._prev = np.zeros((self.width * 3,), dtype=np.uint8)
+        self._z = zlib.compressobj(int(compress_level))
+        self._pending = bytearray()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._tmp = self.path.with_name(self.path.name + ".part")
+        self._f = open(self._tmp, "wb")
+        ihdr = struct.pack(">IIBBBBB", self.width, self.height, 8, 2, 0, 0, 0)
+        self._f.write(_PNG_SIGNATURE + _chunk(b"IHDR", ihdr))
+
+    def _emit(self, data: bytes, final: bool = False) -> None:
+        self._pending += data
+        while len(self._pending) >= IDAT_CHUNK_BYTES or (final and self._pending):
+            part = bytes(self._pending[:IDAT_CHUNK_BYTES])
+            del self._pending[:IDAT_CHUNK_BYTES]
+            self._f.write(_chunk(b"IDAT", part))
+
+    def write_rows(self, rows: np.ndarray) -> None:
+        rows = np.asarray(rows)
+        if rows.dtype != np.uint8 or rows.ndim != 3 or rows.shape[1:] != (self.width, 3):
+            raise ValueError(f"Expected uint8 (n, {self.width}, 3) rows, got {rows.dtype} {rows.shape}")
+        n = rows.shape[0]
+        if self.rows_written + n > self.height:
+            raise ValueError("More rows than the declared PNG height")
+        if n == 0:
+            return
+
+        flat = rows.reshape(n, -1)
+        filtered = np.empty((n, flat.shape[1] + 1), dtype=np.uint8)
+        filtered[:, 0] = _FILTER_UP
+        # Up filter: byte minus the byte above (mod 256), first row against the previous strip
+        np.subtract(flat[0], self._prev, out=filtered[0, 1:])
+        np.subtract(flat[1:], flat[:-1], out=filtered[1:, 1:])
+        self._prev = flat[-1].copy()
+
+        self._emit(self._z.compress(filtered.tobytes()))
+        self.rows_written += n
+
+    def close(self) -> None:
+        if self._f.closed:
+            return
+        try:
+            if self.rows_written != self.height:
+                raise ValueError(f"PNG incomplete: {self.rows_written}/{self.height} rows written")
+            self._emit(self._z.flush(), final=True)
+            self._f.write(_chunk(b"IEND", b""))
+        finally:
+            self._f.close()
+        os.replace(self._tmp, self.path)
+
+    def abort(self) -> None:
+        if not self._f.closed:
+            self._f.close()
+        self._tmp.unlink(missing_ok=True)
+
+    def __enter__(self) -> "PNGStreamWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
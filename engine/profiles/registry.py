@@ -1,3 +1,4 @@
+import copy
 import importlib
 
 
@@ -18,3 +19,14 @@ def load_profile(name: str) -> dict:
         raise ValueError(f"Profile module '{module_path}' has no PROFILE dict")
 
     return module.PROFILE
+
+
+def merge_profile(base: dict, overrides: dict | None) -> dict:
+    """Copy of `base` with `overrides` applied; nested dicts merge key by key."""
+    merged = copy.deepcopy(base)
+    for key, value in (overrides or {}).items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_profile(merged[key], value)
+        else:
+            merged[key] = copy.deepcopy(value)
+    return merged
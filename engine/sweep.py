@@ -0,0 +1,237 @@
+from __future__ import annotations
+
+import csv
+import itertools
+import json
+import os
+import re
+import time
+from pathlib import Path
+from typing import Dict, List, Sequence, Tuple
+
+from PIL import Image, ImageDraw
+
+from engine.batch import BatchJob, render_jobs, warm_pools
+from engine.bootstrap import build_target_match_config, default_target_path
+from engine.profiles.registry import load_profile, merge_profile
+
+
+# -----------------------------
+# Parameter sweeps (in process, no profile patching)
+# -----------------------------
+# Spec (JSON file and/or --vary KEY=V1,V2 on the command line):
+#   {
+#     "target": "data/target/target.jpg",        # optional (default: the run target)
+#     "output_dir": "output/sweep",              # optional (default: <paths.output>/sweep_<timestamp>)
+#     "format": "png",                           # or "jpg" for quick proofs
+#     "profile": {...},                          # overrides shared by every variant
+#     "grid": {"tiles.size": [48, 68], "a4_blend.alpha_center": [0.72, 0.82]},   # cartesian product
+#     "variants": [{"name": "two_faces", "profile": {"a4_match": {"foci": [...]}}}],  # explicit extras
+#     "include_base": false                      # also render the unmodified base profile
+#   }
+# Variants share the warm tile pools of batch mode (one per tile size / blur) and the
+# stage cache of the sweep directory, so alpha-only variants re-blend a cached mosaic.
+# Outputs: one image per variant, contact_sheet.jpg, sweep.csv, stats.jsonl.
+
+SHEET_THUMB_W = 480
+_TABLE_STAGES = ("target_analysis", "matching", "compose", "blend", "encode")
+_TABLE_STATS = ("max_center_repeat", "cap_fallbacks", "greedy_cost")
+
+
+def _nested(dotted: str, value) -> Dict:
+    """"a4_blend.alpha_center", 0.8 -> {"a4_blend": {"alpha_center": 0.8}}"""
+    out: Dict = value
+    for part in reversed(dotted.split(".")):
+        out = {part: out}
+    return out
+
+
+def _parse_value(text: str):
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return text
+
+
+def parse_vary(items: Sequence[str]) -> Dict[str, List]:
+    """["tiles.size=48,68", "a4_match.pick_mode=best,global"] -> grid dict."""
+    grid: Dict[str, List] = {}
+    for item in items:
+        key, sep, values = item.partition("=")
+        if not sep or not key.strip():
+            raise ValueError(f"--vary expects KEY=V1,V2,..., got: {item!r}")
+        grid[key.strip()] = [_parse_value(v.strip()) for v in values.split(",") if v.strip()]
+    return grid
+
+
+def _variant_name(assign: Sequence[Tuple[str, object]]) -> str:
+    if not assign:
+        return "base"
+    name = "_".join(f"{k.split('.')[-1]}{v}" for k, v in assign)
+    return re.sub(r"[^A-Za-z0-9_.=-]+", "-", name)
+
+
+def expand_variants(spec: Dict) -> List[Tuple[str, Dict, Dict]]:
+    """(name, profile overrides, swept values) per variant: base?, grid product, explicit variants."""
+    grid: Dict[str, List] = spec.get("grid") or {}
+    out: List[Tuple[str, Dict, Dict]] = []
+    if spec.get("include_base"):
+        out.append(("base", {}, {}))
+    if grid:
+        keys = list(grid)
+        for values in itertools.product(*(grid[k] for k in keys)):
+            assign = list(zip(keys, values))
+            overrides: Dict = {}
+            for k, v in assign:
+                overrides = merge_profile(overrides, _nested(k, v))
+            out.append((_variant_name(assign), overrides, dict(assign)))
+    for i, v in enumerate(spec.get("variants") or []):
+        out.append((str(v.get("name") or f"variant{i}"), v.get("profile") or {}, {}))
+    if not out:
+        raise ValueError("Sweep has no variants (empty grid and no variants)")
+
+    # keep names (and output files) distinct
+    seen: Dict[str, int] = {}
+    unique = []
+    for name, overrides, values in out:
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}_{seen[name]}"
+        else:
+            seen[name] = 0
+        unique.append((name, overrides, values))
+    return unique
+
+
+def build_sweep_jobs(config: dict, spec: Dict) -> Tuple[List[BatchJob], List[Dict], Path]:
+    paths = config["paths"]
+    base = merge_profile(load_profile(config["engine"].get("profile", "")), spec.get("profile"))
+    out_dir = Path(
+        spec.get("output_dir") or Path(paths.get("output", "output")) / f"sweep_{time.strftime('%Y%m%d_%H%M%S')}"
+    )
+    target = str(spec.get("target") or default_target_path(paths))
+    ext = str(spec.get("format", "png")).lower().lstrip(".")
+
+    jobs: List[BatchJob] = []
+    swept: List[Dict] = []
+    for name, overrides, values in expand_variants(spec):
+        profile = merge_profile(base, overrides)
+        jobs.append(BatchJob(name, build_target_match_config(profile, paths, target, str(out_dir / f"{name}.{ext}"))))
+        swept.append(values)
+    return jobs, swept, out_dir
+
+
+# ---------- report ----------
+def _table_rows(records: List[Dict], swept: Dict[str, Dict]) -> Tuple[List[str], List[List[str]]]:
+    params = sorted({k for values in swept.values() for k in values})
+    header = ["variant", *params, "ok", "latency_s", *_TABLE_STATS, *(f"{s}_ms" for s in _TABLE_STAGES), "cache_hits"]
+    rows = []
+    for r in records:
+        stats = r.get("stats", {})
+        stages = r.get("stages", {})
+        rows.append(
+            [
+                r["name"],
+                *(str(swept[r["name"]].get(p, "")) for p in params),
+                "yes" if r["ok"] else "FAILED",
+                f"{r['latency_s']:.2f}",
+                *(str(stats.get(k, "")) for k in _TABLE_STATS),
+                *(f"{stages[s]['wall_ms']:.0f}" if s in stages else "" for s in _TABLE_STAGES),
+                str(stats.get("stage_cache_hits", "")),
+            ]
+        )
+    return header, rows
+
+
+def write_contact_sheet(records: List[Dict], path: Path, thumb_w: int = SHEET_THUMB_W) -> Path | None:
+    """Thumbnails of the rendered variants on a grid, each labelled with its name and key stats."""
+    thumbs = []
+    for r in records:
+        if not r["ok"] or not Path(r["output"]).exists():
+            continue
+        with Image.open(r["output"]) as im:
+            im.draft("RGB", (thumb_w, thumb_w))
+            im = im.convert("RGB")
+            im.thumbnail((thumb_w, thumb_w * 4), Image.BILINEAR)
+            stats = r.get("stats", {})
+            label = f"{r['name']}  repeat={stats.get('max_center_repeat', '?')}  {r['latency_s']:.1f}s"
+            thumbs.append((im.copy(), label))
+    if not thumbs:
+        return None
+
+    label_h = 18
+    cell_w = thumb_w
+    cell_h = max(t.height for t, _ in thumbs) + label_h
+    cols = min(len(thumbs), 4)
+    rows = (len(thumbs) + cols - 1) // cols
+    sheet = Image.new("RGB", (cols * cell_w, rows * cell_h), (24, 24, 24))
+    draw = ImageDraw.Draw(sheet)
+    for i, (thumb, label) in enumerate(thumbs):
+        x, y = (i % cols) * cell_w, (i // cols) * cell_h
+        sheet.paste(thumb, (x + (cell_w - thumb.width) // 2, y))
+        draw.text((x + 4, y + cell_h - label_h + 3), label, fill=(235, 235, 235))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    sheet.save(path, quality=90)
+    return path
+
+
+def load_sweep_spec(spec_path: str | Path | None, vary: Sequence[str] = ()) -> Dict:
+    spec: Dict = json.loads(Path(spec_path).read_text(encoding="utf-8")) if spec_path else {}
+    if vary:
+        spec["grid"] = {**(spec.get("grid") or {}), **parse_vary(vary)}
+    return spec
+
+
+def run_sweep(config: dict, spec: Dict, workers: int = 0) -> List[Dict]:
+    """
+    Render every variant of the sweep against one target; nothing under engine/ is modified.
+    workers: 0/1 = in-process, N = process pool of N, -1 = one per CPU.
+    """
+    jobs, swept_list, out_dir = build_sweep_jobs(config, spec)
+    swept = {job.name: values for job, values in zip(jobs, swept_list)}
+    out_dir.mkdir(parents=True, exist_ok=True)
+    cache_dir = str(Path(config["paths"].get("output", "output")))
+    (out_dir / "sweep.json").write_text(json.dumps(spec, indent=1), encoding="utf-8")
+
+    print("=" * 50)
+    print(f"[SWEEP] {len(jobs)} variants of {jobs[0].cfg.target_path} -> {out_dir}")
+    t0 = time.perf_counter()
+    print(f"[SWEEP] tile pools warm: {warm_pools(jobs, cache_dir)} in {time.perf_counter() - t0:.2f}s")
+
+    workers = (os.cpu_count() or 1) if workers < 0 else int(workers)
+    workers = max(1, min(workers, len(jobs)))
+
+    records: List[Dict] = []
+    t_render = time.perf_counter()
+    with open(out_dir / "stats.jsonl", "w", encoding="utf-8") as f:
+
+        def consume(record: Dict) -> None:
+            records.append(record)
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            status = "ok" if record["ok"] else f"FAILED ({record['error']})"
+            print(f"[SWEEP] {len(records)}/{len(jobs)} {record['name']} {record['latency_s']:.2f}s {status}")
+
+        render_jobs(jobs, cache_dir, workers, consume)
+    wall = time.perf_counter() - t_render
+
+    # table + sheet in variant order, whatever order the pool finished in
+    order = {job.name: i for i, job in enumerate(jobs)}
+    records.sort(key=lambda r: order[r["name"]])
+    header, rows = _table_rows(records, swept)
+    with open(out_dir / "sweep.csv", "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+    widths = [max(len(h), *(len(r[i]) for r in rows)) for i, h in enumerate(header)]
+    print("-" * 50)
+    for line in [header, *rows]:
+        print("[SWEEP] " + "  ".join(c.ljust(w) for c, w in zip(line, widths)))
+
+    sheet = write_contact_sheet(records, out_dir / "contact_sheet.jpg")
+    print("-" * 50)
+    print(f"[SWEEP] done {sum(r['ok'] for r in records)}/{len(jobs)} in {wall:.2f}s workers={workers}")
+    if sheet is not None:
+        print(f"[SWEEP] contact sheet -> {sheet}")
+    print(f"[SWEEP] table -> {out_dir / 'sweep.csv'}")
+    return records
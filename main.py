@@ -1,8 +1,38 @@
+import argparse
+
 from configs.default import CONFIG
 from engine.bootstrap import run
 
 def main():
-    run(CONFIG)
+    parser = argparse.ArgumentParser(description="ZEN'KO Mozaic Engine")
+    parser.add_argument("--batch", metavar="MANIFEST", help="render every target of a JSON manifest with one warm tile pool")
+    parser.add_argument("--workers", type=int, default=0, help="batch / sweep worker processes (0 = in-process, -1 = one per CPU)")
+    parser.add_argument("--sweep", nargs="?", const="", metavar="SPEC", help="render profile variants (JSON spec and/or --vary) side by side")
+    parser.add_argument("--vary", action="append", default=[], metavar="KEY=V1,V2", help="sweep a dotted profile key, e.g. a4_blend.alpha_center=0.7,0.8")
+    parser.add_argument("--serve", action="store_true", help="run the render daemon (local HTTP / Unix-socket job API)")
+    parser.add_argument("--port", type=int, default=8765, help="daemon TCP port on 127.0.0.1 (0 = none)")
+    parser.add_argument("--socket", default=None, help="daemon Unix socket path")
+    parser.add_argument("--concurrency", type=int, default=1, help="daemon renders running at once")
+    parser.add_argument("--trace", metavar="PATH", help="also write a Chrome trace (chrome://tracing / Perfetto)")
+    parser.add_argument("--profile", action="store_true", help="run the hot stages under cProfile (listed in the run report)")
+    args = parser.parse_args()
+
+    if args.serve:
+        from engine.daemon import DaemonConfig, run_daemon
+
+        run_daemon(CONFIG, DaemonConfig(port=args.port, unix_socket=args.socket, concurrency=args.concurrency))
+        return
+    if args.sweep is not None or args.vary:
+        from engine.sweep import load_sweep_spec, run_sweep
+
+        run_sweep(CONFIG, load_sweep_spec(args.sweep or None, args.vary), workers=args.workers)
+        return
+    if args.batch:
+        from engine.batch import run_batch
+
+        run_batch(CONFIG, args.batch, workers=args.workers)
+        return
+    run(CONFIG, trace_path=args.trace, profile=args.profile)
 
 if __name__ == "__main__":
     main()